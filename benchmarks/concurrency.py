@@ -0,0 +1,197 @@
+"""
+    Curry
+    ~~~~~
+
+    Benchmark: concurrent lookups through one shared Provider
+
+    Shares one `Provider` between a growing number of threads doing
+    warm cache lookups, while a writer thread keeps saving new exchange
+    rates and switching the API provider back and forth. Reports the
+    lookup throughput per thread count, and fails if any lookup raised
+    or returned an invalid rate.
+
+    Reads take no lock, so throughput should grow with the number of
+    threads as far as the interpreter lets Python code run in parallel:
+    on a free-threaded build it scales with the cores, while with the
+    GIL it should hold steady rather than drop as threads are added.
+
+    Usage: python3 benchmarks/concurrency.py [-t THREADS,...]
+                                             [-s SECONDS] [--json]
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import threading
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+PAIR_API = 'finance.yahoo.com'
+TABLE_API = 'openexchangerates.org'
+PAIRS = [('EUR', 'USD'), ('USD', 'NOK'), ('GBP', 'SEK'), ('JPY', 'DKK')]
+RATES = [1.25, 1.5, 1.75, 2.0]
+
+
+def seed(rate_index):
+    """Save the rate of every pair at one of the RATES, as a writer."""
+    from curry.api import Provider
+    provider = Provider(api=PAIR_API)
+    rate = RATES[rate_index % len(RATES)]
+    provider.api.save_cache_many({pair: rate for pair in PAIRS})
+
+
+def measure(provider, threads, seconds, errors):
+    """Run lookups from a number of threads for some seconds.
+
+    :returns: the number of lookups done.
+    """
+    done = []
+    stop = threading.Event()
+    barrier = threading.Barrier(threads + 1)
+
+    def reader(offset):
+        count = 0
+        barrier.wait()
+        while not stop.is_set():
+            transaction, payment = PAIRS[(count + offset) % len(PAIRS)]
+            try:
+                rate = provider.get_exchange_rate(transaction, payment)
+            except Exception as e:
+                errors.append(repr(e))
+            else:
+                # The API provider may be switched at any time, so a
+                # lookup gets either a seeded rate or a table rate.
+                if not isinstance(rate, float) or rate <= 0:
+                    errors.append('bad rate: {!r}'.format(rate))
+            count += 1
+        done.append(count)
+
+    workers = [threading.Thread(target=reader, args=(i,))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(done)
+
+
+def run(thread_counts, seconds):
+    """Run the benchmark.
+
+    :param thread_counts: the numbers of reader threads to measure.
+    :param seconds: how long to measure each thread count.
+
+    :returns: a dictionary with the results.
+    """
+    sys.path.insert(0, here)
+    import stubs
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    result = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'gil': gil,
+        'cpus': os.cpu_count(),
+        'seconds': seconds,
+        'threads': {},
+    }
+
+    with tempfile.TemporaryDirectory() as home:
+        # The cache and config paths are set when curry is imported.
+        os.environ['HOME'] = home
+        os.environ['XDG_CONFIG_HOME'] = os.path.join(home, '.config')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(home, '.cache')
+        from curry.api import Provider, Providers, _load_api_provider
+
+        with stubs.StubServer() as stub:
+            stub.patch(*(_load_api_provider(Providers[api])['klass']
+                         for api in (PAIR_API, TABLE_API)))
+            seed(0)
+            provider = Provider(api=PAIR_API)
+            # Fetch the rate table once, so later lookups are warm.
+            Provider(api=TABLE_API, api_key='x').get_exchange_rate('EUR',
+                                                                   'USD')
+
+            errors = []
+            stop = threading.Event()
+
+            def writer():
+                i = 0
+                while not stop.wait(0.01):
+                    i += 1
+                    seed(i)
+                    if i % 10 == 0:
+                        provider.use_api(api=TABLE_API if i % 20 == 0
+                                         else PAIR_API, api_key='x')
+
+            base = None
+            for threads in thread_counts:
+                stop.clear()
+                writing = threading.Thread(target=writer)
+                writing.start()
+                try:
+                    lookups = measure(provider, threads, seconds, errors)
+                finally:
+                    stop.set()
+                    writing.join()
+                rate = lookups / seconds
+                base = base or rate / threads
+                result['threads'][threads] = {
+                    'lookups_per_second': round(rate),
+                    'per_thread': round(rate / threads),
+                    'scaling': round(rate / base, 2),
+                }
+                log('{:>3} threads: {:>9.0f} lookups/s, {:.2f}x'
+                    .format(threads, rate, rate / base))
+
+            result['requests'] = stub.requests
+            result['errors'] = errors[:10]
+            result['error_count'] = len(errors)
+    return result
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stress one shared '
+                                     'Provider with concurrent lookups')
+    parser.add_argument('-t', '--threads',
+                        type=lambda s: [int(n) for n in s.split(',')],
+                        default=[1, 2, 4, 8], metavar='N,...',
+                        help='the reader thread counts to measure '
+                        '(default: 1,2,4,8)')
+    parser.add_argument('-s', '--seconds', type=float, default=2,
+                        help='how long to measure each thread count '
+                        '(default: 2)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    result = run(args.threads, args.seconds)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        log('python {}, {} cpus, GIL {}'.format(
+            result['python'], result['cpus'],
+            'enabled' if result['gil'] else 'disabled'))
+    if result['error_count']:
+        log('{} lookups failed, e.g.:'.format(result['error_count']))
+        for error in result['errors']:
+            log('  ' + error)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
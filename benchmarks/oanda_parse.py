@@ -0,0 +1,96 @@
+"""
+    Curry
+    ~~~~~
+
+    Benchmark: parsing saved Oanda currency table pages
+
+    Compares the streaming parser with the BeautifulSoup fallback on the
+    fixture pages in benchmarks/fixtures/oanda*.html, and checks that
+    both produce the same rates.
+
+    Usage: python3 benchmarks/oanda_parse.py [-n RUNS] [--json]
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from curry.api.providers.oanda import Oanda  # noqa: E402
+
+
+def fixtures():
+    return sorted(glob.glob(os.path.join(here, 'fixtures', 'oanda*.html')))
+
+
+def best_of(func, runs):
+    """The best time per call in ms, out of a few repeats."""
+    times = timeit.repeat(func, number=runs, repeat=3)
+    return min(times) / runs * 1000
+
+
+def run(runs=50):
+    """Run the benchmark.
+
+    :param runs: the number of parses per measurement.
+
+    :returns: a list with a result dictionary per fixture page.
+    """
+    oanda = Oanda.__new__(Oanda)
+    results = []
+    for path in fixtures():
+        with open(path, 'rb') as f:
+            html = f.read()
+
+        def fast():
+            return oanda._parse_csv(oanda._extract_csv(html))
+
+        def soup():
+            return oanda._parse_csv(oanda._extract_csv_with_soup(html))
+
+        assert fast() == soup(), 'parsers disagree on {}'.format(path)
+
+        fast_ms, soup_ms = best_of(fast, runs), best_of(soup, runs)
+        results.append({
+            'fixture': os.path.basename(path),
+            'bytes': len(html),
+            'currencies': len(fast()[0]),
+            'streaming_ms': round(fast_ms, 4),
+            'beautifulsoup_ms': round(soup_ms, 4),
+            'speedup': round(soup_ms / fast_ms, 1),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark parsing of '
+                                     'Oanda currency table pages')
+    parser.add_argument('-n', '--runs', type=int, default=50,
+                        help='the number of parses per measurement '
+                        '(default: 50)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for r in results:
+        print('{fixture}: {bytes} bytes, {currencies} currencies'.format(**r))
+        print('  streaming:     {streaming_ms:8.3f} ms'.format(**r))
+        print('  BeautifulSoup: {beautifulsoup_ms:8.3f} ms'.format(**r))
+        print('  speedup:       {speedup:8.1f}x'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+    Curry
+    ~~~~~
+
+    Benchmark: command-line startup time with a warm cache
+
+    Runs `curry EUR USD` in fresh interpreters against a temporary,
+    pre-filled cache, and reports the wall time next to the time of a
+    bare interpreter. Also reports which heavy modules got imported.
+
+    Usage: python3 benchmarks/startup.py [-n RUNS] [--json]
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+HEAVY_MODULES = ['requests', 'urllib3', 'bs4', 'lxml', 'numpy']
+
+SEED = '''
+import time
+from curry.api.cache import get_cache_backend
+get_cache_backend().update('finance.yahoo.com', {
+    'EUR': {'USD': {'rate': 1.25, 'timestamp': time.time()}},
+})
+'''
+
+RUN = '''
+import sys
+sys.argv = ['curry', 'EUR', 'USD']
+import curry.cli
+curry.cli.main()
+'''
+
+MODULES = RUN + '''
+print(','.join(m for m in {!r} if m in sys.modules), file=sys.stderr)
+'''.format(HEAVY_MODULES)
+
+
+def environment(home):
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['XDG_CONFIG_HOME'] = os.path.join(home, '.config')
+    env['XDG_CACHE_HOME'] = os.path.join(home, '.cache')
+    env['PYTHONPATH'] = root
+    # Measure with byte-compiled modules, as in an installed curry.
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def timed_runs(code, env, runs):
+    """Run code in fresh interpreters, returning wall times in ms."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def summary(times):
+    return {
+        'min_ms': round(min(times), 2),
+        'median_ms': round(statistics.median(times), 2),
+        'max_ms': round(max(times), 2),
+    }
+
+
+def run(runs=20):
+    """Run the benchmark.
+
+    :param runs: the number of interpreters to start per measurement.
+
+    :returns: a dictionary with the results.
+    """
+    with tempfile.TemporaryDirectory() as home:
+        env = environment(home)
+        subprocess.run([sys.executable, '-c', SEED], env=env, check=True)
+        # Warm up the OS page cache and the byte-code cache.
+        timed_runs(RUN, env, 1)
+
+        baseline = timed_runs('pass', env, runs)
+        warm = timed_runs(RUN, env, runs)
+
+        p = subprocess.run([sys.executable, '-c', MODULES], env=env,
+                           check=True, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE, universal_newlines=True)
+        imported = [m for m in p.stderr.strip().split(',') if m]
+
+    result = {
+        'runs': runs,
+        'interpreter': summary(baseline),
+        'warm_cache': summary(warm),
+        'overhead_ms': round(statistics.median(warm) -
+                             statistics.median(baseline), 2),
+        'heavy_modules_imported': imported,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the startup '
+                                     'time of "curry EUR USD"')
+    parser.add_argument('-n', '--runs', type=int, default=20,
+                        help='the number of runs (default: 20)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    result = run(args.runs)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print('interpreter:  {median_ms:8.2f} ms (median)'
+          .format(**result['interpreter']))
+    print('curry EUR USD:{median_ms:8.2f} ms (median)'
+          .format(**result['warm_cache']))
+    print('overhead:     {:8.2f} ms'.format(result['overhead_ms']))
+    print('heavy modules imported: {}'
+          .format(', '.join(result['heavy_modules_imported']) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+    Curry
+    ~~~~~
+
+    Local stub servers for the API providers
+
+    A threaded HTTP server on localhost that answers like every API
+    provider, replaying the recorded responses in benchmarks/fixtures:
+    the openexchangerates.org rate table (with ETag and 304 support),
+    the Oanda currency table page, and per-pair quotes for Yahoo,
+    rate-exchange and exchangerate-api derived from the same rates.
+
+    The API provider classes are pointed at the server by rewriting
+    their urls, so each provider is served below a path named after its
+    original host, e.g. /openexchangerates.org/api/latest.json.
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+here = os.path.dirname(os.path.abspath(__file__))
+fixtures = os.path.join(here, 'fixtures')
+
+ETAG = '"7f3a2c1e"'
+LAST_MODIFIED = 'Fri, 24 Oct 2014 12:00:00 GMT'
+
+_url_re = re.compile(r'^https?://([^/]+)')
+
+
+def read_fixture(name):
+    with open(os.path.join(fixtures, name), 'rb') as f:
+        return f.read()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        if stub.latency:
+            time.sleep(stub.latency)
+        stub.count(self.path)
+
+        url = urlsplit(self.path)
+        host, _, path = url.path.lstrip('/').partition('/')
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        route = stub.routes.get(host)
+        if route is None:
+            return self.reply(404, b'Not found')
+        route(self, '/' + path, query)
+
+    def reply(self, status, body, content_type='text/plain', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer:
+    """Serves every API provider from localhost.
+
+    :param latency: seconds to sleep before answering a request, to
+        simulate the network round trip.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+
+        self.table = read_fixture('openexchangerates.json')
+        self.rates = json.loads(self.table.decode('utf-8'))['rates']
+        self.oanda = read_fixture('oanda.html')
+
+        self.routes = {
+            'download.finance.yahoo.com': self.yahoo,
+            'rate-exchange.appspot.com': self.rate_exchange,
+            'www.exchangerate-api.com': self.exchangerate_api,
+            'openexchangerates.org': self.openexchangerates,
+            'www.oanda.com': self.oanda_table,
+        }
+
+        self.server = _Server(('127.0.0.1', 0), StubHandler)
+        self.server.stub = self
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name='curry-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, path):
+        host = path.lstrip('/').split('/', 1)[0]
+        with self._lock:
+            self.requests[host] = self.requests.get(host, 0) + 1
+
+    def rate(self, transaction, payment):
+        try:
+            return self.rates[payment] / self.rates[transaction]
+        except KeyError:
+            return None
+
+    def patch(self, *klasses):
+        """Point API provider classes at this server, by rewriting the
+        host of their url class attributes."""
+        for klass in klasses:
+            for attr in dir(klass):
+                url = getattr(klass, attr)
+                if attr.endswith('url') and isinstance(url, str):
+                    setattr(klass, attr, _url_re.sub(
+                        lambda m: '{}/{}'.format(self.url, m.group(1)), url))
+
+    # Routes, called with the handler, the path below the host and the
+    # query parameters.
+
+    def yahoo(self, handler, path, query):
+        symbols = query.get('s', '').split(',')
+        lines = []
+        for symbol in symbols:
+            pair = symbol[:-2] if symbol.endswith('=X') else symbol
+            rate = self.rate(pair[:3], pair[3:])
+            if query.get('f') == 'sl1':
+                lines.append('"{}",{}'.format(symbol, rate or 'N/A'))
+            else:
+                lines.append('{:.4f}'.format(rate) if rate else 'N/A')
+        handler.reply(200, '\n'.join(lines).encode('ascii') + b'\n',
+                      'application/octet-stream')
+
+    def rate_exchange(self, handler, path, query):
+        transaction, payment = query.get('from'), query.get('to')
+        rate = self.rate(transaction, payment)
+        if rate is None:
+            body = {'err': 'failed to parse response from xe.com.'}
+        else:
+            body = {'to': payment, 'rate': rate, 'from': transaction}
+        handler.reply(200, json.dumps(body).encode('utf-8'),
+                      'application/json')
+
+    def exchangerate_api(self, handler, path, query):
+        transaction, payment = path.strip('/').split('/')[:2]
+        rate = self.rate(transaction, payment)
+        body = '{:.6f}'.format(rate) if rate else '-2'
+        handler.reply(200, body.encode('ascii'))
+
+    def openexchangerates(self, handler, path, query):
+        if not query.get('app_id'):
+            body = json.dumps({'error': True, 'status': 401,
+                               'message': 'missing_app_id'})
+            return handler.reply(401, body.encode('utf-8'),
+                                 'application/json')
+        headers = {'ETag': ETAG, 'Last-Modified': LAST_MODIFIED}
+        if handler.headers.get('If-None-Match') == ETAG:
+            return handler.reply(304, b'', headers=headers)
+        handler.reply(200, self.table, 'application/json', headers)
+
+    def oanda_table(self, handler, path, query):
+        handler.reply(200, self.oanda, 'text/html; charset=utf-8')
@@ -0,0 +1,351 @@
+"""
+    Curry
+    ~~~~~
+
+    Benchmark suite, run offline against local stub servers
+
+    Measures, for every API provider, the latency of a lookup with a
+    cold (empty), warm and expired cache, and the throughput of
+    `Provider.get_exchange_rate` with a warm cache. Also measures how
+    the cost of loading, saving and looking up the cache grows with its
+    size for each cache backend, and includes the command-line startup
+    and Oanda parser benchmarks. All requests go to the stub servers in
+    benchmarks/stubs.py, with a temporary HOME, so nothing touches the
+    network or the user's config and cache.
+
+    Usage: python3 benchmarks/suite.py [-n RUNS] [--latency MS]
+                                       [--only NAME,...] [--json]
+                                       [-o FILE]
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+PROVIDERS = [
+    'finance.yahoo.com',
+    'rate-exchange.appspot.com',
+    'exchangerate-api.com',
+    'openexchangerates.org',
+    'oanda.com',
+]
+
+PAIRS = [
+    ('EUR', 'USD'), ('USD', 'NOK'), ('GBP', 'JPY'), ('SEK', 'DKK'),
+    ('CHF', 'EUR'), ('AUD', 'NZD'), ('CAD', 'MXN'), ('CNY', 'HKD'),
+]
+
+CACHE_SIZES = [10, 100, 1000, 10000]
+
+BENCHMARKS = ['lookups', 'throughput', 'cache', 'startup', 'oanda_parse']
+
+
+def summary(times):
+    """Summarize timings, given in seconds, in ms."""
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))]
+    return {
+        'runs': len(times),
+        'min_ms': round(min(times) * 1000, 4),
+        'median_ms': round(statistics.median(times) * 1000, 4),
+        'mean_ms': round(statistics.mean(times) * 1000, 4),
+        'p95_ms': round(p95 * 1000, 4),
+    }
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+class Environment:
+    """Points every API provider at a stub server, and gives each
+    measurement a cache database, and rate table snapshots, of its own.
+
+    :param stub: a running `stubs.StubServer`.
+    :param directory: a directory for the cache databases and
+        snapshots.
+    """
+
+    def __init__(self, stub, directory):
+        from curry.api import get_api_provider
+
+        self.stub = stub
+        self.directory = directory
+        self._caches = 0
+        stub.patch(*[get_api_provider(api)['klass'] for api in PROVIDERS])
+
+    def new_cache(self):
+        from curry.api.cache import SQLiteCache, MemoryCache
+
+        self._caches += 1
+        path = os.path.join(self.directory,
+                            'cache{}.sqlite'.format(self._caches))
+        return MemoryCache(SQLiteCache(path), ttl=60)
+
+    def new_provider(self, api, cache=None):
+        """Create a `Provider` for an API provider, using a new, empty
+        cache unless one is given."""
+        from curry.api import Provider
+
+        provider = Provider(api=api, api_key='benchmark')
+        provider.api.cache_backend = cache or self.new_cache()
+        provider.api.snapshot_dir = os.path.join(
+            self.directory, 'snapshots{}'.format(self._caches))
+        return provider
+
+    def expire(self, provider):
+        """Make every entry in the cache of a provider expired, and
+        remove the snapshot of its rate table."""
+        from curry.api.snapshot import snapshot_path
+
+        api = provider.api
+        cache = api.cache_backend.load(api.id_)
+        if 'base' in cache:
+            cache['timestamp'] = 0
+            api.cache_backend.replace(api.id_, cache)
+            try:
+                os.remove(snapshot_path(api.id_, api.snapshot_dir))
+            except FileNotFoundError:
+                pass
+        else:
+            for payments in cache.values():
+                for entry in payments.values():
+                    entry['timestamp'] = 0
+            api.cache_backend.update(api.id_, cache)
+
+
+def bench_lookups(env, runs):
+    """Latency of a single lookup per API provider, with a cold, warm
+    and expired cache. A cold lookup fetches into an empty cache, and
+    an expired lookup refreshes a cache whose entries have expired,
+    which for openexchangerates.org is a conditional request answered
+    with 304 Not Modified.
+    """
+    results = {}
+    for api in PROVIDERS:
+        pair = PAIRS[0]
+        result = {}
+
+        before = env.stub.requests.copy()
+        cold = []
+        for _ in range(runs):
+            provider = env.new_provider(api)
+            cold.append(timed(lambda: provider.get_exchange_rate(*pair)))
+        result['cold'] = summary(cold)
+
+        provider = env.new_provider(api)
+        provider.get_exchange_rate(*pair)
+        warm = [timed(lambda: provider.get_exchange_rate(*pair))
+                for _ in range(runs * 10)]
+        result['warm'] = summary(warm)
+
+        expired = []
+        for _ in range(runs):
+            env.expire(provider)
+            expired.append(timed(lambda: provider.get_exchange_rate(*pair)))
+        result['expired'] = summary(expired)
+
+        result['requests'] = sum(env.stub.requests.values()) - \
+            sum(before.values())
+        results[api] = result
+    return results
+
+
+def bench_throughput(env, runs):
+    """Lookups per second through `Provider.get_exchange_rate`, with a
+    warm cache, cycling through a set of currency pairs."""
+    from curry.api.metrics import metrics
+
+    results = {}
+    calls = runs * 500
+    for api in PROVIDERS:
+        provider = env.new_provider(api)
+        for pair in PAIRS:
+            provider.get_exchange_rate(*pair)
+
+        metrics.reset()
+        start = time.perf_counter()
+        for i in range(calls):
+            provider.get_exchange_rate(*PAIRS[i % len(PAIRS)])
+        seconds = time.perf_counter() - start
+
+        results[api] = {
+            'calls': calls,
+            'lookups_per_second': round(calls / seconds),
+            'us_per_lookup': round(seconds / calls * 1e6, 3),
+            'requests': metrics.snapshot().get(api, {})
+                               .get('requests', {}).get('count', 0),
+        }
+    return results
+
+
+def bench_cache(env, runs):
+    """The cost of each cache backend as the cache grows: loading the
+    whole cache, looking up one pair, and saving one pair into a cache
+    of a given number of entries."""
+    from curry.api.cache import JSONCache, SQLiteCache
+    from curry.api.providers.oanda import currencies
+
+    pairs = [(t, p) for t in currencies for p in currencies if t != p]
+    timestamp = time.time()
+    results = {}
+    for name in ('json', 'sqlite'):
+        results[name] = {}
+        for size in CACHE_SIZES:
+            directory = tempfile.mkdtemp(dir=env.directory)
+            if name == 'json':
+                backend = JSONCache(directory)
+            else:
+                backend = SQLiteCache(os.path.join(directory, 'cache.sqlite'))
+
+            entries = {}
+            for t, p in pairs[:size]:
+                entries.setdefault(t, {})[p] = {'rate': 1.0,
+                                                'timestamp': timestamp}
+            backend.update('benchmark', entries)
+
+            t, p = pairs[size // 2]
+            extra = {'rate': 2.0, 'timestamp': timestamp}
+            results[name][str(size)] = {
+                'file_bytes': sum(os.path.getsize(os.path.join(directory, f))
+                                  for f in os.listdir(directory)),
+                'load': summary([timed(lambda: backend.load('benchmark'))
+                                 for _ in range(runs)]),
+                'get': summary([timed(lambda: backend.get('benchmark', t, p))
+                                for _ in range(runs)]),
+                'save_one': summary([
+                    timed(lambda: backend.update('benchmark',
+                                                 {t: {p: extra}}))
+                    for _ in range(runs)]),
+            }
+            backend.close()
+    return results
+
+
+def bench_startup(env, runs):
+    """Command-line startup time, see benchmarks/startup.py."""
+    import startup
+    return startup.run(runs)
+
+
+def bench_oanda_parse(env, runs):
+    """Oanda page parsing, see benchmarks/oanda_parse.py."""
+    import oanda_parse
+    return oanda_parse.run(runs)
+
+
+def run(runs=20, latency=0, only=None):
+    """Run the benchmark suite.
+
+    :param runs: the number of repetitions per measurement.
+    :param latency: seconds the stub servers wait before answering.
+    :param only: a list of benchmark names to run, default all.
+
+    :returns: a dictionary with the results.
+    """
+    import stubs
+
+    result = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': runs,
+        'stub_latency_ms': latency * 1000,
+    }
+
+    with tempfile.TemporaryDirectory() as home:
+        # The cache and config paths are set when curry is imported.
+        os.environ['HOME'] = home
+        os.environ['XDG_CONFIG_HOME'] = os.path.join(home, '.config')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(home, '.cache')
+        import curry
+        result['curry'] = curry.version
+
+        with stubs.StubServer(latency=latency) as stub:
+            env = Environment(stub, home)
+            for name in only or BENCHMARKS:
+                log('Running {} ...'.format(name))
+                result[name] = globals()['bench_' + name](env, runs)
+
+    return result
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run the benchmark suite '
+                                     'against local stub servers')
+    parser.add_argument('-n', '--runs', type=int, default=20,
+                        help='the number of repetitions per measurement '
+                        '(default: 20)')
+    parser.add_argument('--latency', type=float, default=0, metavar='MS',
+                        help='simulated network latency of the stub '
+                        'servers, in ms (default: 0)')
+    parser.add_argument('--only', type=lambda s: s.split(','),
+                        metavar='NAME,...',
+                        help='only run some of the benchmarks: {}'
+                        .format(', '.join(BENCHMARKS)))
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='also write the results as JSON to FILE')
+    args = parser.parse_args()
+
+    for name in args.only or []:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: {}'.format(name))
+
+    logging.basicConfig(level=logging.ERROR)
+    result = run(args.runs, args.latency / 1000, args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    for api, r in sorted(result.get('lookups', {}).items()):
+        print('{}:'.format(api))
+        for state in ('cold', 'warm', 'expired'):
+            print('  {:8} {median_ms:10.3f} ms (median), {p95_ms:10.3f} ms '
+                  '(p95)'.format(state + ':', **r[state]))
+        if api in result.get('throughput', {}):
+            print('  lookups: {lookups_per_second:10d} /s'
+                  .format(**result['throughput'][api]))
+    for name, sizes in sorted(result.get('cache', {}).items()):
+        print('{} cache:'.format(name))
+        for size in map(str, CACHE_SIZES):
+            r = sizes[size]
+            print('  {:>6} entries: load {:9.3f} ms, get {:7.3f} ms, '
+                  'save one {:8.3f} ms'.format(
+                      size, r['load']['median_ms'], r['get']['median_ms'],
+                      r['save_one']['median_ms']))
+    if 'startup' in result:
+        print('startup overhead: {:.2f} ms'
+              .format(result['startup']['overhead_ms']))
+    for r in result.get('oanda_parse', []):
+        print('oanda parse ({fixture}): {streaming_ms:.3f} ms, {speedup}x '
+              'faster than BeautifulSoup'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,12 +9,16 @@
 """
 # TODO:2014-10-23:einar: review use of appropriate log levels
 import os
-import json
+import heapq
 import logging
 import time
-from requests.exceptions import RequestException
-
+import datetime
+import importlib
+import threading
 from curry.config import config
+from curry.api.cache import get_cache_backend
+from curry.api.ttl import adaptive_ttl_enabled
+from curry.api.metrics import metrics
 
 log = logging.getLogger(__name__)
 
@@ -23,11 +27,41 @@ Providers = {}
 
 START_ENUMERATE_ON = 1
 
+FRESH, STALE, EXPIRED = 'fresh', 'stale', 'expired'
+"""The states of cached exchange rates, see `cache_state`."""
+
+DEFAULT_STALE_GRACE = 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_COMPACT_INTERVAL = 60
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_cache_timeouts = None
+_last_used = {}
+_last_compacted = {}
+_http = threading.local()
+
 
 def register_api_provider(api, klass, requires=[]):
+    """Register an API provider.
+
+    :param api: the API provider id.
+    :param klass: the API provider class, or a 'module:Class' string
+        naming it. The module is then only imported once the API
+        provider is used.
+    :param requires: the names of options the API provider requires.
+    """
     Providers[api] = {'klass': klass, 'requires': requires}
 
 
+def _load_api_provider(provider):
+    """Import the class of a lazily registered API provider."""
+    if isinstance(provider['klass'], str):
+        module, name = provider['klass'].split(':')
+        provider['klass'] = getattr(importlib.import_module(module), name)
+    return provider
+
+
 def _emphasis(text):
     """Wrap text in terminal escape codes for bold text."""
     return '\033[1m{}\033[0m'.format(text)
@@ -59,7 +93,81 @@ def get_api_provider(api):
     if api not in Providers:
         raise APIError('Unknown API provider: {}'.format(api))
 
-    return Providers[api]
+    return _load_api_provider(Providers[api])
+
+
+def get_cache_timeout(transaction=None, payment=None):
+    """Get the configured cache_timeout in seconds, or that of a
+    currency pair. The [cache_timeouts] section may set it per pair,
+    e.g. 'EUR/USD = 600', which also applies to USD/EUR, or per
+    currency, e.g. 'JPY = 3600', where the shorter of the two
+    currencies of a pair applies. Other pairs use the cache_timeout.
+    """
+    if transaction is not None:
+        cache_timeout = pair_cache_timeout(transaction, payment)
+        if cache_timeout is not None:
+            return cache_timeout
+    try:
+        return float(config.get('cache_timeout'))
+    except:
+        return config.default_cache_timeout()
+
+
+def pair_cache_timeout(transaction, payment):
+    """Get the cache timeout set for a currency pair, or its currencies,
+    in the [cache_timeouts] section, see `get_cache_timeout`.
+
+    :returns: the cache timeout in seconds, or None if it is not set.
+    """
+    if not has_pair_timeouts():
+        return None
+    for pair in ((transaction, payment), (payment, transaction)):
+        if pair in _cache_timeouts:
+            return _cache_timeouts[pair]
+    timeouts = [_cache_timeouts[code] for code in (transaction, payment)
+                if code in _cache_timeouts]
+    return min(timeouts) if timeouts else None
+
+
+def http_requests_made():
+    """Get the number of HTTP requests the API providers have made
+    from the current thread, e.g. to tell if a lookup was answered from
+    the cache."""
+    return getattr(_http, 'requests', 0)
+
+
+def has_pair_timeouts():
+    """Check if any cache timeouts are set in the [cache_timeouts]
+    section, which is parsed once, on first use."""
+    global _cache_timeouts
+    if _cache_timeouts is None:
+        timeouts = {}
+        for key, value in config.items('cache_timeouts').items():
+            codes = key.upper().replace('/', '')
+            try:
+                timeout = float(value)
+            except ValueError:
+                timeout = None
+            if timeout is None or len(codes) not in (3, 6):
+                log.warning('Ignoring invalid cache timeout: {} = {}'
+                            .format(key, value))
+                continue
+            timeouts[codes if len(codes) == 3 else
+                     (codes[:3], codes[3:])] = timeout
+        _cache_timeouts = timeouts
+    return bool(_cache_timeouts)
+
+
+def entry_cache_timeout(data, transaction, payment):
+    """Get the cache timeout of a cached currency pair: the timeout
+    saved with it, when the 'adaptive_ttl' option is set (see
+    `curry.api.ttl`), and otherwise `get_cache_timeout`.
+
+    :param data: the cache entry of the pair.
+    """
+    if data.get('ttl') and adaptive_ttl_enabled():
+        return data['ttl']
+    return get_cache_timeout(transaction, payment)
 
 
 def cache_has_expired(timestamp):
@@ -70,19 +178,88 @@ def cache_has_expired(timestamp):
 
     :returns: True if the cache has expired, False otherwise.
     """
-    try:
-        cache_timeout = config.get('cache_timeout')
-    except:
-        cache_timeout = config.default_cache_timeout()
+    return timestamp < time.time() - get_cache_timeout()
+
+
+def cache_state(timestamp, cache_timeout=None):
+    """Classify the timestamp of local cache according to the
+    configured cache_timeout and stale-while-revalidate settings:
+
+    - FRESH, if the cache_timeout is not reached.
+    - STALE, if the cache_timeout is reached, but by no more than
+      `stale_grace` seconds, and the cache is no older than
+      `max_stale` seconds (if set). A stale cache may still be used
+      while it is refreshed in the background.
+    - EXPIRED otherwise, or if there is no timestamp.
+
+    :param timestamp: timestamp of the local cache, or None.
+    :param cache_timeout: the cache timeout to use, e.g. of a currency
+        pair, default the cache_timeout.
+    """
+    if not timestamp:
+        return EXPIRED
 
-    return timestamp < time.time() - cache_timeout
+    age = time.time() - timestamp
+    if cache_timeout is None:
+        cache_timeout = get_cache_timeout()
+    if age <= cache_timeout:
+        return FRESH
+
+    stale_grace = float(config.get('stale_grace', DEFAULT_STALE_GRACE))
+    max_stale = float(config.get('max_stale', 0))
+    if age <= cache_timeout + stale_grace and not (max_stale and
+                                                   age > max_stale):
+        return STALE
+
+    return EXPIRED
+
+
+def refresh_in_background(key, func):
+    """Run a cache refresh in a background thread, unless a refresh
+    with the same key is already running in this process. The thread
+    is not a daemon, so the refreshed cache is saved before the
+    process exits.
+
+    :param key: identifies the refresh.
+    :param func: the function doing the refresh.
+
+    :returns: True if a refresh was started, False otherwise.
+    """
+    with _refreshing_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+
+    def run():
+        from curry.api.scheduler import priority, BACKGROUND
+        try:
+            with priority(BACKGROUND):
+                func()
+        except Exception as e:
+            log.warning('Background refresh failed: {}'.format(e))
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    log.info('Refreshing stale cache in the background: {}'.format(key))
+    threading.Thread(target=run, name='curry-refresh').start()
+    return True
 
 
 class Provider:
-    """Main interface for the providers."""
+    """Main interface for the providers.
+
+    A provider can be shared by many threads, e.g. the workers of a web
+    server. Lookups read the API provider and the cached exchange rates
+    without taking a lock: cached rates are kept in snapshots that are
+    never modified, and writers swap in new snapshots one at a time.
+    `use_api` swaps the API provider the same way, so a lookup already
+    running finishes with the API provider it started with.
+    """
 
     def __init__(self, **kwargs):
         self.api = None
+        self._lock = threading.Lock()
         self.use_api(**kwargs)
 
     def use_api(self, **kwargs):
@@ -90,36 +267,77 @@ class Provider:
         api = kwargs.pop('api')
         provider = get_api_provider(api)
 
-        if self.api:
-            log.info('Switching API provider: {} -> {}'
-                     .format(self.api.id_, api))
+        instance = provider['klass'](**kwargs)
+        with self._lock:
+            if self.api:
+                log.info('Switching API provider: {} -> {}'
+                         .format(self.api.id_, api))
+            self.api = instance
 
-        self.api = provider['klass'](**kwargs)
-
-    def get_exchange_rate(self, transaction, payment):
+    def get_exchange_rate(self, transaction, payment, as_of=None):
         """Get the exchange rate for a currency pair (transaction
         currency -> payment currency).
 
         :param transaction: transaction (from) currency.
         :param payment: payment (to) currency.
+        :param as_of: a `datetime.date` to get the historical exchange
+            rate of, default the current exchange rate.
 
         :returns: the exchange rate or raises an APIError.
         """
-        if not self.api:
+        api = self.api
+        if not api:
             raise APIError('No API provider is set!')
 
         transaction, payment = transaction.upper(), payment.upper()
-        log.info('Using API provider: {}'.format(self.api.id_))
+        log.info('Using API provider: {}'.format(api.id_))
 
         rate = -1
         try:
-            rate = self.api.get_exchange_rate(transaction, payment)
+            if as_of is None:
+                rate = api.get_exchange_rate(transaction, payment)
+            else:
+                rate = api.get_historical_exchange_rate(
+                    transaction, payment, as_of)
         # XXX:2014-10-22:einar: do HTTP error handling more granular?
-        except RequestException as e:
+        except RequestError as e:
             log.error(e)
 
         return rate
 
+    def backfill(self, start, end):
+        """Fetch the historical exchange rates of every date between
+        start and end (inclusive) missing from the history. Only API
+        providers that fetch rates by date support this.
+
+        :param start: the first `datetime.date`.
+        :param end: the last `datetime.date`.
+
+        :returns: the number of dates fetched, or raises an APIError.
+        """
+        api = self.api
+        if not api:
+            raise APIError('No API provider is set!')
+        return api.backfill(start, end)
+
+    def get_rate_matrix(self):
+        """Get a cross-rate matrix of all currencies known by the API
+        provider, for vectorized conversions. Requires NumPy, and an API
+        provider that fetches all exchange rates relative to a base
+        currency.
+
+        :returns: a `curry.api.matrix.RateMatrix`, or raises an
+            APIError.
+        """
+        api = self.api
+        if not api:
+            raise APIError('No API provider is set!')
+
+        if not isinstance(api, RateTableProvider):
+            raise APIError('Rate matrix not supported', api.id_)
+
+        return api.get_rate_matrix()
+
 
 class APIError(Exception):
     """Common exception class for all API errors."""
@@ -134,16 +352,141 @@ class APIError(Exception):
         return 'APIError: {}'.format(self.message)
 
 
+class RequestError(APIError):
+    """Raised when an HTTP request to an API provider fails, e.g. on
+    connection errors and timeouts."""
+
+
+class RateLimitError(RequestError):
+    """Raised when a request is held back by the rate limit of an API
+    provider for longer than allowed. See `curry.api.scheduler`."""
+
+
 class APIProvider:
     """Super class for API providers."""
 
     def __init__(self, api_key=None, refresh_cache=False):
         self.api_key = api_key
         self.cache = {}
+        self.cache_backend = get_cache_backend()
         self.refresh_cache = refresh_cache
+        self._compacted = None
 
     def get_exchange_rate(self, transaction, payment):
-        """Must be implemented in every subclass."""
+        """Get the exchange rate for a currency pair (transaction
+        currency -> payment currency). Generic implementation for API
+        providers where a request is needed for every currency pair:
+        the cache is tried first, then triangulation over the other
+        cached rates, and otherwise the rate is fetched with
+        `fetch_exchange_rate` and saved to the cache.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        rate = self.get_exchange_rate_from_cache(transaction, payment)
+        if not rate:
+            rate = self.triangulate(transaction, payment)
+
+        # If rate is None here the exchange rate was either not cached
+        # or its timestamp was too old, and could not be derived from
+        # other cached rates, therefor we need to do a request for an
+        # up-to-date exchange rate. Concurrent callers in this and other
+        # processes share the request, see `curry.api.flight`.
+        if not rate:
+            from curry.api.flight import single_flight
+            started = time.time()
+
+            def fetch():
+                rate = self.fetch_exchange_rate(transaction, payment)
+                self.save_cache(transaction, payment, rate)
+                return rate
+
+            rate = single_flight(
+                (self.id_, transaction, payment), fetch,
+                lambda: self._rate_saved_since(transaction, payment, started))
+
+        return rate
+
+    def _rate_saved_since(self, transaction, payment, since):
+        """Get the cached exchange rate for a currency pair, if it was
+        saved after a point in time, e.g. by another process.
+
+        :returns: the exchange rate, or None.
+        """
+        data = self.cache_backend.get(self.id_, transaction, payment)
+        if data and (data.get('timestamp') or 0) >= since:
+            return data.get('rate')
+        return None
+
+    def fetch_exchange_rate(self, transaction, payment):
+        """Request the exchange rate for a currency pair from the API,
+        bypassing the cache. Must be implemented in every subclass that
+        relies on the generic `get_exchange_rate`.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        raise NotImplementedError
+
+    def get_exchange_rates(self, pairs):
+        """Get the exchange rates for many currency pairs. The cache is
+        loaded once, the missing pairs are fetched with as few requests
+        as the API provider allows, and saved with a single write.
+
+        :param pairs: an iterable of (transaction, payment) tuples.
+
+        :returns: a dictionary mapping the pairs to exchange rates, or
+            raises an APIError, after caching the rates that were
+            fetched, if some pairs have no exchange rate.
+        """
+        pairs = list(dict.fromkeys(pairs))
+        rates = self.get_exchange_rates_from_cache(pairs)
+
+        for pair in pairs:
+            if pair not in rates:
+                rate = self.triangulate(*pair)
+                if rate:
+                    rates[pair] = rate
+
+        missing = [pair for pair in pairs if pair not in rates]
+        if missing:
+            fetched = self.fetch_exchange_rates(missing)
+            self.save_cache_many(fetched)
+            rates.update(fetched)
+            failed = [pair for pair in missing if pair not in fetched]
+            if failed:
+                raise APIError('No exchange rate for {}'.format(', '.join(
+                    '{}/{}'.format(*pair) for pair in failed)), self.id_)
+
+        return rates
+
+    def fetch_exchange_rates(self, pairs):
+        """Request the exchange rates for many currency pairs from the
+        API, bypassing the cache. API providers that can quote several
+        pairs in one request should override this, and `chunk_pairs`.
+
+        :param pairs: an iterable of (transaction, payment) tuples.
+
+        :returns: a dictionary mapping the pairs to exchange rates, or
+            raises an APIError. Overrides may leave out pairs the API
+            has no exchange rate for, rather than fail the others.
+        """
+        return {pair: self.fetch_exchange_rate(*pair) for pair in pairs}
+
+    def chunk_pairs(self, pairs):
+        """Split currency pairs into the chunks that can be requested
+        with a single call to `fetch_exchange_rates`. By default every
+        pair needs a request of its own.
+
+        :param pairs: a list of (transaction, payment) tuples.
+
+        :returns: a list of lists of pairs.
+        """
+        return [[pair] for pair in pairs]
 
     def get_exchange_rate_from_cache(self, transaction, payment):
         """Try to get the exchange rate from cache.
@@ -154,14 +497,120 @@ class APIProvider:
         :returns: the exchange rate, if found and the cache timeout is
             not reached, None otherwise.
         """
+        if self.refresh_cache:
+            return None
+        self.compact_cache_periodically()
+        data = self.cache_backend.get(self.id_, transaction, payment)
+        rate, state = self._rate_from_entry(data, transaction, payment)
+        if rate:
+            _last_used[(self.id_, transaction, payment)] = time.time()
+        if state == STALE:
+            self.refresh_in_background([(transaction, payment)])
+        return rate
+
+    def get_exchange_rates_from_cache(self, pairs):
+        """Try to get the exchange rates for many currency pairs from
+        cache, loading the cache only once.
+
+        :param pairs: an iterable of (transaction, payment) tuples.
+
+        :returns: a dictionary mapping the pairs found in the cache to
+            their exchange rates.
+        """
         self.load_cache()
-        rate = None
-        if not self.refresh_cache and transaction in self.cache:
-            data = self.cache[transaction].get(payment)
-            if data and not cache_has_expired(data.get('timestamp')):
-                rate = data.get('rate')
+        cache, rates, stale, now = self.cache, {}, [], time.time()
+        for transaction, payment in pairs:
+            data = cache.get(transaction, {}).get(payment)
+            rate, state = self._rate_from_entry(data, transaction, payment)
+            if rate:
+                rates[(transaction, payment)] = rate
+                _last_used[(self.id_, transaction, payment)] = now
+            if state == STALE:
+                stale.append((transaction, payment))
+        if stale:
+            self.refresh_in_background(stale)
+        return rates
+
+    def _rate_from_entry(self, data, transaction, payment):
+        """Get the rate of the cache entry of a currency pair, if it
+        can be used.
+
+        :returns: a (rate, state) tuple, where rate is None if the
+            entry is missing, has expired, or a refresh is forced.
+        """
+        if self.refresh_cache or not data:
+            metrics.record_cache(self.id_, 'miss')
+            return None, EXPIRED
+        state = cache_state(data.get('timestamp'),
+                            entry_cache_timeout(data, transaction, payment))
+        metrics.record_cache(self.id_, 'hit' if state == FRESH else state)
+        if state == EXPIRED:
+            return None, state
+        return data.get('rate'), state
+
+    def triangulate(self, transaction, payment):
+        """Derive the exchange rate of a currency pair from other fresh
+        cached exchange rates, as configured by the 'triangulate' and
+        'max_hops' options. See `curry.api.graph`.
+
+        :param transaction: the transaction (from) currency.
+        :param payment: the payment (to) currency.
+
+        :returns: the exchange rate, or None if it can not be derived.
+        """
+        from curry.api.graph import get_rate_graph, triangulation_mode
+        mode = triangulation_mode()
+        if self.refresh_cache or not mode:
+            return None
+
+        graph = get_rate_graph(self.id_)
+        version = self.cache_backend.version(self.id_)
+        offset = None
+        if has_pair_timeouts() or adaptive_ttl_enabled():
+            # Age every edge by its own cache timeout.
+            cache_timeout = get_cache_timeout()
+
+            def edge_offset(transaction, payment, data):
+                return (entry_cache_timeout(data, transaction, payment) -
+                        cache_timeout)
+            offset = edge_offset
+        graph.sync(self.cache_backend.load(self.id_), version, offset)
+        found = graph.triangulate(transaction, payment,
+                                  time.time() - get_cache_timeout(), mode)
+        if not found:
+            return None
+
+        rate, path = found
+        log.info('Triangulated {}/{} via {}'
+                 .format(transaction, payment, ' -> '.join(path)))
+        metrics.record_cache(self.id_, 'triangulated')
         return rate
 
+    def refresh_in_background(self, pairs):
+        """Fetch currency pairs with stale cache entries in a background
+        thread, and save them to the cache.
+
+        :param pairs: a list of (transaction, payment) tuples.
+        """
+        from curry.api.flight import single_flight
+        key = (self.id_,) + tuple(sorted(pairs))
+
+        def fetch():
+            rates = self.fetch_exchange_rates(pairs)
+            self.save_cache_many(rates)
+            return rates
+
+        def check():
+            rates = {pair: self._rate_saved_since(*pair, since=started)
+                     for pair in pairs}
+            return rates if all(rates.values()) else None
+
+        def refresh():
+            single_flight(key, fetch, check)
+
+        started = time.time()
+        refresh_in_background(key, refresh)
+
     def save_cache(self, transaction, payment, rate):
         """Generic caching for API providers where a request is needed
         for every currency pair. The exchange rate for a currency pair
@@ -172,40 +621,261 @@ class APIProvider:
         :param payment: the payment (to) currency.
         :param rate: the exchange rate for the currency pair.
         """
-        if not hasattr(self, 'cache_file'):
-            log.warn('Trying to save cache, but no cache_file is declared')
+        self.save_cache_many({(transaction, payment): rate})
+
+    def save_cache_many(self, rates):
+        """Save the exchange rates for many currency pairs to the cache
+        with a single write.
+
+        :param rates: a dictionary mapping (transaction, payment)
+            tuples to exchange rates.
+        """
+        if not rates:
             return
+        for (transaction, payment), rate in rates.items():
+            if isinstance(rate, bool) or not isinstance(rate, (int, float)):
+                raise APIError('Invalid exchange rate for {}/{}: {!r}'
+                               .format(transaction, payment, rate), self.id_)
 
-        cache = {
-            payment: {
+        from curry.api.ttl import next_ttl
+        timestamp = time.time()
+        adaptive = adaptive_ttl_enabled()
+        entries = {}
+        for (transaction, payment), rate in rates.items():
+            data = entries.setdefault(transaction, {})[payment] = {
                 'rate': rate,
-                'timestamp': time.time(),
+                'timestamp': timestamp,
             }
-        }
+            if adaptive:
+                previous = self.cache_backend.get(self.id_, transaction,
+                                                  payment)
+                ttl = next_ttl(transaction, payment, rate, timestamp,
+                               previous)
+                if ttl:
+                    data['ttl'] = ttl
 
-        if transaction in self.cache:
-            self.cache[transaction].update(cache)
-        else:
-            self.cache[transaction] = cache
+        self.cache_backend.update(self.id_, entries)
 
-        log.info('Saving cache.')
-        with open(self.cache_file, 'w') as f:
-            f.write(json.dumps(self.cache))
+        # The loaded cache may be shared with other threads, so update
+        # a copy of it.
+        cache = dict(self.cache)
+        for transaction, payments in entries.items():
+            cache[transaction] = dict(cache.get(transaction, {}), **payments)
+        self.cache = cache
 
-    def load_cache(self):
-        """Load saved cache from disk.
+        for transaction, payments in entries.items():
+            self.save_history(transaction, {payment: data['rate'] for
+                                            payment, data in payments.items()})
+        self.evict_cache()
+
+    def evict_cache(self):
+        """Remove the least recently used currency pairs from the cache
+        while it holds more than 'max_entries' pairs (default: 10000,
+        0 for no limit). A pair is used when it is saved, or found in
+        the cache by a lookup in this process.
+        """
+        max_entries = int(config.get('max_entries', DEFAULT_MAX_ENTRIES))
+        if not max_entries:
+            return
+        count = self.cache_backend.count(self.id_)
+        if count <= max_entries:
+            return
+
+        used = {}
+        for transaction, payments in self.cache_backend.load(
+                self.id_).items():
+            for payment, data in payments.items():
+                used[(transaction, payment)] = max(
+                    data.get('timestamp') or 0,
+                    _last_used.get((self.id_, transaction, payment), 0))
+        evicted = heapq.nsmallest(count - max_entries, used, key=used.get)
+        log.info('Evicting {} least recently used cache entries'
+                 .format(len(evicted)))
+        self.delete_cache(evicted)
+
+    def compact_cache(self, cache):
+        """Remove the expired currency pairs from a loaded cache, and
+        from the cache backend. With the 'adaptive_ttl' option set,
+        pairs are kept until they are older than the longest cache
+        timeout, as their last rate is needed to adapt the next.
+
+        :param cache: the per-pair cache, which is not modified.
+
+        :returns: the cache without the expired pairs.
+        """
+        from curry.api.ttl import ttl_bounds
+        keep = ttl_bounds()[1] if adaptive_ttl_enabled() else 0
+        oldest = time.time() - keep
+        expired = [(transaction, payment)
+                   for transaction, payments in cache.items()
+                   for payment, data in payments.items()
+                   if (data.get('timestamp') or 0) < oldest and
+                   cache_state(data.get('timestamp'), entry_cache_timeout(
+                       data, transaction, payment)) == EXPIRED]
+        if not expired:
+            return cache
+        log.info('Removing {} expired cache entries'.format(len(expired)))
+        self.cache = cache
+        self.delete_cache(expired)
+        return self.cache
+
+    def compact_cache_periodically(self):
+        """Remove the expired currency pairs from the cache, at most
+        once every 'compact_interval' seconds (default: 60, 0 to only
+        compact when the cache is loaded anew) for each API provider.
+        Lookups of single pairs never load the whole cache, so pairs
+        that are not looked up again would otherwise expire in place.
+        """
+        interval = config.getfloat('compact_interval',
+                                   DEFAULT_COMPACT_INTERVAL)
+        now = time.time()
+        if not interval or now - _last_compacted.get(self.id_, 0) < interval:
+            return
+        _last_compacted[self.id_] = now
+        # Entries expire with time, so the cache is compacted even if
+        # it has not changed since it was last compacted.
+        cache = self.cache_backend.load(self.id_)
+        self.cache = self._compacted = self.compact_cache(cache)
+
+    def delete_cache(self, pairs):
+        """Remove currency pairs from the cache.
+
+        :param pairs: a list of (transaction, payment) tuples.
+        """
+        self.cache_backend.delete(self.id_, pairs)
+
+        cache = dict(self.cache)
+        for transaction, payment in pairs:
+            _last_used.pop((self.id_, transaction, payment), None)
+            payments = dict(cache.get(transaction, {}))
+            payments.pop(payment, None)
+            if payments:
+                cache[transaction] = payments
+            else:
+                cache.pop(transaction, None)
+        self.cache = cache
 
-        :returns: True if the cache file is loaded, False if its not,
-            and None if no cache_file attribute is declared.
+    def save_history(self, base, rates, date=None):
+        """Record exchange rates in the historical rate store, unless
+        the 'history' option is 0. Failing to do so is only logged.
+
+        :param base: the currency the rates are relative to.
+        :param rates: a dictionary mapping currency codes to rates.
+        :param date: the `datetime.date` of the rates, default today.
         """
-        if not hasattr(self, 'cache_file'):
-            log.warn('Trying to load cache, but no cache_file is declared')
+        from curry.api.history import RateHistory, history_enabled, today
+        if not history_enabled():
             return
+        try:
+            RateHistory(self.id_, base).append(date or today(), rates)
+        except OSError as e:
+            log.warning('Unable to save history: {}'.format(e))
+
+    def get_historical_exchange_rate(self, transaction, payment, date):
+        """Get the exchange rate for a currency pair as of a date, that
+        is the last rate recorded on or before it, from the historical
+        rate store. The current exchange rate is used if nothing is
+        recorded and the date is today or later.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+        :param date: a `datetime.date`.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        from curry.api.history import RateHistory, today
+        found = RateHistory(self.id_, transaction).get(payment, date)
+        if found:
+            return found[1]
+        found = RateHistory(self.id_, payment).get(transaction, date)
+        if found:
+            return 1 / found[1]
+        if date >= today():
+            return self.get_exchange_rate(transaction, payment)
+        raise APIError('No exchange rate for {}/{} on {}'
+                       .format(transaction, payment, date), self.id_)
+
+    def fetch_historical_rates(self, date):
+        """Request the exchange rates of a past date from the API. Only
+        API providers that fetch rates by date implement this.
+
+        :param date: a `datetime.date`.
+
+        :returns: a (base, rates) tuple, or raises an APIError.
+        """
+        raise NotImplementedError
+
+    def backfill(self, start, end):
+        """Fetch the historical exchange rates of every date between
+        start and end (inclusive) missing from the history, and record
+        them.
 
-        if os.path.isfile(self.cache_file):
-            log.info('Loading cache.')
-            with open(self.cache_file) as f:
-                self.cache = json.load(f)
+        :param start: the first `datetime.date`.
+        :param end: the last `datetime.date`.
+
+        :returns: the number of dates fetched, or raises an APIError.
+        """
+        from curry.api.history import RateHistory, list_bases
+        histories = [RateHistory(self.id_, base)
+                     for base in list_bases(self.id_)]
+        rows, date = {}, start
+        while date <= end:
+            if not any(h.has_date(date) for h in histories):
+                try:
+                    base, rates = self.fetch_historical_rates(date)
+                except NotImplementedError:
+                    raise APIError('Historical exchange rates are not '
+                                   'supported', self.id_)
+                rows.setdefault(base, []).append((date, rates))
+            date += datetime.timedelta(days=1)
+
+        for base, history in rows.items():
+            RateHistory(self.id_, base).extend(history)
+        return sum(len(history) for history in rows.values())
+
+    def load_cache(self):
+        """Load the saved cache from the cache backend. Expired pairs
+        are removed whenever it is loaded anew, see `compact_cache`.
+        """
+        cache = self.cache_backend.load(self.id_)
+        if cache is not self._compacted:
+            cache = self._compacted = self.compact_cache(cache)
+        self.cache = cache
+
+    def http_get(self, url, headers=None):
+        """Do a GET request through the shared, pooled HTTP transport,
+        once the rate limit of the API provider allows it.
+
+        :param url: the request url.
+        :param headers: additional request headers.
+
+        :returns: a `requests.Response`.
+        """
+        from curry.api.transport import get_transport
+        from curry.api.scheduler import get_scheduler
+        _http.requests = http_requests_made() + 1
+        scheduler = get_scheduler(self.id_)
+        if scheduler:
+            scheduler.acquire()
+
+        start = time.perf_counter()
+        try:
+            r = get_transport().get(url, headers=headers)
+        except RequestError:
+            metrics.observe_request(self.id_, time.perf_counter() - start,
+                                    ok=False)
+            raise
+        metrics.observe_request(self.id_, time.perf_counter() - start,
+                                len(r.content))
+        self.dump_http_response(r)
+
+        if r.status_code == 429 and scheduler:
+            try:
+                retry_after = float(r.headers.get('retry-after', 60))
+            except ValueError:
+                retry_after = 60
+            scheduler.backoff(retry_after)
+        return r
 
     def dump_http_response(self, response):
         log.debug('*** Start: HTTP Response DUMP ***')
@@ -218,5 +888,273 @@ class APIProvider:
         log.debug('*** End ***')
 
 
-# Loads and registers API providers
-from curry.api.providers import *
+class RateTableProvider(APIProvider):
+    """Super class for API providers that fetch the exchange rates of
+    all currencies relative to a base currency in a single request.
+    Subclasses must implement `fetch_rates`, which sets the base
+    currency and the exchange rates in the 'base' and 'rates' keys of
+    the cache, and saves it with `save_rate_table`.
+    """
+    snapshot_dir = None
+    """The directory of the snapshot, default `SNAPSHOT_PATH` of
+    `curry.api.snapshot`."""
+
+    def load_cache(self):
+        """Load the saved cache, and refresh it if needed. An expired
+        cache is refreshed before returning, while a stale cache is
+        refreshed in the background.
+        """
+        self.cache = self.cache_backend.load(self.id_)
+
+        state = cache_state(self.cache.get('timestamp'))
+        if not self.cache or self.refresh_cache:
+            metrics.record_cache(self.id_, 'miss')
+        else:
+            metrics.record_cache(self.id_, 'hit' if state == FRESH else state)
+
+        if not self.cache or self.refresh_cache or state == EXPIRED:
+            self.fetch_rates_once()
+            return
+        if state == STALE:
+            self.refresh_in_background()
+
+        from curry.api.snapshot import snapshot_enabled, snapshot_path
+        if snapshot_enabled() and not os.path.exists(
+                snapshot_path(self.id_, self.snapshot_dir)):
+            self.save_snapshot()
+
+    def fetch_rates(self):
+        """Request the exchange rates from the API, and save them to
+        the cache. Must be implemented in every subclass.
+        """
+        raise NotImplementedError
+
+    def fetch_rates_once(self):
+        """Fetch the exchange rates with `fetch_rates`, sharing the
+        request with concurrent callers in this and other processes. A
+        caller that waited for another process uses the rate table it
+        saved, see `curry.api.flight`.
+        """
+        from curry.api.flight import single_flight
+        started = time.time()
+
+        def fetch():
+            self.fetch_rates()
+            return self.cache
+
+        def check():
+            cache = self.cache_backend.load(self.id_)
+            if (cache.get('timestamp') or 0) >= started:
+                return cache
+            return None
+
+        self.cache = single_flight((self.id_,), fetch, check)
+
+    def refresh_in_background(self, pairs=None):
+        """Fetch the exchange rates in a background thread."""
+        refresh_in_background(self.id_, self.fetch_rates_once)
+
+    def save_rate_table(self):
+        """Save the rate table in `self.cache` to the cache backend,
+        and record it in the history and the snapshot.
+        """
+        self.cache_backend.replace(self.id_, self.cache)
+        self.save_history(self.cache['base'], self.cache['rates'])
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        """Write the rate table in `self.cache` to a binary snapshot,
+        unless the 'snapshot' option is 0. Failing to do so is only
+        logged.
+        """
+        from curry.api.snapshot import (write_snapshot, snapshot_path,
+                                        snapshot_enabled)
+        if not snapshot_enabled() or not self.cache.get('rates'):
+            return
+        try:
+            write_snapshot(snapshot_path(self.id_, self.snapshot_dir),
+                           self.cache['base'],
+                           self.cache['rates'],
+                           self.cache.get('inverse_rates'),
+                           self.cache['timestamp'])
+        except OSError as e:
+            log.warning('Unable to save snapshot: {}'.format(e))
+
+    def get_snapshot(self):
+        """Get the snapshot of the rate table, if it can be used. A
+        stale snapshot is used while the rates are refreshed in the
+        background.
+
+        :returns: a `curry.api.snapshot.RateSnapshot`, or None if there
+            is none, it has expired, or a refresh is forced.
+        """
+        from curry.api.snapshot import open_snapshot, snapshot_enabled
+        if self.refresh_cache or not snapshot_enabled():
+            return None
+        snapshot = open_snapshot(self.id_, self.snapshot_dir)
+        if snapshot is None:
+            return None
+        state = cache_state(snapshot.timestamp)
+        if state == EXPIRED:
+            return None
+        metrics.record_cache(self.id_, 'hit' if state == FRESH else state)
+        if state == STALE:
+            self.refresh_in_background()
+        return snapshot
+
+    def get_base_rates(self):
+        """Get the exchange rates relative to the base currency.
+
+        :returns: a (base, rates) tuple, where rates is a dictionary
+            mapping currency codes to the amount of that currency one
+            unit of the base currency buys.
+        """
+        self.load_cache()
+        cache = self.cache
+        return cache.get('base'), cache.get('rates')
+
+    def get_exchange_rates(self, pairs):
+        """Get the exchange rates for many currency pairs.
+
+        :param pairs: an iterable of (transaction, payment) tuples.
+
+        :returns: a dictionary mapping the pairs to exchange rates, or
+            raises an APIError.
+        """
+        return {pair: self.get_exchange_rate(*pair) for pair in pairs}
+
+    def get_exchange_rate_from_cache(self, transaction, payment):
+        """Try to get the exchange rate from the snapshot or the cached
+        rate table, without fetching the rates.
+
+        :param transaction: the transaction (from) currency.
+        :param payment: the payment (to) currency.
+
+        :returns: the exchange rate, if the rate table has not expired
+            and has both currencies, None otherwise.
+        """
+        if self.refresh_cache:
+            return None
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            base, rates = snapshot.base, snapshot
+        else:
+            cache = self.cache_backend.load(self.id_)
+            state = cache_state(cache.get('timestamp'))
+            if not cache.get('rates') or state == EXPIRED:
+                return None
+            if state == STALE:
+                self.refresh_in_background()
+            base, rates = cache.get('base'), cache['rates']
+        try:
+            return self.cross_rate(base, rates, transaction, payment)
+        except APIError:
+            return None
+
+    def get_exchange_rate(self, transaction, payment):
+        """Get the exchange rate for a currency pair (transaction
+        currency -> payment currency), calculated from the rates
+        relative to the base currency.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return self.cross_rate(snapshot.base, snapshot, transaction,
+                                   payment)
+        base, rates = self.get_base_rates()
+        return self.cross_rate(base, rates, transaction, payment)
+
+    def get_historical_exchange_rate(self, transaction, payment, date):
+        """Get the exchange rate for a currency pair on a date. The
+        rates of the date are fetched and recorded if they are missing
+        from the history, and the API provider fetches rates by date.
+        Otherwise the last rates recorded on or before the date are
+        used.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+        :param date: a `datetime.date`.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        from curry.api.history import RateHistory, list_bases, today
+        if date >= today():
+            return self.get_exchange_rate(transaction, payment)
+
+        recorded = []
+        for base in list_bases(self.id_):
+            found = RateHistory(self.id_, base).row(date)
+            if found:
+                recorded.append((found[0], base, found[1]))
+        recorded.sort(key=lambda r: r[0], reverse=True)
+
+        if recorded and recorded[0][0] == date:
+            _, base, rates = recorded[0]
+            return self.cross_rate(base, rates, transaction, payment)
+
+        try:
+            base, rates = self.fetch_historical_rates(date)
+        except NotImplementedError:
+            if not recorded:
+                raise APIError('No exchange rates recorded on or before {}'
+                               .format(date), self.id_)
+            day, base, rates = recorded[0]
+            log.info('Using exchange rates recorded on {}'.format(day))
+            return self.cross_rate(base, rates, transaction, payment)
+
+        self.save_history(base, rates, date)
+        return self.cross_rate(base, rates, transaction, payment)
+
+    def cross_rate(self, base, rates, transaction, payment):
+        """Calculate the exchange rate for a currency pair from rates
+        relative to a base currency.
+
+        :param base: the base currency.
+        :param rates: a dictionary mapping currency codes to the amount
+            of that currency one unit of the base currency buys.
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        t_rate = rates.get(transaction)
+        p_rate = rates.get(payment)
+        log.debug('Using base currency: {}'.format(base))
+        log.debug('Calculation currency pair: {}/{} '
+                  .format(transaction, payment))
+
+        if transaction == base:
+            log.debug('Transaction currency ({}) == base currency ({})'
+                      .format(transaction, base))
+            t_rate = 1.0
+
+        if payment == base:
+            log.debug('Payment currency ({}) == base currency ({})'
+                      .format(payment, base))
+            p_rate = 1.0
+
+        for code, rate in [(transaction, t_rate), (payment, p_rate)]:
+            if not rate:
+                raise APIError('Unknown currency code: {}'.format(code),
+                               self.id_)
+
+        log.debug('1 {} == {} {}'.format(base, t_rate, transaction))
+        log.debug('1 {} == {} {}'.format(base, p_rate, payment))
+        return p_rate * (1 / t_rate)
+
+    def get_rate_matrix(self):
+        """Get a cross-rate matrix of all currencies, for vectorized
+        conversions. Requires NumPy.
+
+        :returns: a `curry.api.matrix.RateMatrix`.
+        """
+        from curry.api.matrix import RateMatrix
+        return RateMatrix.from_base_rates(*self.get_base_rates())
+
+
+# Registers the API providers, without loading them
+import curry.api.providers  # noqa: F401, imported for the registration
@@ -0,0 +1,140 @@
+"""
+    Curry
+    ~~~~~
+
+    Asynchronous interface for the providers
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from curry.config import config
+from curry.api import Provider, RateTableProvider, APIError, RequestError
+
+log = logging.getLogger(__name__)
+
+
+class AsyncProvider:
+    """Asynchronous counterpart of `Provider`, which resolves many
+    currency pairs concurrently::
+
+        provider = AsyncProvider(api='finance.yahoo.com')
+        rates = await provider.get_exchange_rates([('EUR', 'USD'),
+                                                   ('USD', 'NOK')])
+
+    Pairs that are not cached are fetched concurrently, with at most
+    `concurrency` requests in flight, and all fetched rates are saved
+    to the cache in one write at the end. API providers that can quote
+    several pairs in one request get one request per chunk of pairs
+    (see `APIProvider.chunk_pairs`). The blocking HTTP requests run in
+    a thread pool, so the shared transport should be configured
+    with a `pool_maxsize` of at least `concurrency`.
+
+    :param concurrency: the maximum number of concurrent requests
+        (default: the 'concurrency' config option, or 8).
+    :param priority: the priority of the requests in the rate limit
+        of the API provider, see `curry.api.scheduler` (default:
+        INTERACTIVE).
+    :param kwargs: passed on to `Provider`.
+    """
+
+    def __init__(self, concurrency=None, priority=None, **kwargs):
+        self.provider = Provider(**kwargs)
+        if concurrency is None:
+            concurrency = config.get('concurrency', 8)
+        self.concurrency = int(concurrency)
+        self.priority = priority
+
+    @property
+    def api(self):
+        return self.provider.api
+
+    def use_api(self, **kwargs):
+        self.provider.use_api(**kwargs)
+
+    def _init_thread(self):
+        if self.priority is not None:
+            from curry.api.scheduler import set_priority
+            set_priority(self.priority)
+
+    async def get_exchange_rate(self, transaction, payment):
+        """Get the exchange rate for a currency pair (transaction
+        currency -> payment currency).
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        rates = await self.get_exchange_rates([(transaction, payment)])
+        return rates[(transaction.upper(), payment.upper())]
+
+    async def get_exchange_rates(self, pairs):
+        """Get the exchange rates for many currency pairs.
+
+        :param pairs: an iterable of (transaction, payment) tuples.
+
+        :returns: a dictionary mapping the (upper-cased) pairs to their
+            exchange rates. As with `Provider.get_exchange_rate`, the
+            rate is -1 for pairs where the HTTP request failed. The
+            first APIError is raised after the successfully fetched
+            rates are saved.
+        """
+        api = self.provider.api
+        pairs = list(dict.fromkeys((t.upper(), p.upper()) for t, p in pairs))
+        log.info('Using API provider: {}'.format(api.id_))
+
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                                initializer=self._init_thread) as executor:
+            if isinstance(api, RateTableProvider):
+                # One request refreshes the rates for every pair.
+                await loop.run_in_executor(executor, api.load_cache)
+                return {pair: api.get_exchange_rate(*pair) for pair in pairs}
+
+            rates = await loop.run_in_executor(
+                executor, api.get_exchange_rates_from_cache, pairs)
+            for pair in pairs:
+                if pair not in rates:
+                    rate = api.triangulate(*pair)
+                    if rate:
+                        rates[pair] = rate
+            missing = [pair for pair in pairs if pair not in rates]
+            log.info('{} cached, {} to fetch'
+                     .format(len(rates), len(missing)))
+
+            chunks = api.chunk_pairs(missing)
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(chunk):
+                async with semaphore:
+                    return await loop.run_in_executor(
+                        executor, api.fetch_exchange_rates, chunk)
+
+            results = await asyncio.gather(*[fetch(chunk) for chunk in chunks],
+                                           return_exceptions=True)
+
+        fetched, failed, error = {}, [], None
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, RequestError):
+                log.error(result)
+                rates.update((pair, -1) for pair in chunk)
+            elif isinstance(result, Exception):
+                error = error or result
+            else:
+                fetched.update(result)
+                failed.extend(pair for pair in chunk if pair not in result)
+
+        rates.update(fetched)
+        api.save_cache_many(fetched)
+        if failed and not error:
+            error = APIError('No exchange rate for {}'.format(', '.join(
+                '{}/{}'.format(*pair) for pair in failed)), api.id_)
+
+        if error:
+            raise error
+
+        return rates
@@ -0,0 +1,612 @@
+"""
+    Curry
+    ~~~~~
+
+    Cache backends for the API providers
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import json
+import time
+import sqlite3
+import weakref
+import logging
+import itertools
+import threading
+
+from curry.config import config, cache_path, get_cache_file
+
+log = logging.getLogger(__name__)
+
+__all__ = ['CacheBackend', 'JSONCache', 'SQLiteCache', 'MemoryCache',
+           'Backends', 'get_cache_backend', 'migrate_json_caches']
+
+DEFAULT_BACKEND = 'sqlite'
+SQLITE_FILENAME = 'cache.sqlite'
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class _ThreadToken:
+    """Kept in thread-local data, which is dropped when the thread
+    ends, to tell when that happens."""
+
+
+class CacheBackend:
+    """Super class for cache backends.
+
+    A backend stores the cache of every API provider, keyed by the
+    provider id. Two shapes of cache are supported, matching the two
+    kinds of API providers:
+
+    - per-pair caches, saved with `update`, on the form
+      ``{transaction: {payment: {'rate': ..., 'timestamp': ...}}}``,
+      with an optional 'ttl' key
+    - rate tables, saved with `replace`, on the form
+      ``{'base': ..., 'rates': {...}, 'timestamp': ...}``, with
+      optional 'inverse_rates', 'etag' and 'last_modified' keys.
+    """
+
+    def load(self, provider):
+        """Load the whole cache of an API provider.
+
+        :param provider: the API provider id.
+
+        :returns: the cache dictionary, which is empty if nothing is
+            cached.
+        """
+        raise NotImplementedError
+
+    def get(self, provider, transaction, payment):
+        """Look up a single cached currency pair.
+
+        :param provider: the API provider id.
+        :param transaction: the transaction (from) currency.
+        :param payment: the payment (to) currency.
+
+        :returns: a dictionary with 'rate' and 'timestamp' keys, or
+            None if the pair is not cached.
+        """
+        return self.load(provider).get(transaction, {}).get(payment)
+
+    def update(self, provider, entries):
+        """Insert or update cached currency pairs.
+
+        :param provider: the API provider id.
+        :param entries: per-pair cache entries to merge in.
+        """
+        raise NotImplementedError
+
+    def replace(self, provider, cache):
+        """Replace the whole cache of an API provider with a rate
+        table.
+
+        :param provider: the API provider id.
+        :param cache: the rate table.
+        """
+        raise NotImplementedError
+
+    def delete(self, provider, pairs):
+        """Remove cached currency pairs.
+
+        :param provider: the API provider id.
+        :param pairs: an iterable of (transaction, payment) tuples.
+        """
+        raise NotImplementedError
+
+    def count(self, provider):
+        """Count the cached currency pairs of an API provider.
+
+        :param provider: the API provider id.
+        """
+        return sum(len(payments) for payments in
+                   self.load(provider).values())
+
+    def version(self, provider):
+        """Get a token that changes whenever the stored cache of an API
+        provider may have changed, also by other processes.
+
+        :param provider: the API provider id.
+
+        :returns: a comparable token, or None if change detection is
+            not supported.
+        """
+        return None
+
+    def close(self):
+        """Release any resources held by the backend."""
+
+
+class JSONCache(CacheBackend):
+    """The original cache format: one JSON file per API provider, which
+    is rewritten as a whole on every save. Writers in the process are
+    serialized, so concurrent updates are not lost.
+
+    :param directory: the directory holding the cache files.
+    """
+
+    def __init__(self, directory=cache_path):
+        self.directory = directory
+        self._lock = threading.RLock()
+
+    def _path(self, provider):
+        return os.path.join(self.directory, provider)
+
+    def version(self, provider):
+        try:
+            st = os.stat(self._path(provider))
+        except FileNotFoundError:
+            return (0, 0)
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, provider):
+        path = self._path(provider)
+        if not os.path.isfile(path):
+            return {}
+        log.info('Loading cache: {}'.format(path))
+        with open(path) as f:
+            return json.load(f)
+
+    def update(self, provider, entries):
+        with self._lock:
+            cache = self.load(provider)
+            for transaction, payments in entries.items():
+                cache.setdefault(transaction, {}).update(payments)
+            self.replace(provider, cache)
+
+    def delete(self, provider, pairs):
+        with self._lock:
+            cache = self.load(provider)
+            for transaction, payment in pairs:
+                payments = cache.get(transaction, {})
+                payments.pop(payment, None)
+                if not payments:
+                    cache.pop(transaction, None)
+            self.replace(provider, cache)
+
+    def replace(self, provider, cache):
+        path = self._path(provider)
+        log.info('Saving cache: {}'.format(path))
+        with self._lock:
+            tmp = '{}.tmp{}'.format(path, os.getpid())
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(cache))
+            os.replace(tmp, path)
+
+
+class SQLiteCache(CacheBackend):
+    """A cache backend storing every API provider in one SQLite
+    database. Each currency pair is a row, so saving a rate only writes
+    that row, and a lookup only reads it. The database runs in WAL
+    mode, so several processes can read and write it concurrently.
+
+    Rate tables are stored as rows from the base currency to every
+    other currency, and their inverse rates (if any) as rows from
+    every currency to the base currency.
+
+    Writes go through one connection, one at a time. Reads use a
+    connection per thread, so they take no lock and run concurrently,
+    which is closed when the thread ends.
+
+    The schema is versioned with 'PRAGMA user_version', and older
+    databases are migrated when opened, see `migrations`.
+
+    :param path: the database file.
+    :param timeout: seconds to wait for a lock held by another process.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS rates (
+            provider TEXT NOT NULL,
+            from_currency TEXT NOT NULL,
+            to_currency TEXT NOT NULL,
+            rate REAL NOT NULL,
+            timestamp REAL NOT NULL,
+            ttl REAL,
+            PRIMARY KEY (provider, from_currency, to_currency)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS tables (
+            provider TEXT PRIMARY KEY,
+            base TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            etag TEXT,
+            last_modified TEXT
+        );
+    '''
+
+    migrations = [
+        # 1: the cache timeouts of adaptive_ttl, see curry.api.ttl.
+        ('rates', 'ttl', 'ALTER TABLE rates ADD COLUMN ttl REAL'),
+    ]
+    """The schema changes since the first version, as (table, column,
+    statement) tuples. The database is at the version given by the
+    number of changes applied."""
+
+    def __init__(self, path=None, timeout=30):
+        self.path = path or get_cache_file(SQLITE_FILENAME)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._readers = set()
+        self._generations = itertools.count(1)
+        self._generation = 0
+        self._db = self._connect()
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(self.schema)
+        self._migrate()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None,
+                               check_same_thread=False)
+
+    def _migrate(self):
+        """Apply the migrations the database is missing, in one
+        transaction, so concurrent processes do not both apply them.
+        Tables just created by the schema already have the columns."""
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+            for table, column, sql in self.migrations[version:]:
+                columns = [row[1] for row in self._db.execute(
+                    'PRAGMA table_info({})'.format(table))]
+                if column not in columns:
+                    log.info('Migrating cache database: {}'.format(sql))
+                    self._db.execute(sql)
+            self._db.execute('PRAGMA user_version = {:d}'
+                             .format(len(self.migrations)))
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def _reader(self):
+        """Get the read connection of the current thread."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._connect()
+            self._local.data_version = None
+            self._local.token = _ThreadToken()
+            self._readers.add(db)
+            weakref.finalize(self._local.token, self._close_reader, db)
+        return db
+
+    def _close_reader(self, db):
+        # Called when the thread of a reader ends, or from close, so it
+        # takes no lock.
+        self._readers.discard(db)
+        db.close()
+
+    def _changed(self):
+        # A generation number shared by every thread, which moves on
+        # whenever any thread sees the database change.
+        self._generation = next(self._generations)
+
+    def _transaction(self, statements):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, params in statements:
+                    if params and isinstance(params, list):
+                        self._db.executemany(sql, params)
+                    else:
+                        self._db.execute(sql, params or ())
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+            self._changed()
+
+    def version(self, provider):
+        # data_version changes on commits from other connections, but
+        # its values are only comparable within one connection, so any
+        # change seen by a thread moves the shared generation on. A new
+        # thread can not tell what it missed, and does so as well.
+        reader = self._reader()
+        data_version = reader.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self._local.data_version:
+            self._local.data_version = data_version
+            self._changed()
+        return self._generation
+
+    def load(self, provider):
+        reader = self._reader()
+        # Both queries must see the same commit.
+        reader.execute('BEGIN')
+        try:
+            table = reader.execute(
+                'SELECT base, timestamp, etag, last_modified FROM tables '
+                'WHERE provider = ?', (provider,)).fetchone()
+            rows = reader.execute(
+                'SELECT from_currency, to_currency, rate, timestamp, ttl '
+                'FROM rates WHERE provider = ?', (provider,)).fetchall()
+        finally:
+            reader.execute('COMMIT')
+
+        if table:
+            return self._to_table(table, rows)
+
+        cache = {}
+        for transaction, payment, rate, timestamp, ttl in rows:
+            data = cache.setdefault(transaction, {})[payment] = {
+                'rate': rate,
+                'timestamp': timestamp,
+            }
+            if ttl is not None:
+                data['ttl'] = ttl
+        return cache
+
+    def _to_table(self, table, rows):
+        base, timestamp, etag, last_modified = table
+        rates, inverse_rates = {}, {}
+        for transaction, payment, rate, _, _ in rows:
+            if transaction == base:
+                rates[payment] = rate
+            if payment == base and transaction != base:
+                inverse_rates[transaction] = rate
+
+        cache = {
+            'base': base,
+            'rates': rates,
+            'timestamp': timestamp,
+        }
+        if inverse_rates:
+            if base in rates:
+                inverse_rates[base] = rates[base]
+            cache['inverse_rates'] = inverse_rates
+        if etag is not None:
+            cache['etag'] = etag
+        if last_modified is not None:
+            cache['last_modified'] = last_modified
+        return cache
+
+    def get(self, provider, transaction, payment):
+        row = self._reader().execute(
+            'SELECT rate, timestamp, ttl FROM rates WHERE provider = ? AND '
+            'from_currency = ? AND to_currency = ?',
+            (provider, transaction, payment)).fetchone()
+        if row:
+            data = {'rate': row[0], 'timestamp': row[1]}
+            if row[2] is not None:
+                data['ttl'] = row[2]
+            return data
+
+    def update(self, provider, entries):
+        rows = [(provider, transaction, payment,
+                 data['rate'], data['timestamp'], data.get('ttl'))
+                for transaction, payments in entries.items()
+                for payment, data in payments.items()]
+        if not rows:
+            return
+        log.info('Saving {} cache entries.'.format(len(rows)))
+        self._transaction([
+            ('INSERT OR REPLACE INTO rates VALUES (?, ?, ?, ?, ?, ?)', rows),
+        ])
+
+    def replace(self, provider, cache):
+        base, timestamp = cache['base'], cache['timestamp']
+        rows = [(provider, base, code, rate, timestamp)
+                for code, rate in cache['rates'].items() if rate is not None]
+        rows += [(provider, code, base, rate, timestamp)
+                 for code, rate in cache.get('inverse_rates', {}).items()
+                 if rate is not None and code != base]
+        log.info('Saving rate table with {} entries.'.format(len(rows)))
+        self._transaction([
+            ('DELETE FROM rates WHERE provider = ?', (provider,)),
+            ('INSERT OR REPLACE INTO rates (provider, from_currency, '
+             'to_currency, rate, timestamp) VALUES (?, ?, ?, ?, ?)', rows),
+            ('INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?)',
+             (provider, base, timestamp, cache.get('etag'),
+              cache.get('last_modified'))),
+        ])
+
+    def delete(self, provider, pairs):
+        rows = [(provider, transaction, payment)
+                for transaction, payment in pairs]
+        if not rows:
+            return
+        log.info('Removing {} cache entries.'.format(len(rows)))
+        self._transaction([
+            ('DELETE FROM rates WHERE provider = ? AND from_currency = ? '
+             'AND to_currency = ?', rows),
+        ])
+
+    def count(self, provider):
+        return self._reader().execute(
+            'SELECT COUNT(*) FROM rates WHERE provider = ?',
+            (provider,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            for db in list(self._readers):
+                self._close_reader(db)
+            self._local = threading.local()
+            self._db.close()
+
+
+class MemoryCache(CacheBackend):
+    """An in-memory layer on top of another cache backend. The parsed
+    cache of each API provider is kept in memory, and only reloaded
+    when the `version` of the underlying backend changes (e.g. the
+    file's mtime or size), or when it is older than `ttl` seconds.
+    Writes go straight through to the underlying backend.
+
+    The 'hits', 'misses' and 'reloads' counters in `stats` count loads
+    served from memory, first loads, and loads that had to go back to
+    the underlying backend.
+
+    The caches kept in memory are never modified: writes build a new
+    cache and swap it in, so the dictionaries returned by `load` can be
+    read from any thread without a lock, and must not be modified by
+    the caller. Writers are serialized.
+
+    :param backend: the underlying `CacheBackend`.
+    :param ttl: the maximum age in seconds of a cache kept in memory,
+        or 0 to rely on change detection only.
+    """
+
+    def __init__(self, backend, ttl=0):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+        self._caches = {}
+        self._write_lock = threading.Lock()
+
+    def _is_fresh(self, entry, version):
+        version_, loaded, _ = entry
+        if version is None or version != version_:
+            return False
+        return not self.ttl or time.time() - loaded < self.ttl
+
+    def load(self, provider):
+        version = self.backend.version(provider)
+        entry = self._caches.get(provider)
+        if entry and self._is_fresh(entry, version):
+            self.stats['hits'] += 1
+            return entry[2]
+
+        self.stats['reloads' if entry else 'misses'] += 1
+        cache = self.backend.load(provider)
+        self._caches[provider] = (version, time.time(), cache)
+        return cache
+
+    def get(self, provider, transaction, payment):
+        return self.load(provider).get(transaction, {}).get(payment)
+
+    def update(self, provider, entries):
+        with self._write_lock:
+            before = self.backend.version(provider)
+            self.backend.update(provider, entries)
+
+            entry = self._caches.get(provider)
+            if entry and entry[0] == before:
+                # Nothing else changed the backend, so apply our own
+                # write to a copy in memory instead of reloading.
+                _, loaded, cache = entry
+                cache = dict(cache)
+                for transaction, payments in entries.items():
+                    cache[transaction] = dict(cache.get(transaction, {}),
+                                              **payments)
+                self._caches[provider] = (self.backend.version(provider),
+                                          loaded, cache)
+            else:
+                self._caches.pop(provider, None)
+
+    def delete(self, provider, pairs):
+        pairs = list(pairs)
+        with self._write_lock:
+            before = self.backend.version(provider)
+            self.backend.delete(provider, pairs)
+
+            entry = self._caches.get(provider)
+            if entry and entry[0] == before:
+                _, loaded, cache = entry
+                cache = dict(cache)
+                for transaction, payment in pairs:
+                    payments = dict(cache.get(transaction, {}))
+                    payments.pop(payment, None)
+                    if payments:
+                        cache[transaction] = payments
+                    else:
+                        cache.pop(transaction, None)
+                self._caches[provider] = (self.backend.version(provider),
+                                          loaded, cache)
+            else:
+                self._caches.pop(provider, None)
+
+    def replace(self, provider, cache):
+        with self._write_lock:
+            self.backend.replace(provider, cache)
+            self._caches[provider] = (self.backend.version(provider),
+                                      time.time(), cache)
+
+    def version(self, provider):
+        return self.backend.version(provider)
+
+    def clear(self):
+        """Forget all caches kept in memory."""
+        self._caches.clear()
+
+    def close(self):
+        self.clear()
+        self.backend.close()
+
+
+Backends = {
+    'json': JSONCache,
+    'sqlite': SQLiteCache,
+}
+"""A dictionary containing the available cache backends."""
+
+
+def migrate_json_caches(backend, providers, directory=cache_path):
+    """Copy the JSON cache files of the original cache format into
+    another cache backend. The JSON files are left untouched.
+
+    :param backend: the `CacheBackend` to migrate to.
+    :param providers: the ids of the API providers to migrate.
+    :param directory: the directory holding the JSON cache files.
+
+    :returns: the ids of the migrated API providers.
+    """
+    source = JSONCache(directory)
+    migrated = []
+    for provider in providers:
+        try:
+            cache = source.load(provider)
+        except ValueError as e:
+            log.warning('Skipping corrupt cache file for {}: {}'
+                        .format(provider, e))
+            continue
+        if not cache:
+            continue
+        if 'base' in cache and 'rates' in cache:
+            backend.replace(provider, cache)
+        else:
+            backend.update(provider, cache)
+        migrated.append(provider)
+        log.info('Migrated JSON cache: {}'.format(provider))
+    return migrated
+
+
+def get_cache_backend():
+    """Get the cache backend shared by all API providers in this
+    process, as selected by the 'cache_backend' config option. When a
+    new SQLite database is created, any existing JSON cache files are
+    migrated into it. Unless the 'memory_cache' option is 0, the
+    backend is wrapped in a `MemoryCache`, reloaded at least every
+    'memory_cache_ttl' seconds.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = _create_backend(
+                    config.get('cache_backend', DEFAULT_BACKEND))
+                if config.get('memory_cache', 1):
+                    ttl = float(config.get('memory_cache_ttl', 60))
+                    backend = MemoryCache(backend, ttl=ttl)
+                _backend = backend
+    return _backend
+
+
+def _create_backend(name):
+    if name not in Backends:
+        log.warning('Unknown cache backend: {}, using {}'
+                    .format(name, DEFAULT_BACKEND))
+        name = DEFAULT_BACKEND
+
+    if name != 'sqlite':
+        return Backends[name]()
+
+    is_new = not os.path.exists(get_cache_file(SQLITE_FILENAME))
+    backend = SQLiteCache()
+    if is_new:
+        from curry.api import Providers
+        migrate_json_caches(backend, sorted(Providers.keys()))
+    return backend
@@ -0,0 +1,143 @@
+"""
+    Curry
+    ~~~~~
+
+    Single-flight coalescing of concurrent identical fetches
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import re
+import hashlib
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from curry.config import config, cache_path
+
+log = logging.getLogger(__name__)
+
+__all__ = ['single_flight', 'file_lock']
+
+LOCK_PATH = os.path.join(cache_path, 'locks')
+DEFAULT_LOCK_TIMEOUT = 60
+LOCK_POLL_INTERVAL = 0.01
+MAX_NAME_LENGTH = 120
+
+_unsafe_re = re.compile(r'[^\w.-]')
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def lock_path(key):
+    """Get the lock file of a key. Long keys, e.g. many currency pairs,
+    are shortened with a hash."""
+    name = _unsafe_re.sub('_', '_'.join(str(part) for part in key))
+    if len(name) > MAX_NAME_LENGTH:
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        name = '{}_{}'.format(name[:MAX_NAME_LENGTH - 41], digest)
+    return os.path.join(LOCK_PATH, name + '.lock')
+
+
+@contextmanager
+def file_lock(path, timeout=None):
+    """Hold an exclusive lock on a file, shared with other processes.
+    If the lock is not acquired within timeout seconds, the block runs
+    without it, so a stuck process can not block the others for good.
+
+    :param path: the lock file.
+    :param timeout: seconds to wait, default the 'lock_timeout' option.
+    """
+    if fcntl is None:
+        yield
+        return
+    if timeout is None:
+        timeout = float(config.get('lock_timeout', DEFAULT_LOCK_TIMEOUT))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        locked = False
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    log.warning('Timed out waiting for lock: {}'.format(path))
+                    break
+                time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            if locked:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def single_flight(key, fetch, check=None):
+    """Run a fetch once for all concurrent callers with the same key.
+
+    Within the process, the first caller runs the fetch, and callers
+    arriving while it runs wait for it and share its result (or
+    exception). Across processes, the fetch runs while holding a lock
+    file under the cache directory. Once a caller holds the lock, it
+    calls `check`, which looks in the cache for a result saved by the
+    process it waited for, and only fetches if there is none.
+
+    :param key: a tuple identifying the fetch, e.g. (provider id,
+        transaction, payment).
+    :param fetch: a function doing the fetch, and saving the result.
+    :param check: a function returning the result if another process
+        saved it in the meantime, or None.
+
+    :returns: the result of fetch, or of check.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        log.debug('Waiting for fetch in flight: {}'.format(key))
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        with file_lock(lock_path(key)):
+            result = check() if check else None
+            if result is not None:
+                log.info('Fetched by another process: {}'.format(key))
+            else:
+                result = fetch()
+        flight.result = result
+        return result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
@@ -0,0 +1,217 @@
+"""
+    Curry
+    ~~~~~
+
+    Triangulation of exchange rates over cached currency pairs
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import logging
+import threading
+
+from curry.config import config
+
+log = logging.getLogger(__name__)
+
+__all__ = ['RateGraph', 'get_rate_graph', 'triangulation_mode']
+
+SHORTEST, FRESHEST = 'shortest', 'freshest'
+DEFAULT_MAX_HOPS = 2
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def triangulation_mode():
+    """Get the 'triangulate' option: 'shortest' (default) to prefer
+    paths with the fewest hops, 'freshest' to prefer the paths whose
+    oldest rate is the most recent, or None if disabled."""
+    mode = config.get('triangulate', SHORTEST)
+    if mode in (0, '0', 'no', 'off'):
+        return None
+    return FRESHEST if mode == FRESHEST else SHORTEST
+
+
+class RateGraph:
+    """A graph with a node per currency, and an edge per cached
+    exchange rate, in both directions. Exchange rates missing from the
+    cache are derived along paths of cached rates, e.g. EUR/NOK from
+    EUR/USD and USD/NOK, or NOK/EUR from the inverse of EUR/NOK.
+
+    The chosen path of every pair is kept, and dropped once any of its
+    edges changes.
+
+    :param max_hops: the longest path to consider.
+    """
+
+    def __init__(self, max_hops=DEFAULT_MAX_HOPS):
+        self.max_hops = max_hops
+        self.version = None
+        self.edges = {}
+        self._paths = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<RateGraph edges={} paths={}>'.format(len(self.edges),
+                                                      len(self._paths))
+
+    def sync(self, cache, version=None, offset=None):
+        """Bring the graph up to date with a per-pair cache, dropping
+        the paths using any edge that changed.
+
+        :param cache: a per-pair cache dictionary, on the form
+            ``{transaction: {payment: {'rate': ..., 'timestamp': ...}}}``.
+        :param version: the cache backend version token the cache was
+            loaded at. A sync with an unchanged token is skipped.
+        :param offset: a function of (transaction, payment, data)
+            giving the seconds to add to the timestamp of a pair, e.g.
+            so edges with their own cache timeouts compare with one
+            min_timestamp.
+        """
+        with self._lock:
+            if version is not None and version == self.version:
+                return
+            edges = {}
+            for transaction, payments in cache.items():
+                for payment, data in payments.items():
+                    rate = data.get('rate')
+                    if not rate or rate <= 0 or transaction == payment:
+                        continue
+                    timestamp = data.get('timestamp') or 0
+                    if offset is not None:
+                        timestamp += offset(transaction, payment, data)
+                    edges[(transaction, payment)] = (rate, timestamp)
+                    inverse = (payment, transaction)
+                    if inverse not in cache.get(payment, {}):
+                        edges[inverse] = (1 / rate, timestamp)
+
+            changed = set(self.edges.items()) ^ set(edges.items())
+            for edge, _ in changed:
+                self._invalidate(edge)
+            if changed:
+                # A new edge may connect pairs that had no path.
+                self._paths = {pair: path for pair, path in
+                               self._paths.items() if path is not None}
+
+            self.edges = edges
+            self.version = version
+
+    def _invalidate(self, edge):
+        for pair in self._users.pop(edge, ()):
+            path = self._paths.pop(pair, None)
+            for hop in zip(path or (), (path or ())[1:]):
+                self._users.get(hop, set()).discard(pair)
+
+    def _neighbours(self):
+        neighbours = {}
+        for (transaction, payment), (_, timestamp) in self.edges.items():
+            neighbours.setdefault(transaction, []).append((payment,
+                                                           timestamp))
+        return neighbours
+
+    def find_path(self, transaction, payment, min_timestamp=0,
+                  mode=SHORTEST):
+        """Find a path of cached exchange rates between two currencies.
+
+        Paths are searched hop by hop, up to `max_hops`, keeping the
+        freshest path (the one whose oldest edge is the most recent) to
+        every currency for each number of hops.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+        :param min_timestamp: ignore edges older than this.
+        :param mode: SHORTEST to use the freshest of the paths with the
+            fewest hops, or FRESHEST to use the freshest of all paths.
+
+        :returns: a list of currencies from transaction to payment, or
+            None if there is no path.
+        """
+        neighbours = self._neighbours()
+        # currency -> (freshness, path), for paths of the current length
+        layer = {transaction: (float('inf'), [transaction])}
+        best = None
+        for _ in range(self.max_hops):
+            next_layer = {}
+            for node, (freshness, path) in layer.items():
+                for neighbour, timestamp in neighbours.get(node, ()):
+                    if timestamp < min_timestamp or neighbour in path:
+                        continue
+                    candidate = (min(freshness, timestamp),
+                                 path + [neighbour])
+                    if neighbour not in next_layer or \
+                            candidate[0] > next_layer[neighbour][0]:
+                        next_layer[neighbour] = candidate
+            found = next_layer.pop(payment, None)
+            if found and (best is None or found[0] > best[0]):
+                best = found
+                if mode == SHORTEST:
+                    break
+            layer = next_layer
+            if not layer:
+                break
+        return best[1] if best else None
+
+    def path_rate(self, path, min_timestamp=0):
+        """Multiply the exchange rates along a path.
+
+        :returns: the exchange rate, or None if an edge is missing or
+            older than min_timestamp.
+        """
+        rate = 1.0
+        for edge in zip(path, path[1:]):
+            if edge not in self.edges:
+                return None
+            edge_rate, timestamp = self.edges[edge]
+            if timestamp < min_timestamp:
+                return None
+            rate *= edge_rate
+        return rate
+
+    def triangulate(self, transaction, payment, min_timestamp=0,
+                    mode=SHORTEST):
+        """Derive the exchange rate of a currency pair from the cached
+        exchange rates, reusing the path chosen last time while all of
+        its edges are unchanged and fresh enough.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+        :param min_timestamp: ignore edges older than this.
+        :param mode: SHORTEST or FRESHEST, see `find_path`.
+
+        :returns: a (rate, path) tuple, or None.
+        """
+        pair = (transaction, payment)
+        with self._lock:
+            if pair in self._paths:
+                path = self._paths[pair]
+                if path is None:
+                    return None
+                rate = self.path_rate(path, min_timestamp)
+                if rate is not None:
+                    return rate, path
+                self._invalidate_pair(pair)
+
+            path = self.find_path(transaction, payment, min_timestamp, mode)
+            self._paths[pair] = path
+            if path is None:
+                return None
+            for edge in zip(path, path[1:]):
+                self._users.setdefault(edge, set()).add(pair)
+            return self.path_rate(path, min_timestamp), path
+
+    def _invalidate_pair(self, pair):
+        path = self._paths.pop(pair, None) or ()
+        for edge in zip(path, path[1:]):
+            self._users.get(edge, set()).discard(pair)
+
+
+def get_rate_graph(provider):
+    """Get the rate graph of an API provider, shared by all its
+    instances in this process."""
+    with _graphs_lock:
+        if provider not in _graphs:
+            _graphs[provider] = RateGraph(
+                int(config.get('max_hops', DEFAULT_MAX_HOPS)))
+        return _graphs[provider]
@@ -0,0 +1,290 @@
+"""
+    Curry
+    ~~~~~
+
+    Hedged requests across several API providers
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import (ThreadPoolExecutor, FIRST_COMPLETED,
+                                wait)
+
+from curry.config import config
+from curry.api import (APIProvider, APIError, Providers, get_api_provider,
+                       http_requests_made)
+
+log = logging.getLogger(__name__)
+
+ID = 'hedged'
+
+DEFAULT_WINDOW = 50
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_DELAY = 1.0
+DEFAULT_MAX_ERROR_RATE = 0.5
+
+_records = {}
+_records_lock = threading.Lock()
+
+
+class ProviderRecord:
+    """A rolling record of the latencies and errors of one API
+    provider, over the last `window` requests.
+
+    :param window: the number of requests to keep.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        """Record a finished request.
+
+        :param seconds: the time the request took.
+        :param ok: False if the request failed.
+        """
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(seconds)
+
+    def percentile(self, q):
+        """Get the q-th percentile (0-100) of the successful request
+        latencies, or None if there are none."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        i = int(round(q / 100 * (len(latencies) - 1)))
+        i = max(0, min(len(latencies) - 1, i))
+        return latencies[i]
+
+    @property
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def __repr__(self):
+        return '<ProviderRecord p50={} errors={:.0%}>'.format(
+            self.percentile(50), self.error_rate)
+
+
+def get_provider_record(api):
+    """Get the record of an API provider, shared by every hedged
+    provider in this process."""
+    with _records_lock:
+        if api not in _records:
+            _records[api] = ProviderRecord(
+                int(config.get('window', DEFAULT_WINDOW, section=ID)))
+        return _records[api]
+
+
+class HedgedAPI(APIProvider):
+    """A composite API provider, which asks the fastest healthy API
+    provider first, and if it has not answered within the configured
+    percentile of its past latencies, sends a hedged request to the
+    next best. The first valid exchange rate wins.
+
+    A currency pair with a fresh cached exchange rate from any of the
+    API providers is answered from the cache, without a request.
+    Otherwise the API providers are ranked by their median latency,
+    with providers whose error rate exceeds `max_error_rate` moved
+    last. The API
+    providers to use are read from the 'providers' option in the
+    '[hedged]' config section, and default to all registered API
+    providers whose required options are configured.
+
+    Exchange rates are cached by the API providers asked, so the hedged
+    provider keeps no cache of its own.
+    """
+    id_ = ID
+
+    def __init__(self, api_key=None, refresh_cache=False, providers=None):
+        APIProvider.__init__(self, api_key=api_key,
+                             refresh_cache=refresh_cache)
+        if providers is None:
+            providers = config.get('providers', section=ID)
+            providers = providers.split() if providers else None
+        self.providers = providers or self._available_providers()
+        self.hedge_percentile = config.getfloat(
+            'hedge_percentile', DEFAULT_HEDGE_PERCENTILE, section=ID)
+        self.hedge_delay = config.getfloat(
+            'hedge_delay', DEFAULT_HEDGE_DELAY, section=ID)
+        self.max_error_rate = config.getfloat(
+            'max_error_rate', DEFAULT_MAX_ERROR_RATE, section=ID)
+        self._apis = {}
+
+        if not self.providers:
+            raise APIError('No API providers available', self.id_)
+
+    def _available_providers(self):
+        available = []
+        for api, provider in sorted(Providers.items()):
+            if api == self.id_:
+                continue
+            requires = provider.get('requires', [])
+            if all(config.get(option, section=api) for option in requires):
+                available.append(api)
+        return available
+
+    def _get_api(self, api):
+        if api not in self._apis:
+            klass = get_api_provider(api)['klass']
+            api_key = config.get('api_key', section=api)
+            self._apis[api] = klass(api_key=api_key,
+                                    refresh_cache=self.refresh_cache)
+        return self._apis[api]
+
+    def rank(self, cached=()):
+        """Rank the API providers, best first.
+
+        :param cached: the API providers with a fresh cached exchange
+            rate for the currency pair, which are ranked first.
+
+        :returns: a list of API provider ids.
+        """
+        def key(api):
+            record = get_provider_record(api)
+            unhealthy = record.error_rate > self.max_error_rate
+            # Unmeasured API providers are tried early, to get a record.
+            latency = record.percentile(50) or 0.0
+            return (api not in cached, unhealthy, latency)
+
+        return sorted(self.providers, key=key)
+
+    def get_cached_rates(self, transaction, payment):
+        """Get the fresh cached exchange rates for a currency pair from
+        the API providers, without any requests.
+
+        :returns: a dictionary mapping API provider ids to exchange
+            rates.
+        """
+        rates = {}
+        for api in self.providers:
+            try:
+                rate = self._get_api(api).get_exchange_rate_from_cache(
+                    transaction, payment)
+            except APIError:
+                continue
+            if rate and rate > 0:
+                rates[api] = rate
+        return rates
+
+    def _hedge_delay(self, api):
+        latency = get_provider_record(api).percentile(self.hedge_percentile)
+        return latency if latency is not None else self.hedge_delay
+
+    def _request(self, api, transaction, payment):
+        # Only lookups that went to the network are recorded, as cache
+        # hits would pull the hedge delay towards zero.
+        record = get_provider_record(api)
+        requests = http_requests_made()
+        start = time.perf_counter()
+        try:
+            rate = self._get_api(api).get_exchange_rate(transaction, payment)
+        except Exception:
+            if http_requests_made() != requests:
+                record.record(time.perf_counter() - start, False)
+            raise
+        if http_requests_made() != requests:
+            ok = bool(rate) and rate > 0
+            record.record(time.perf_counter() - start, ok)
+        return rate
+
+    def fetch_exchange_rate(self, transaction, payment):
+        """Get the exchange rate for a currency pair through the hedged
+        requests, see `get_exchange_rate`."""
+        return self.get_exchange_rate(transaction, payment)
+
+    def get_exchange_rates(self, pairs):
+        """Get the exchange rates for many currency pairs, each through
+        the hedged requests, see `get_exchange_rate`.
+
+        :param pairs: an iterable of (transaction, payment) tuples.
+
+        :returns: a dictionary mapping the pairs to exchange rates, or
+            raises an APIError.
+        """
+        return {pair: self.get_exchange_rate(*pair)
+                for pair in dict.fromkeys(pairs)}
+
+    def save_cache_many(self, rates):
+        """Do nothing, as the API providers asked cache the rates."""
+
+    def get_exchange_rate(self, transaction, payment):
+        """Get the exchange rate for a currency pair (transaction
+        currency -> payment currency) from the first API provider to
+        answer with a valid rate.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+
+        :returns: the exchange rate or raises an APIError.
+        """
+        cached = self.get_cached_rates(transaction, payment)
+        queue = self.rank(cached)
+        if queue[0] in cached:
+            log.info('Using cached exchange rate from {}'.format(queue[0]))
+            return cached[queue[0]]
+
+        # A pool of its own for every lookup, so requests abandoned by
+        # earlier lookups never hold up the next one.
+        executor = ThreadPoolExecutor(max_workers=len(queue),
+                                      thread_name_prefix='curry-hedge')
+        try:
+            return self._hedge(executor, queue, transaction, payment)
+        finally:
+            executor.shutdown(wait=False)
+
+    def _hedge(self, executor, queue, transaction, payment):
+        pending, error = {}, None
+
+        def launch():
+            api = queue.pop(0)
+            log.info('Requesting {}/{} from {}'
+                     .format(transaction, payment, api))
+            future = executor.submit(self._request, api, transaction, payment)
+            pending[future] = api
+            return api
+
+        last = launch()
+        while pending:
+            timeout = self._hedge_delay(last) if queue else None
+            done, _ = wait(pending, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+
+            if not done:
+                log.info('No answer from {} within {:.3f}s, hedging'
+                         .format(last, timeout))
+                last = launch()
+                continue
+
+            for future in done:
+                api = pending.pop(future)
+                try:
+                    rate = future.result()
+                except Exception as e:
+                    log.warning('{} failed: {}'.format(api, e))
+                    error = e
+                    continue
+                if rate and rate > 0:
+                    log.info('Using exchange rate from {}'.format(api))
+                    return rate
+                log.warning('{} returned an invalid rate: {}'
+                            .format(api, rate))
+
+            if not pending and queue:
+                last = launch()
+
+        if error:
+            raise error
+        raise APIError('No API provider returned an exchange rate',
+                       self.id_)
@@ -0,0 +1,326 @@
+"""
+    Curry
+    ~~~~~
+
+    Historical exchange rates, stored in columns
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import mmap
+import bisect
+import logging
+import datetime
+import threading
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from curry.config import config, cache_path
+
+log = logging.getLogger(__name__)
+
+__all__ = ['RateHistory', 'history_enabled', 'list_bases', 'today']
+
+HISTORY_PATH = os.path.join(cache_path, 'history')
+DATES_FILENAME = 'dates.i8'
+COLUMN_SUFFIX = '.f8'
+
+NAN = float('nan')
+SCAN_BLOCK = 64
+
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def to_day(date):
+    """Convert a date to the number of days since 1970-01-01."""
+    return date.toordinal() - _EPOCH
+
+
+def from_day(day):
+    """Convert a number of days since 1970-01-01 to a date."""
+    return datetime.date.fromordinal(day + _EPOCH)
+
+
+def today():
+    """Get the current date (UTC), which rates are recorded under."""
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def history_enabled():
+    """Check the 'history' option, which enables recording rates."""
+    return bool(config.get('history', 1))
+
+
+def list_bases(provider, directory=None):
+    """Get the base currencies with a history for an API provider."""
+    try:
+        return sorted(os.listdir(os.path.join(directory or HISTORY_PATH,
+                                              provider)))
+    except FileNotFoundError:
+        return []
+
+
+def _read_array(path, typecode, start, stop):
+    """Read the items from start up to stop of a binary array file.
+    Missing items are left out."""
+    values = array(typecode)
+    if stop <= start:
+        return values
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start * values.itemsize)
+            data = f.read((stop - start) * values.itemsize)
+    except FileNotFoundError:
+        return values
+    values.frombytes(data[:len(data) // values.itemsize * values.itemsize])
+    return values
+
+
+class RateHistory:
+    """The exchange rates of an API provider relative to one base
+    currency, by date. The history is stored column-wise in a
+    directory: a 'dates.i8' file with the sorted dates (int64 days
+    since 1970-01-01), and a '<CODE>.f8' file per currency with the
+    rates (float64, NaN where unknown) on the same rows. All files are
+    in native byte order.
+
+    Lookups binary search the memory mapped dates, and then only read
+    the rows they need from the columns, so no query loads the whole
+    history.
+
+    :param provider: the API provider id.
+    :param base: the base currency.
+    :param directory: the directory holding every history.
+    """
+
+    def __init__(self, provider, base, directory=None):
+        self.provider = provider
+        self.base = base
+        self.path = os.path.join(directory or HISTORY_PATH, provider, base)
+        self._dates_path = os.path.join(self.path, DATES_FILENAME)
+        with _locks_lock:
+            self._lock = _locks.setdefault(self.path, threading.Lock())
+
+    def _column_path(self, code):
+        return os.path.join(self.path, code + COLUMN_SUFFIX)
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self._dates_path) // 8
+        except FileNotFoundError:
+            return 0
+
+    def __repr__(self):
+        return '<RateHistory {}/{} rows={}>'.format(
+            self.provider, self.base, len(self))
+
+    def currencies(self):
+        """Get the currency codes with a column in the history."""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(COLUMN_SUFFIX)] for name in names
+                      if name.endswith(COLUMN_SUFFIX))
+
+    def _index(self, day, right=True):
+        """Binary search the dates for a day.
+
+        :returns: the insertion point of the day, after (right) or
+            before any equal date.
+        """
+        search = bisect.bisect_right if right else bisect.bisect_left
+        try:
+            f = open(self._dates_path, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            size = os.fstat(f.fileno()).st_size // 8 * 8
+            if not size:
+                return 0
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m, \
+                    memoryview(m) as view, view.cast('q') as days:
+                return search(days, day)
+
+    def _dates(self, start, stop):
+        return _read_array(self._dates_path, 'q', start, stop)
+
+    def _column(self, code, start, stop):
+        values = _read_array(self._column_path(code), 'd', start, stop)
+        values.extend([NAN] * (stop - start - len(values)))
+        return values
+
+    def has_date(self, date):
+        """Check if there is a row for a date."""
+        i = self._index(to_day(date))
+        return i > 0 and self._dates(i - 1, i)[0] == to_day(date)
+
+    def get(self, code, date):
+        """Get the last known rate of a currency on or before a date.
+
+        :param code: the currency code.
+        :param date: a `datetime.date`.
+
+        :returns: a (date, rate) tuple, or None if there is no rate.
+        """
+        if not os.path.exists(self._column_path(code)):
+            return None
+        stop = self._index(to_day(date))
+        while stop > 0:
+            start = max(0, stop - SCAN_BLOCK)
+            values = self._column(code, start, stop)
+            for i in reversed(range(len(values))):
+                if values[i] == values[i]:
+                    day = self._dates(start + i, start + i + 1)[0]
+                    return from_day(day), values[i]
+            stop = start
+        return None
+
+    def row(self, date):
+        """Get the rates of the last row on or before a date.
+
+        :param date: a `datetime.date`.
+
+        :returns: a (date, rates) tuple, where rates is a dictionary of
+            the known rates in the row, or None if there is no row.
+        """
+        i = self._index(to_day(date))
+        if not i:
+            return None
+        rates = {}
+        for code in self.currencies():
+            rate = self._column(code, i - 1, i)[0]
+            if rate == rate:
+                rates[code] = rate
+        return from_day(self._dates(i - 1, i)[0]), rates
+
+    def range(self, code, start=None, end=None):
+        """Get the rates of a currency between two dates, inclusive.
+
+        :param code: the currency code.
+        :param start: the first date, default the start of history.
+        :param end: the last date, default the end of history.
+
+        :returns: a list of (date, rate) tuples, leaving out dates
+            without a known rate.
+        """
+        i = self._index(to_day(start), right=False) if start else 0
+        j = self._index(to_day(end)) if end else len(self)
+        days, values = self._dates(i, j), self._column(code, i, j)
+        return [(from_day(day), rate) for day, rate in zip(days, values)
+                if rate == rate]
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, '.lock'), 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, date, rates):
+        """Record the rates of a date. See `extend`.
+
+        :param date: a `datetime.date`.
+        :param rates: a dictionary mapping currency codes to rates.
+        """
+        self.extend([(date, rates)])
+
+    def extend(self, rows):
+        """Record the rates of many dates. Rates for a date already in
+        the history update its row. Rows after the last date are
+        appended to the files, while earlier dates need every file to
+        be rewritten, so backfill as many dates at once as possible.
+
+        :param rows: an iterable of (date, rates) tuples.
+        """
+        merged = {}
+        for date, rates in rows:
+            merged.setdefault(to_day(date), {}).update(
+                (code, rate) for code, rate in rates.items()
+                if rate is not None)
+        if not merged:
+            return
+
+        with self._locked():
+            n = len(self)
+            last = self._dates(n - 1, n)[0] if n else None
+            days = sorted(merged)
+            if last is not None and days[0] < last:
+                self._rewrite(merged, n)
+                return
+
+            if days[0] == last:
+                for code, rate in merged[last].items():
+                    self._write_column(code, n - 1, [rate], n)
+                days = days[1:]
+            if not days:
+                return
+
+            codes = set()
+            for day in days:
+                codes.update(merged[day])
+            for code in codes:
+                self._write_column(code, n, [merged[day].get(code, NAN)
+                                             for day in days], n)
+            # The dates are written last, as they decide the row count.
+            self._write_array(self._dates_path, 'q', n, days, n)
+
+    def _write_array(self, path, typecode, start, values, n):
+        """Write values from row start, after truncating or padding
+        the file to n rows."""
+        values = array(typecode, values)
+        with open(path, 'ab'):
+            pass
+        with open(path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size // values.itemsize
+            if size > n:
+                f.truncate(n * values.itemsize)
+            elif size < n:
+                fill = NAN if typecode == 'd' else 0
+                f.seek(size * values.itemsize)
+                f.write(array(typecode, [fill] * (n - size)).tobytes())
+            f.seek(start * values.itemsize)
+            f.write(values.tobytes())
+
+    def _write_column(self, code, start, values, n):
+        self._write_array(self._column_path(code), 'd', start, values, n)
+
+    def _rewrite(self, merged, n):
+        log.info('Rewriting history: {}'.format(self.path))
+        old_days = list(self._dates(0, n))
+        codes = set(self.currencies())
+        for rates in merged.values():
+            codes.update(rates)
+
+        days = sorted(set(old_days) | set(merged))
+        index = {day: i for i, day in enumerate(days)}
+        for code in codes:
+            values = array('d', [NAN] * len(days))
+            for day, rate in zip(old_days, self._column(code, 0, n)):
+                values[index[day]] = rate
+            for day, rates in merged.items():
+                if code in rates:
+                    values[index[day]] = rates[code]
+            self._replace(self._column_path(code), values)
+        self._replace(self._dates_path, array('q', days))
+
+    def _replace(self, path, values):
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(values.tobytes())
+        os.replace(tmp, path)
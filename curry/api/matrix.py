@@ -0,0 +1,120 @@
+"""
+    Curry
+    ~~~~~
+
+    Vectorized cross-rate matrix
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import logging
+
+import numpy as np
+
+from curry.api import APIError
+
+log = logging.getLogger(__name__)
+
+
+class RateMatrix:
+    """An N×N matrix of cross exchange rates, where ``matrix[i, j]`` is
+    the exchange rate from currency ``codes[i]`` to currency
+    ``codes[j]``.
+
+    :param codes: a sorted sequence of currency codes.
+    :param matrix: an N×N float64 array of cross rates.
+    """
+
+    def __init__(self, codes, matrix):
+        self.codes = np.asarray(codes, dtype='U3')
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+
+        assert self.matrix.shape == (len(self.codes), len(self.codes))
+
+    @classmethod
+    def from_base_rates(cls, base, rates):
+        """Build a matrix from exchange rates relative to one base
+        currency, as cached by the `RateTableProvider` subclasses.
+
+        :param base: the base currency.
+        :param rates: a dictionary mapping currency codes to the amount
+            of that currency one unit of the base currency buys.
+        """
+        rates = {code: rate for code, rate in rates.items()
+                 if rate is not None and rate > 0}
+        rates.setdefault(base, 1.0)
+
+        codes = sorted(rates)
+        r = np.array([rates[code] for code in codes], dtype=np.float64)
+
+        # from i to j: (1 / r[i]) * r[j]
+        matrix = r[np.newaxis, :] / r[:, np.newaxis]
+        log.debug('Built {0}x{0} rate matrix (base: {1})'
+                  .format(len(codes), base))
+
+        return cls(codes, matrix)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def indices(self, codes):
+        """Look up the matrix indices for an array of currency codes.
+
+        :param codes: a currency code, or an array-like of codes.
+
+        :returns: an integer array of indices, or raises an APIError if
+            any of the codes are invalid or unknown.
+        """
+        # Not converted to 'U3' directly, which would silently truncate
+        # e.g. 'EURX' to 'EUR'.
+        codes = np.char.upper(np.asarray(codes, dtype=str))
+        invalid = (np.char.str_len(codes) != 3) | ~np.char.isalpha(codes)
+        if np.any(invalid):
+            raise APIError('Invalid currency code(s): {}'
+                           .format(', '.join(np.unique(codes[invalid]))))
+        idx = np.searchsorted(self.codes, codes)
+        idx = np.clip(idx, 0, len(self.codes) - 1)
+
+        unknown = self.codes[idx] != codes
+        if np.any(unknown):
+            raise APIError('Unknown currency code(s): {}'
+                           .format(', '.join(np.unique(codes[unknown]))))
+        return idx
+
+    def rate(self, transaction, payment):
+        """Get the exchange rate for a single currency pair.
+
+        :param transaction: transaction (from) currency.
+        :param payment: payment (to) currency.
+        """
+        i, j = self.indices([transaction, payment])
+        return float(self.matrix[i, j])
+
+    def rates(self, from_codes, to_codes):
+        """Get the exchange rates for arrays of currency pairs. The code
+        arrays are broadcast against each other.
+
+        :param from_codes: transaction (from) currency codes.
+        :param to_codes: payment (to) currency codes.
+
+        :returns: a float64 array of exchange rates.
+        """
+        return self.matrix[self.indices(from_codes), self.indices(to_codes)]
+
+    def convert(self, amounts, from_codes, to_codes):
+        """Convert an array of amounts in a single vectorized operation.
+        The amounts and code arrays are broadcast against each other,
+        so a single code can be given for either side.
+
+        :param amounts: the amounts to convert.
+        :param from_codes: transaction (from) currency codes.
+        :param to_codes: payment (to) currency codes.
+
+        :returns: a float64 array of converted amounts.
+        """
+        amounts = np.asarray(amounts, dtype=np.float64)
+        return amounts * self.rates(from_codes, to_codes)
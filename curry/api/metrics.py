@@ -0,0 +1,314 @@
+"""
+    Curry
+    ~~~~~
+
+    Performance metrics for the API providers
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import time
+import weakref
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+__all__ = ['Histogram', 'Metrics', 'metrics']
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+"""Upper bounds, in seconds, of the latency histogram buckets."""
+
+CACHE_EVENTS = ('hit', 'stale', 'expired', 'miss', 'triangulated')
+"""Cache lookup outcomes. 'triangulated' counts misses answered by
+deriving the rate from other cached rates."""
+
+
+class Histogram:
+    """A histogram with fixed bucket upper bounds.
+
+    :param buckets: the sorted upper bounds of the buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Get (upper bound, cumulative count) pairs, ending with the
+        '+Inf' bucket."""
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0-1) as the upper bound of the
+        bucket it falls in, or None if nothing is observed."""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': [[bound, count] for bound, count in self.cumulative()
+                        if bound != float('inf')],
+        }
+
+
+class Metrics:
+    """Collects per API provider: HTTP request latencies, response
+    bytes and errors, cache hits, stale hits, expirations and misses,
+    and the time spent parsing responses.
+
+    Cache lookups are counted per thread, so recording them takes no
+    lock, and summed up when read. The counts of a thread are moved to
+    a shared total once the thread is gone, so they do not pile up in a
+    daemon serving every client in a new thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cache_counts = {}
+        self._cache_totals = {}
+        self._finished = deque()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self.requests = {}
+            self.response_bytes = {}
+            self.errors = {}
+            self.parsing = {}
+            self._merge_finished()
+            self._cache_totals.clear()
+            for counts in self._cache_counts.values():
+                counts.clear()
+
+    @property
+    def cache(self):
+        """The cache lookups of every thread, summed up per API
+        provider and event."""
+        with self._lock:
+            self._merge_finished()
+            thread_counts = [dict(counts) for counts in
+                             self._cache_counts.values()]
+            thread_counts.append(dict(self._cache_totals))
+        cache = {}
+        for counts in thread_counts:
+            for (provider, event), count in counts.items():
+                events = cache.setdefault(provider,
+                                          dict.fromkeys(CACHE_EVENTS, 0))
+                events[event] += count
+        return cache
+
+    def observe_request(self, provider, seconds, nbytes=0, ok=True):
+        """Record an HTTP request.
+
+        :param provider: the API provider id.
+        :param seconds: the time the request took.
+        :param nbytes: the size of the response body.
+        :param ok: False if the request failed without a response.
+        """
+        with self._lock:
+            if not ok:
+                self.errors[provider] = self.errors.get(provider, 0) + 1
+                return
+            self.requests.setdefault(provider, Histogram()).observe(seconds)
+            self.response_bytes[provider] = \
+                self.response_bytes.get(provider, 0) + nbytes
+
+    def record_cache(self, provider, event):
+        """Record a cache lookup.
+
+        :param provider: the API provider id.
+        :param event: one of `CACHE_EVENTS`.
+        """
+        counts = getattr(self._local, 'cache', None)
+        if counts is None:
+            counts = self._local.cache = {}
+            with self._lock:
+                self._merge_finished()
+                self._cache_counts[id(counts)] = counts
+            # The finalizer may run wherever the thread is collected,
+            # even with the lock held, so it only queues the counts.
+            weakref.finalize(threading.current_thread(),
+                             self._finished.append, id(counts))
+        key = (provider, event)
+        counts[key] = counts.get(key, 0) + 1
+
+    def _merge_finished(self):
+        # Move the counts of finished threads to the totals, with the
+        # lock held.
+        while self._finished:
+            counts = self._cache_counts.pop(self._finished.popleft())
+            for key, count in counts.items():
+                self._cache_totals[key] = \
+                    self._cache_totals.get(key, 0) + count
+
+    def observe_parse(self, provider, seconds):
+        """Record the time spent parsing a response.
+
+        :param provider: the API provider id.
+        :param seconds: the time parsing took.
+        """
+        with self._lock:
+            self.parsing.setdefault(provider, Histogram()).observe(seconds)
+
+    @contextmanager
+    def time_parse(self, provider):
+        """A context manager recording the time spent in its block as
+        parse time."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_parse(provider, time.perf_counter() - start)
+
+    def providers(self):
+        cache = self.cache
+        with self._lock:
+            return sorted(set(self.requests) | set(self.errors) |
+                          set(cache) | set(self.parsing))
+
+    def snapshot(self):
+        """Get everything recorded so far.
+
+        :returns: a dictionary keyed by API provider id.
+        """
+        result = {}
+        caches = self.cache
+        for provider in self.providers():
+            with self._lock:
+                cache = caches.get(provider, dict.fromkeys(CACHE_EVENTS, 0))
+                lookups = sum(cache[event] for event in
+                              ('hit', 'stale', 'expired', 'miss'))
+                hits = cache['hit'] + cache['stale']
+                result[provider] = {
+                    'requests': self.requests.get(provider,
+                                                  Histogram()).as_dict(),
+                    'response_bytes': self.response_bytes.get(provider, 0),
+                    'errors': self.errors.get(provider, 0),
+                    'cache': cache,
+                    'cache_hit_ratio': hits / lookups if lookups else None,
+                    'parsing': self.parsing.get(provider,
+                                                Histogram()).as_dict(),
+                }
+        return result
+
+    def format_text(self):
+        """Format the metrics as a human readable summary."""
+        lines = []
+        for provider, m in sorted(self.snapshot().items()):
+            requests, parsing = m['requests'], m['parsing']
+            lines.append('{}:'.format(provider))
+            lines.append('  requests:   {} ({} errors), {} bytes received'
+                         .format(requests['count'], m['errors'],
+                                 m['response_bytes']))
+            if requests['count']:
+                lines.append('  latency:    {:.1f} ms mean, p50 <= {}, '
+                             'p95 <= {}'.format(
+                                 requests['sum'] / requests['count'] * 1000,
+                                 _format_bound(self._quantile(provider, .5)),
+                                 _format_bound(self._quantile(provider, .95))))
+            ratio = m['cache_hit_ratio']
+            lines.append('  cache:      {hit} hits, {stale} stale, '
+                         '{expired} expired, {miss} misses, '
+                         '{triangulated} triangulated'
+                         .format(**m['cache']) +
+                         (', {:.0%} hit ratio'.format(ratio)
+                          if ratio is not None else ''))
+            if parsing['count']:
+                lines.append('  parsing:    {} responses, {:.3f} ms mean'
+                             .format(parsing['count'],
+                                     parsing['sum'] / parsing['count'] *
+                                     1000))
+        return '\n'.join(lines)
+
+    def _quantile(self, provider, q):
+        with self._lock:
+            return self.requests[provider].quantile(q)
+
+    def to_prometheus(self):
+        """Format the metrics in the Prometheus text exposition
+        format."""
+        cache = self.cache
+        with self._lock:
+            requests = dict(self.requests)
+            response_bytes = dict(self.response_bytes)
+            errors = dict(self.errors)
+            parsing = dict(self.parsing)
+
+        lines = []
+        _prometheus_histogram(lines, 'curry_request_duration_seconds',
+                              'HTTP request latency per API provider.',
+                              requests)
+        lines.append('# HELP curry_response_bytes_total Bytes received per '
+                     'API provider.')
+        lines.append('# TYPE curry_response_bytes_total counter')
+        for provider, value in sorted(response_bytes.items()):
+            lines.append('curry_response_bytes_total{{provider="{}"}} {}'
+                         .format(provider, value))
+        lines.append('# HELP curry_request_errors_total Failed HTTP '
+                     'requests per API provider.')
+        lines.append('# TYPE curry_request_errors_total counter')
+        for provider, value in sorted(errors.items()):
+            lines.append('curry_request_errors_total{{provider="{}"}} {}'
+                         .format(provider, value))
+        lines.append('# HELP curry_cache_lookups_total Cache lookups per '
+                     'API provider and outcome.')
+        lines.append('# TYPE curry_cache_lookups_total counter')
+        for provider, events in sorted(cache.items()):
+            for event in CACHE_EVENTS:
+                lines.append('curry_cache_lookups_total{{provider="{}",'
+                             'event="{}"}} {}'
+                             .format(provider, event, events[event]))
+        _prometheus_histogram(lines, 'curry_parse_duration_seconds',
+                              'Response parse time per API provider.',
+                              parsing)
+        return '\n'.join(lines) + '\n'
+
+
+def _format_bound(bound):
+    if bound is None:
+        return '-'
+    if bound == float('inf'):
+        return '+Inf'
+    return '{:g} ms'.format(bound * 1000)
+
+
+def _prometheus_histogram(lines, name, help, histograms):
+    lines.append('# HELP {} {}'.format(name, help))
+    lines.append('# TYPE {} histogram'.format(name))
+    for provider, h in sorted(histograms.items()):
+        for bound, count in h.cumulative():
+            le = '+Inf' if bound == float('inf') else '{:g}'.format(bound)
+            lines.append('{}_bucket{{provider="{}",le="{}"}} {}'
+                         .format(name, provider, le, count))
+        lines.append('{}_sum{{provider="{}"}} {}'
+                     .format(name, provider, h.sum))
+        lines.append('{}_count{{provider="{}"}} {}'
+                     .format(name, provider, h.count))
+
+
+metrics = Metrics()
+"""The metrics collected in this process."""
@@ -7,11 +7,41 @@
     Copyright: (c) 2014 Einar Uvsløkk
     License: GNU General Public License (GPL) version 3 or later
 """
-from .yahoo import Yahoo
-from .rate_exchange import RateExchange
-from .exchangerate_api import ExchangeRateAPI
-from .openexchangerates import OpenExchangeRates
-from .oanda import Oanda
+import importlib
+
+from curry.api import register_api_provider
+
+# The API providers are registered from this metadata alone. Each
+# provider module, and its dependencies, is only imported once the API
+# provider is used.
+_providers = [
+    # (id, class name, module, requires)
+    ('finance.yahoo.com', 'Yahoo', 'yahoo', []),
+    ('rate-exchange.appspot.com', 'RateExchange', 'rate_exchange', []),
+    ('exchangerate-api.com', 'ExchangeRateAPI', 'exchangerate_api',
+     ['api_key']),
+    ('openexchangerates.org', 'OpenExchangeRates', 'openexchangerates',
+     ['api_key']),
+    ('oanda.com', 'Oanda', 'oanda', []),
+]
+
+_modules = {}
+for id_, name, module, requires in _providers:
+    _modules[name] = module
+    register_api_provider(id_, '{}.{}:{}'.format(__name__, module, name),
+                          requires)
+
+# A composite of the other API providers, see curry.api.hedge
+register_api_provider('hedged', 'curry.api.hedge:HedgedAPI')
 
 __all__ = ['Yahoo', 'RateExchange', 'ExchangeRateAPI', 'OpenExchangeRates',
            'Oanda']
+
+
+def __getattr__(name):
+    """Import provider classes on first access."""
+    if name not in _modules:
+        raise AttributeError('module {!r} has no attribute {!r}'
+                             .format(__name__, name))
+    module = importlib.import_module('.' + _modules[name], __name__)
+    return getattr(module, name)
@@ -7,23 +7,25 @@
     Copyright: (c) 2014 Einar Uvsløkk
     License: GNU General Public License (GPL) version 3 or later
 """
-import os
 import io
 import csv
 import time
-import json
+import re
 import logging
-import requests
-import importlib
+import importlib.util
+from html import unescape as html_unescape
 
-from bs4 import BeautifulSoup
-
-from curry.config import get_cache_file
-from curry.api import (APIProvider, APIError, register_api_provider,
-                       cache_has_expired)
+from curry.api import RateTableProvider, APIError
+from curry.api.metrics import metrics
+from curry.api.history import today
 
 log = logging.getLogger(__name__)
 
+_content_section_re = re.compile(br'id\s*=\s*["\']?content_section\b', re.I)
+_font_re = re.compile(br'<font\b[^>]*>(.*?)</font\s*>', re.I | re.S)
+_break_re = re.compile(br'<br\s*/?>', re.I)
+_tag_re = re.compile(br'<[^>]*>')
+
 base_currency = 'USD'
 currencies = [
     'ADF', 'ADP', 'AED', 'AFN', 'ALL', 'AMD', 'ANG', 'AOA', 'AON', 'ARS',
@@ -49,98 +51,138 @@ currencies = [
 ]
 
 
-class Oanda(APIProvider):
+class Oanda(RateTableProvider):
     id_ = 'oanda.com'
-    url = 'http://www.oanda.com/currency/table?date=10/24/14&' \
+    url = 'http://www.oanda.com/currency/table?date={}&' \
           'date_fmt=us&exch={}&sel_list={}&value=1&format=CSV&redirected=1'
+    date_format = '%m/%d/%y'
 
-    def __init__(self, **kwargs):
-        APIProvider.__init__(self, **kwargs)
-        self.cache_file = get_cache_file(self.id_)
-        # Use lxml as the BeautifulSoup parser if it's installed.
-        if importlib.find_loader('lxml'):
-            self._parser = 'lxml'
-        else:
-            self._parser = 'html.parser'
+    def save_cache(self, rates, inverse_rates):
+        self.cache = {
+            'base': base_currency,
+            'rates': rates,
+            'inverse_rates': inverse_rates,
+            'timestamp': time.time()
+        }
+        log.debug('Saving cache.')
+        self.save_rate_table()
 
-    def get_exchange_rate(self, transaction, payment):
-        self.load_cache()
+    def fetch_rates(self):
+        self.save_cache(*self.do_request(today()))
 
-        base = self.cache.get('base')
-        rates = self.cache.get('rates')
-        # TODO:2014-10-24:einar: take advantage of cached inverse rates
+    def fetch_historical_rates(self, date):
+        rates, inverse_rates = self.do_request(date)
+        return base_currency, rates
 
-        t_rate = rates.get(transaction)
-        p_rate = rates.get(payment)
+    def do_request(self, date):
+        """Request the currency table of a date.
 
-        if transaction == base:
-            return p_rate
+        :param date: a `datetime.date`.
 
-        if payment == base:
-            return 1 / t_rate
+        :returns: two dictionaries (rates and inverse_rates), or raises
+            an APIError.
+        """
+        msg = 'Querying {} is slow. This might take a while...'
+        log.warning(msg.format(self.id_))
+        url = self.url.format(date.strftime(self.date_format), base_currency,
+                              '_'.join(currencies))
+        log.debug('Request url: {}'.format(url))
 
-        return p_rate * (1 / t_rate)
+        r = self.http_get(url)
 
-    def save_cache(self, rates, inverse_rates):
-        self.cache.update({
-            'base': base_currency,
-            'rates': rates,
-            'inverse_rates': inverse_rates,
-            'timestamp': time.time()
-        })
-        log.debug('Saving cache.')
-        with open(self.cache_file, 'w') as f:
-            f.write(json.dumps(self.cache))
-
-    def load_cache(self):
-        if os.path.isfile(self.cache_file):
-            log.info('Loading cache from file.')
-            with open(self.cache_file) as f:
-                self.cache = json.load(f)
-
-        # Incase of no cache, timestamp will be None
-        timestamp = self.cache.get('timestamp')
-        has_expired = not timestamp or cache_has_expired(timestamp)
-        if not self.cache or self.refresh_cache or has_expired:
-            msg = 'Querying {} is slow. This might take a while...'
-            log.warning(msg.format(self.id_))
-            url = self.url.format(base_currency, '_'.join(currencies))
-            log.debug('Request url: {}'.format(url))
-
-            r = requests.get(url)
-            self.dump_http_response(r)
-
-            if r.status_code == 200:
-                data = self._parse_html(r.content)
-                self.save_cache(*data)
-            else:
-                raise APIError('Unable to fetch data.', self.id_)
+        if r.status_code == 200:
+            with metrics.time_parse(self.id_):
+                return self._parse_html(r.content)
+        else:
+            raise APIError('Unable to fetch data.', self.id_)
 
     def _parse_html(self, html):
-        """Parse the return HTML document for exchange rate data.
+        """Parse the return HTML document for exchange rate data. The
+        CSV block is extracted straight from the response bytes, and
+        BeautifulSoup is only used as a fallback if that fails.
 
         :param html: the HTML content to parse.
 
         :returns: two dictionaries (rates and inverse_rates), which
-            contains exchange rates on success, or is empty otherwise.
+            contains exchange rates on success, or raises an APIError.
         """
-        soup = BeautifulSoup(html, self._parser)
+        try:
+            return self._parse_csv(self._extract_csv(html))
+        except ValueError as e:
+            log.info('Falling back to BeautifulSoup: {}'.format(e))
+
+        try:
+            return self._parse_csv(self._extract_csv_with_soup(html))
+        except (AttributeError, ValueError) as e:
+            raise APIError('Unable to parse data: {}'.format(e), self.id_)
+
+    def _extract_csv(self, html):
+        """Extract the CSV block from the HTML document, without
+        building a DOM. The block is the text of the first <font> tag
+        within the first <table> in the 'content_section' element.
+
+        :param html: the HTML content, as bytes.
+
+        :returns: the CSV block, or raises a ValueError.
+        """
+        section = _content_section_re.search(html)
+        if not section:
+            raise ValueError('No content_section found')
+
+        table = html.find(b'<table', section.end())
+        if table < 0:
+            raise ValueError('No table found in content_section')
+
+        font = _font_re.search(html, table)
+        if not font:
+            raise ValueError('No font block found in table')
+
+        block = _break_re.sub(b'\n', font.group(1))
+        block = _tag_re.sub(b'', block)
+        return html_unescape(block.decode('utf-8', 'replace'))
+
+    def _extract_csv_with_soup(self, html):
+        """Extract the CSV block from the HTML document with
+        BeautifulSoup.
+
+        :param html: the HTML content.
+
+        :returns: the CSV block.
+        """
+        from bs4 import BeautifulSoup
+
+        # Use lxml as the BeautifulSoup parser if it's installed.
+        if importlib.util.find_spec('lxml'):
+            parser = 'lxml'
+        else:
+            parser = 'html.parser'
+
+        soup = BeautifulSoup(html, parser)
         content = soup.find(id='content_section').find('table').find('font')
+        return content.text
 
-        f = io.StringIO(content.text)
-        reader = csv.reader(f)
-        data = [row for row in reader if len(row) > 0][1:]
+    def _parse_csv(self, text):
+        """Parse the CSV block in a single pass. The first row is a
+        header, and each following row holds a currency name, code,
+        inverse rate and rate.
 
-        assert len(data) > 0
-        assert len(data[0]) == 4
+        :param text: the CSV block.
 
+        :returns: two dictionaries (rates and inverse_rates), or raises
+            a ValueError.
+        """
         rates, inverse_rates = {}, {}
-        for row in data:
+        rows = (row for row in csv.reader(io.StringIO(text)) if row)
+
+        next(rows, None)
+        for row in rows:
+            if len(row) != 4:
+                raise ValueError('Unexpected row: {}'.format(row))
             name, code, inverse, rate = row
             rates[code] = float(rate)
             inverse_rates[code] = float(inverse)
 
-        return rates, inverse_rates
-
+        if not rates:
+            raise ValueError('No exchange rates found')
 
-register_api_provider(Oanda.id_, Oanda)
+        return rates, inverse_rates
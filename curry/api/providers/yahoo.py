@@ -7,11 +7,12 @@
     Copyright: (c) 2014 Einar Uvsløkk
     License: GNU General Public License (GPL) version 3 or later
 """
+import io
+import csv
 import logging
-import requests
 
-from curry.config import get_cache_file
-from curry.api import APIProvider, APIError, register_api_provider
+from curry.api import APIProvider, APIError
+from curry.api.metrics import metrics
 
 log = logging.getLogger(__name__)
 
@@ -19,48 +20,114 @@ log = logging.getLogger(__name__)
 class Yahoo(APIProvider):
     id_ = 'finance.yahoo.com'
     url = 'http://download.finance.yahoo.com/d/quotes.csv?s={}{}=X&f=l1'
+    bulk_url = 'http://download.finance.yahoo.com/d/quotes.csv?s={}&f=sl1'
+    symbol = '{}{}=X'
+    # Keep well below the URL length most servers and proxies accept.
+    max_url_length = 2000
 
-    def __init__(self, **kwargs):
-        APIProvider.__init__(self, **kwargs)
-        self.cache_file = get_cache_file(self.id_)
-
-    def get_exchange_rate(self, transaction, payment):
-        """Get the exchange rate for a currency pair (transaction
-        currency -> payment currency).
+    def fetch_exchange_rate(self, transaction, payment):
+        """Request the exchange rate for a currency pair (transaction
+        currency -> payment currency) from the API.
 
         :param transaction: transaction (from) currency.
         :param payment: payment (to) currency.
 
         :returns: the exchange rate or raises an APIError.
         """
-        rate = self.get_exchange_rate_from_cache(transaction, payment)
+        url = self.url.format(transaction, payment)
+        log.debug('Request url: {}'.format(url))
+
+        r = self.http_get(url)
+
+        # TODO:2014-10-23:einar: provide better user feedback.
+        # Should probably provide some sort of 'contact developer'
+        # functionality is implemented.
+        if r.status_code != 200:
+            raise APIError('Unknown API error happend.', self.id_)
+
+        rate = r.text
+
+        try:
+            rate = float(rate)
+        except ValueError:
+            raise APIError(rate, self.id_)
+
+        return rate
+
+    def fetch_exchange_rates(self, pairs):
+        """Request the exchange rates for many currency pairs from the
+        API, packing as many symbols into each request as the URL
+        length limit allows.
+
+        :param pairs: an iterable of (transaction, payment) tuples.
 
-        # If rate is None here the exchange rate was either not cached
-        # or its timestamp was too old, therefor we need to do a
-        # request for an up-to-date exchange rate.
-        if not rate:
-            url = self.url.format(transaction, payment)
+        :returns: a dictionary mapping the pairs to exchange rates,
+            leaving out pairs the API has no rate for, or raises an
+            APIError if a request fails.
+        """
+        rates = {}
+        for chunk in self.chunk_pairs(list(pairs)):
+            symbols = {self.symbol.format(*pair): pair for pair in chunk}
+            url = self.bulk_url.format(','.join(symbols))
             log.debug('Request url: {}'.format(url))
 
-            r = requests.get(url)
-            self.dump_http_response(r)
+            r = self.http_get(url)
 
-            # TODO:2014-10-23:einar: provide better user feedback.
-            # Should probably provide some sort of 'contact developer'
-            # functionality is implemented.
             if r.status_code != 200:
                 raise APIError('Unknown API error happend.', self.id_)
 
-            rate = r.text
+            with metrics.time_parse(self.id_):
+                quotes = list(self._parse_quotes(r.text))
+            for symbol, rate in quotes:
+                if symbol not in symbols:
+                    log.warning('Unexpected symbol in response: {}'
+                                .format(symbol))
+                    continue
+                rates[symbols[symbol]] = rate
 
-            try:
-                rate = float(rate)
-            except ValueError:
-                raise APIError(rate, self.id_)
+            missing = [pair for pair in chunk if pair not in rates]
+            if missing:
+                log.warning('No exchange rate for {}'.format(', '.join(
+                    '{}/{}'.format(*pair) for pair in missing)))
 
-            self.save_cache(transaction, payment, rate)
+        return rates
 
-        return rate
+    def chunk_pairs(self, pairs):
+        """Split currency pairs into chunks whose request urls fit
+        within `max_url_length`.
 
+        :param pairs: a list of (transaction, payment) tuples.
 
-register_api_provider(Yahoo.id_, Yahoo)
+        :returns: a list of lists of pairs.
+        """
+        chunks, chunk = [], []
+        length = len(self.bulk_url.format(''))
+        for pair in pairs:
+            # One extra character for the separating comma.
+            size = len(self.symbol.format(*pair)) + 1
+            if chunk and length + size > self.max_url_length:
+                chunks.append(chunk)
+                chunk, length = [], len(self.bulk_url.format(''))
+            chunk.append(pair)
+            length += size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _parse_quotes(self, text):
+        """Parse a multi-line quotes.csv response.
+
+        :param text: the response body, with one "SYMBOL",rate row per
+            requested symbol.
+
+        :returns: a generator of (symbol, rate) tuples. Symbols without
+            a valid rate are skipped.
+        """
+        for row in csv.reader(io.StringIO(text)):
+            if len(row) < 2:
+                continue
+            symbol, rate = row[0].strip(), row[1].strip()
+            try:
+                yield symbol, float(rate)
+            except ValueError:
+                log.warning('Invalid rate for {}: {}'.format(symbol, rate))
@@ -0,0 +1,288 @@
+"""
+    Curry
+    ~~~~~
+
+    Rate limiting and scheduling of the requests to API providers
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import time
+import heapq
+import struct
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from curry.config import config, cache_path
+from curry.api import RateLimitError
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Scheduler', 'Ledger', 'get_scheduler', 'priority',
+           'current_priority', 'set_priority', 'parse_rate_limit',
+           'INTERACTIVE',
+           'BACKGROUND']
+
+LEDGER_PATH = os.path.join(cache_path, 'ratelimit')
+
+INTERACTIVE, BACKGROUND = 0, 1
+"""Request priorities. Lower values go first."""
+
+DEFAULT_BACKGROUND_RESERVE = 0.1
+DEFAULT_MAX_WAIT = 10
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 60 * 60 * 24,
+    'month': 60 * 60 * 24 * 30,
+}
+
+# tokens, last update
+LEDGER = struct.Struct('<dd')
+
+_local = threading.local()
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def current_priority():
+    """Get the request priority of the current thread."""
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+def set_priority(level):
+    """Set the request priority of the current thread, e.g. in the
+    initializer of a thread pool."""
+    _local.priority = level
+
+
+@contextmanager
+def priority(level):
+    """Set the request priority of the current thread within a block,
+    e.g. ``with priority(BACKGROUND): ...`` for cache refreshes.
+    """
+    previous = current_priority()
+    set_priority(level)
+    try:
+        yield
+    finally:
+        set_priority(previous)
+
+
+def parse_rate_limit(text):
+    """Parse a rate limit on the form 'COUNT/PERIOD', where period is
+    one of second, minute, hour, day or month (30 days), e.g.
+    '1000/month'.
+
+    :returns: a (count, seconds) tuple, or raises a ValueError.
+    """
+    count, _, period = str(text).partition('/')
+    period = period.strip().rstrip('s') or 'second'
+    if period not in PERIODS:
+        raise ValueError('Unknown rate limit period: {}'.format(period))
+    count = float(count)
+    if count <= 0:
+        raise ValueError('Rate limit must be positive: {}'.format(text))
+    return count, PERIODS[period]
+
+
+class Ledger:
+    """A token bucket stored in a small file, so every process on the
+    host draws from the same budget. The file holds the number of
+    tokens left and the time it was last updated, and is locked while
+    it is updated.
+
+    :param path: the ledger file.
+    :param rate: tokens added per second.
+    :param capacity: the maximum number of tokens.
+    """
+
+    def __init__(self, path, rate, capacity):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                yield fd
+            finally:
+                os.close(fd)
+
+    def _read(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = os.read(fd, LEDGER.size)
+        if len(data) < LEDGER.size:
+            return self.capacity, time.time()
+        return LEDGER.unpack(data)
+
+    def _write(self, fd, tokens, updated):
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, LEDGER.pack(tokens, updated))
+
+    def take(self, reserve=0):
+        """Take a token, if more than `reserve` tokens are left.
+
+        :returns: 0 if a token was taken, otherwise the seconds until
+            one can be.
+        """
+        with self._locked() as fd:
+            tokens, updated = self._read(fd)
+            now = time.time()
+            tokens = min(self.capacity,
+                         tokens + max(0, now - updated) * self.rate)
+            if now < updated:
+                # Held back by `drain`.
+                wait = updated - now
+            elif tokens >= 1 + reserve:
+                self._write(fd, tokens - 1, now)
+                return 0
+            else:
+                wait = (1 + reserve - tokens) / self.rate
+                updated = now
+            self._write(fd, tokens, updated)
+            return wait
+
+    def drain(self, seconds=0):
+        """Empty the bucket, and add no tokens for the next seconds,
+        e.g. after the API provider answered 429 Too Many Requests."""
+        with self._locked() as fd:
+            self._write(fd, 0, time.time() + seconds)
+
+    def tokens(self):
+        """Get the number of tokens left."""
+        with self._locked() as fd:
+            tokens, updated = self._read(fd)
+        return min(self.capacity,
+                   tokens + max(0, time.time() - updated) * self.rate)
+
+
+class Scheduler:
+    """Lets the requests to one API provider through as fast as its
+    rate limit allows. Waiting requests are served in priority order,
+    so interactive lookups go ahead of background refreshes in the
+    same process. Across processes, background requests leave a
+    reserve of tokens to interactive requests.
+
+    :param provider: the API provider id.
+    :param ledger: the shared `Ledger`.
+    :param background_reserve: the fraction of the capacity background
+        requests leave untouched.
+    :param max_wait: the longest time to wait for a token, in seconds.
+    """
+
+    def __init__(self, provider, ledger, background_reserve=0, max_wait=0):
+        self.provider = provider
+        self.ledger = ledger
+        self.reserve = background_reserve * ledger.capacity
+        self.max_wait = max_wait
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return '<Scheduler {} rate={}/s capacity={}>'.format(
+            self.provider, self.ledger.rate, self.ledger.capacity)
+
+    @classmethod
+    def from_config(cls, provider):
+        """Create a scheduler from the 'rate_limit', 'burst',
+        'background_reserve' and 'max_wait' options in the config
+        section of an API provider.
+
+        :returns: a `Scheduler`, or None if no rate limit is set.
+        """
+        rate_limit = config.get('rate_limit', section=provider)
+        if not rate_limit:
+            return None
+        try:
+            count, seconds = parse_rate_limit(rate_limit)
+        except ValueError as e:
+            log.warning('Ignoring rate limit of {}: {}'.format(provider, e))
+            return None
+
+        capacity = config.getfloat('burst', count, section=provider)
+        ledger = Ledger(os.path.join(LEDGER_PATH, provider),
+                        count / seconds, max(1, capacity))
+        return cls(provider, ledger,
+                   config.getfloat('background_reserve',
+                                   DEFAULT_BACKGROUND_RESERVE,
+                                   section=provider),
+                   config.getfloat('max_wait', DEFAULT_MAX_WAIT,
+                                   section=provider))
+
+    def acquire(self, level=None):
+        """Wait for a turn to send a request.
+
+        :param level: the request priority, default the priority of
+            the current thread.
+
+        :raises: a `curry.api.RateLimitError` if no token is available
+            within `max_wait` seconds.
+        """
+        level = current_priority() if level is None else level
+        reserve = self.reserve if level == BACKGROUND else 0
+        ticket = (level, next(self._counter))
+        deadline = time.monotonic() + self.max_wait
+
+        with self._condition:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._queue[0] == ticket:
+                        wait = self.ledger.take(reserve)
+                        if not wait:
+                            return
+                    remaining = deadline - time.monotonic()
+                    if wait is not None and wait > remaining:
+                        raise RateLimitError(
+                            'Rate limit reached, next request allowed in '
+                            '{:.1f}s'.format(wait), self.provider)
+                    if remaining <= 0:
+                        raise RateLimitError('Rate limit reached',
+                                             self.provider)
+                    log.debug('Waiting for a request slot: {:.3f}s'
+                              .format(wait if wait is not None
+                                      else remaining))
+                    self._condition.wait(remaining if wait is None
+                                         else wait)
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+
+    def backoff(self, seconds):
+        """Hold back all requests, e.g. on a Retry-After header."""
+        log.warning('{} asked to back off for {}s'
+                    .format(self.provider, seconds))
+        self.ledger.drain(seconds)
+
+
+def get_scheduler(provider):
+    """Get the scheduler of an API provider, shared within the
+    process.
+
+    :returns: a `Scheduler`, or None if the API provider has no rate
+        limit.
+    """
+    with _schedulers_lock:
+        if provider not in _schedulers:
+            _schedulers[provider] = Scheduler.from_config(provider)
+        return _schedulers[provider]
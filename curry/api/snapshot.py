@@ -0,0 +1,254 @@
+"""
+    Curry
+    ~~~~~
+
+    Memory mapped binary snapshots of rate tables
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import mmap
+import struct
+import logging
+import threading
+
+from curry.config import config, cache_path
+
+log = logging.getLogger(__name__)
+
+__all__ = ['RateSnapshot', 'write_snapshot', 'open_snapshot',
+           'snapshot_path', 'snapshot_enabled']
+
+SNAPSHOT_PATH = os.path.join(cache_path, 'snapshots')
+SNAPSHOT_SUFFIX = '.snapshot'
+
+MAGIC = b'CURS'
+VERSION = 1
+HAS_INVERSE = 0x1
+
+# magic, version, flags, count, base, timestamp
+HEADER = struct.Struct('<4sHHI8sd4x')
+RATE = struct.Struct('<d')
+CODE_SIZE = 3
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def snapshot_enabled():
+    """Check the 'snapshot' option, which enables rate table
+    snapshots."""
+    return bool(config.get('snapshot', 1))
+
+
+def snapshot_path(provider, directory=None):
+    """Get the path of the snapshot of an API provider."""
+    return os.path.join(directory or SNAPSHOT_PATH, provider + SNAPSHOT_SUFFIX)
+
+
+def _align(size):
+    return (size + 7) // 8 * 8
+
+
+def write_snapshot(path, base, rates, inverse_rates=None, timestamp=0):
+    """Write a rate table snapshot atomically, so processes reading
+    the previous snapshot are unaffected.
+
+    The snapshot consists of a fixed size header, the sorted 3 letter
+    currency codes, and the rates and inverse rates as contiguous
+    little-endian float64 arrays in the same order, each section
+    aligned to 8 bytes. Unknown rates are stored as NaN.
+
+    :param path: the snapshot file.
+    :param base: the base currency.
+    :param rates: a dictionary mapping currency codes to the amount of
+        that currency one unit of the base currency buys.
+    :param inverse_rates: an optional dictionary mapping currency codes
+        to the amount of the base currency one unit buys.
+    :param timestamp: the time the rates were fetched.
+    """
+    codes = sorted(code for code, rate in rates.items()
+                   if len(code.encode('ascii')) == CODE_SIZE and
+                   rate is not None)
+    nan = float('nan')
+    flags = HAS_INVERSE if inverse_rates else 0
+
+    index = b''.join(code.encode('ascii') for code in codes)
+    values = [rates[code] for code in codes]
+    if inverse_rates:
+        values += [inverse_rates.get(code) or nan for code in codes]
+
+    data = bytearray(HEADER.pack(MAGIC, VERSION, flags, len(codes),
+                                 base.encode('ascii'), timestamp))
+    data += index.ljust(_align(len(index)), b'\0')
+    data += struct.pack('<{}d'.format(len(values)), *values)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class RateSnapshot:
+    """A read-only, memory mapped rate table snapshot, written by
+    `write_snapshot`. Lookups binary search the code index and unpack
+    single rates straight from the mapping, so nothing is parsed up
+    front, and processes reading the same snapshot share its pages.
+
+    Supports the read-only parts of the dictionary interface, mapping
+    currency codes to rates, so it can stand in for the 'rates' of a
+    rate table.
+
+    :param path: the snapshot file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            if self.stat.st_size < HEADER.size:
+                raise ValueError('Truncated snapshot: {}'.format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, count, base, timestamp = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('Not a version {} snapshot: {}'
+                             .format(VERSION, path))
+
+        self.base = base.rstrip(b'\0').decode('ascii')
+        self.timestamp = timestamp
+        self.count = count
+        self.has_inverse = bool(flags & HAS_INVERSE)
+        self._index = HEADER.size
+        self._rates = self._index + _align(count * CODE_SIZE)
+        self._inverse = self._rates + count * RATE.size
+
+        size = self._inverse + (count * RATE.size if self.has_inverse else 0)
+        if len(self._map) < size:
+            self.close()
+            raise ValueError('Truncated snapshot: {}'.format(path))
+
+    def __repr__(self):
+        return '<RateSnapshot {} base={} currencies={}>'.format(
+            self.path, self.base, self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def _code(self, i):
+        offset = self._index + i * CODE_SIZE
+        return self._map[offset:offset + CODE_SIZE]
+
+    def find(self, code):
+        """Binary search the code index.
+
+        :returns: the position of the currency code, or -1.
+        """
+        key = code.encode('ascii', 'replace')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._code(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._code(lo) == key:
+            return lo
+        return -1
+
+    def _value(self, offset, i):
+        if i < 0:
+            return None
+        rate = RATE.unpack_from(self._map, offset + i * RATE.size)[0]
+        return rate if rate == rate else None
+
+    def get(self, code, default=None):
+        rate = self._value(self._rates, self.find(code))
+        return default if rate is None else rate
+
+    def get_inverse(self, code, default=None):
+        """Get the amount of the base currency one unit of a currency
+        buys."""
+        if not self.has_inverse:
+            return default
+        rate = self._value(self._inverse, self.find(code))
+        return default if rate is None else rate
+
+    def __getitem__(self, code):
+        rate = self.get(code)
+        if rate is None:
+            raise KeyError(code)
+        return rate
+
+    def __contains__(self, code):
+        return self.find(code) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [self._code(i).decode('ascii') for i in range(self.count)]
+
+    def items(self):
+        return [(code, self._value(self._rates, i))
+                for i, code in enumerate(self.keys())]
+
+    def to_dict(self):
+        """Get the rates as a dictionary."""
+        return dict(self.items())
+
+
+def open_snapshot(provider, directory=None):
+    """Get the snapshot of an API provider. Opened snapshots are
+    shared within the process, and reopened once the file has been
+    replaced.
+
+    :param provider: the API provider id.
+    :param directory: the directory holding the snapshots.
+
+    :returns: a `RateSnapshot`, or None if there is no valid snapshot.
+    """
+    path = snapshot_path(provider, directory)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    def is_current(snapshot):
+        return snapshot and (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns,
+                             snapshot.stat.st_size) == \
+            (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    # The common case, an unchanged snapshot, takes no lock.
+    snapshot = _snapshots.get(path)
+    if is_current(snapshot):
+        return snapshot
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(path)
+        if is_current(snapshot):
+            return snapshot
+
+        # Snapshots are replaced, not written to, so an old mapping
+        # stays valid for anyone still holding it.
+        try:
+            snapshot = RateSnapshot(path)
+        except (OSError, ValueError) as e:
+            log.warning('Unable to open snapshot: {}'.format(e))
+            _snapshots.pop(path, None)
+            return None
+        _snapshots[path] = snapshot
+        return snapshot
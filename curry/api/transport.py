@@ -0,0 +1,112 @@
+"""
+    Curry
+    ~~~~~
+
+    Pooled HTTP transport shared by the API providers
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from curry import prog_name, version
+from curry.config import config
+from curry.api import RequestError
+
+log = logging.getLogger(__name__)
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+class Transport:
+    """A thin wrapper around a `requests.Session`, which keeps a pool
+    of keep-alive connections per host, so repeated requests to an API
+    provider reuse the same TCP (and TLS) connection.
+
+    :param connect_timeout: seconds to wait for a connection.
+    :param read_timeout: seconds to wait for the server to respond.
+    :param pool_connections: the number of hosts to keep pools for.
+    :param pool_maxsize: the number of connections to keep per host.
+    :param max_retries: the number of retries on connection errors.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=30,
+                 pool_connections=10, pool_maxsize=10, max_retries=0):
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip',
+            'User-Agent': '{}/{}'.format(prog_name, version),
+        })
+
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=max_retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls):
+        """Create a transport from the configured timeouts and pool
+        sizes."""
+        return cls(
+            connect_timeout=float(config.get('connect_timeout', 5)),
+            read_timeout=float(config.get('read_timeout', 30)),
+            pool_connections=int(config.get('pool_connections', 10)),
+            pool_maxsize=int(config.get('pool_maxsize', 10)),
+            max_retries=int(config.get('max_retries', 0)),
+        )
+
+    def get(self, url, headers=None, timeout=None):
+        """Do a GET request.
+
+        :param url: the request url.
+        :param headers: additional request headers.
+        :param timeout: override the (connect, read) timeout.
+
+        :returns: a `requests.Response`, or raises a
+            `curry.api.RequestError` if the request failed.
+        """
+        log.debug('GET {}'.format(url))
+        try:
+            return self.session.get(url, headers=headers,
+                                    timeout=timeout or self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise RequestError(e)
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+
+def get_transport():
+    """Get the transport shared by all API providers in this process.
+    The transport is created from the config on first use.
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport.from_config()
+    return _transport
+
+
+def set_transport(transport):
+    """Replace the shared transport, e.g. to point the API providers at
+    a local stub server with other timeouts. The previous transport is
+    closed.
+
+    :param transport: a `Transport` instance, or None to recreate the
+        transport from the config on next use.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is not None and _transport is not transport:
+            _transport.close()
+        _transport = transport
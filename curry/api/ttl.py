@@ -0,0 +1,99 @@
+"""
+    Curry
+    ~~~~~
+
+    Cache timeouts adapting to how much exchange rates move
+
+    Each time the exchange rate of a currency pair is fetched, it is
+    compared with the rate cached before, and the move is taken as a
+    sample of the volatility of the pair, treating the rate as a random
+    walk: a rate with volatility sigma is expected to move by about
+    sigma * sqrt(t) in t seconds. The volatility is smoothed over the
+    refreshes, and the cache timeout chosen as the time the rate is
+    expected to take to move by the 'rate_tolerance', within the
+    'min_cache_timeout' and 'max_cache_timeout' bounds.
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import logging
+
+from curry.config import config
+
+log = logging.getLogger(__name__)
+
+__all__ = ['adaptive_ttl_enabled', 'ttl_bounds', 'rate_tolerance',
+           'next_ttl']
+
+DEFAULT_RATE_TOLERANCE = 0.003
+DEFAULT_MIN_FRACTION = 1 / 12
+DEFAULT_MAX_FRACTION = 4
+SMOOTHING = 0.3
+"""The weight of the newest sample in the smoothed volatility."""
+
+
+def adaptive_ttl_enabled():
+    """Check if the 'adaptive_ttl' option is set."""
+    return bool(config.get('adaptive_ttl', 0))
+
+
+def rate_tolerance():
+    """Get the relative move of an exchange rate to allow before it is
+    refreshed, from the 'rate_tolerance' option (default: 0.003)."""
+    return config.getfloat('rate_tolerance', DEFAULT_RATE_TOLERANCE)
+
+
+def ttl_bounds():
+    """Get the 'min_cache_timeout' and 'max_cache_timeout' options,
+    default a twelfth and four times the cache_timeout.
+
+    :returns: a (min, max) tuple of seconds.
+    """
+    from curry.api import get_cache_timeout
+    cache_timeout = get_cache_timeout()
+    low = config.get('min_cache_timeout')
+    high = config.get('max_cache_timeout')
+    low = float(low) if low else cache_timeout * DEFAULT_MIN_FRACTION
+    high = float(high) if high else cache_timeout * DEFAULT_MAX_FRACTION
+    return low, max(low, high)
+
+
+def next_ttl(transaction, payment, rate, timestamp, previous=None):
+    """Choose the cache timeout of a freshly fetched exchange rate.
+
+    :param transaction: the transaction (from) currency.
+    :param payment: the payment (to) currency.
+    :param rate: the fetched exchange rate.
+    :param timestamp: when it was fetched.
+    :param previous: the cache entry of the pair before, if any.
+
+    :returns: the cache timeout in seconds, or None if it is not
+        adaptive, as it is off, or set for the pair in the
+        [cache_timeouts] section.
+    """
+    from curry.api import get_cache_timeout, pair_cache_timeout
+    if not adaptive_ttl_enabled() or \
+            pair_cache_timeout(transaction, payment) is not None:
+        return None
+
+    low, high = ttl_bounds()
+    tolerance = rate_tolerance()
+    previous = previous or {}
+    last_rate = previous.get('rate')
+    elapsed = timestamp - (previous.get('timestamp') or timestamp)
+    last_ttl = previous.get('ttl') or get_cache_timeout()
+    if not rate or rate <= 0 or not last_rate or last_rate <= 0 or \
+            elapsed <= 0:
+        return min(max(last_ttl, low), high)
+
+    # Variances per second, the last one implied by the last timeout.
+    move = rate / last_rate - 1
+    variance = move ** 2 / elapsed
+    variance = (SMOOTHING * variance +
+                (1 - SMOOTHING) * tolerance ** 2 / last_ttl)
+    ttl = tolerance ** 2 / variance if variance else high
+    ttl = min(max(ttl, low), high)
+    log.info('Cache timeout of {}/{}: {:.0f} seconds, after a move of '
+             '{:+.4%} in {:.0f} seconds'.format(transaction, payment, ttl,
+                                                move, elapsed))
+    return ttl
@@ -0,0 +1,195 @@
+"""
+    Curry
+    ~~~~~
+
+    Streaming batch conversion
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import csv
+import json
+import logging
+from itertools import islice
+
+from curry.api import APIError
+from curry.money import (to_minor, format_minor, minor_units, round_div,
+                         conversion_factors, rounding_mode)
+
+log = logging.getLogger(__name__)
+
+FORMATS = ['csv', 'jsonl']
+
+PREFETCH_ROWS = 1000
+"""The number of rows to read ahead, for providers that get the
+exchange rates of many currency pairs in one request."""
+
+HEADER = ['from', 'to', 'amount', 'rate', 'result']
+
+
+def read_header(f):
+    """Read a header row from a CSV file object.
+
+    :param f: a file object opened in text mode.
+
+    :returns: the names of the passthrough columns.
+    """
+    row = next(csv.reader([f.readline()]), [])
+    return row[3:]
+
+
+def read_rows(f):
+    """Read transaction rows from a CSV file object. Each row must
+    start with the transaction currency, the payment currency and the
+    amount. Any remaining columns are passed through untouched.
+
+    :param f: a file object opened in text mode.
+
+    :returns: a generator of (transaction, payment, amount, rest)
+        tuples.
+    """
+    reader = csv.reader(f)
+    for lineno, row in enumerate(reader, 1):
+        if not row:
+            continue
+        try:
+            transaction, payment, amount = row[:3]
+            amount = float(amount)
+        except ValueError:
+            log.warning('Skipping malformed row on line {}: {}'
+                        .format(lineno, row))
+            continue
+        yield transaction.strip().upper(), payment.strip().upper(), \
+            amount, row[3:]
+
+
+def _blocks(rows, size):
+    rows = iter(rows)
+    while True:
+        block = list(islice(rows, size))
+        if not block:
+            return
+        yield block
+
+
+def _prefetch(provider, pairs, as_of=None):
+    """Get the exchange rates of many currency pairs in one request,
+    if the provider supports it, e.g. a `curry.client.FallbackProvider`.
+
+    :returns: a dictionary mapping pairs to exchange rates, which may
+        leave out some or all of the pairs.
+    """
+    try:
+        return provider.get_exchange_rates(pairs, as_of=as_of)
+    except APIError as e:
+        log.warning('{}, requesting the pairs one at a time'.format(e))
+        return {}
+
+
+def convert_rows(rows, provider, as_of=None, rounding=None, skipped=None):
+    """Convert rows as they are read. The exchange rate of every
+    distinct currency pair is requested from the provider only once,
+    and a pair the provider fails on (e.g. an unknown currency) is
+    treated as having no exchange rate. Providers with a
+    `get_exchange_rates` method, like the daemon client, are asked for
+    the new pairs of every `PREFETCH_ROWS` rows in one request. Amounts
+    are converted exactly in integer minor units, see `curry.money`.
+
+    :param rows: an iterable of (transaction, payment, amount, rest)
+        tuples, as produced by `read_rows`.
+    :param provider: a `curry.api.Provider` instance.
+    :param as_of: a `datetime.date` to use the exchange rates of,
+        default the current exchange rates.
+    :param rounding: the rounding mode, default the 'rounding' option.
+    :param skipped: a dictionary, which is updated with the number of
+        skipped rows of every currency pair.
+
+    :returns: a generator of (transaction, payment, amount, rate,
+        result, rest) tuples, where result is in minor units of the
+        payment currency. Rows without a valid exchange rate are
+        skipped.
+    """
+    mode = rounding_mode(rounding)
+    rates = {}
+    bulk = hasattr(provider, 'get_exchange_rates')
+    for block in _blocks(rows, PREFETCH_ROWS if bulk else 1):
+        prefetched = {}
+        if bulk:
+            pairs = [pair for pair in dict.fromkeys(
+                (transaction, payment)
+                for transaction, payment, _, _ in block)
+                if pair not in rates]
+            if pairs:
+                prefetched = _prefetch(provider, pairs, as_of)
+
+        for transaction, payment, amount, rest in block:
+            pair = (transaction, payment)
+            if pair not in rates:
+                if pair in prefetched:
+                    rate = prefetched[pair]
+                else:
+                    try:
+                        rate = provider.get_exchange_rate(
+                            transaction, payment, as_of=as_of)
+                    except APIError as e:
+                        log.error(e)
+                        rate = None
+                factors = None
+                if rate and rate > 0:
+                    factors = conversion_factors(rate, transaction, payment)
+                rates[pair] = rate, factors
+            rate, factors = rates[pair]
+
+            if factors is None:
+                log.warning('No exchange rate for {}/{}, skipping row'
+                            .format(transaction, payment))
+                if skipped is not None:
+                    skipped[pair] = skipped.get(pair, 0) + 1
+                continue
+
+            num, den = factors
+            result = round_div(to_minor(amount, transaction, mode) * num,
+                               den, mode)
+            yield transaction, payment, amount, rate, result, rest
+
+
+def write_rows(rows, f, format='csv', header=None):
+    """Write converted rows to a file object as they are produced.
+
+    :param rows: an iterable of rows as produced by `convert_rows`. The
+        results are written with the decimal places of the payment
+        currency.
+    :param f: a file object opened in text mode.
+    :param format: the output format, either 'csv' or 'jsonl'.
+    :param header: if not None, a header row is written first, with
+        these names for the passthrough columns (CSV only).
+
+    :returns: the number of rows written.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown output format: {}'.format(format))
+
+    if format == 'csv':
+        writer = csv.writer(f, lineterminator='\n')
+        if header is not None:
+            writer.writerow(HEADER + header)
+
+    count = 0
+    for transaction, payment, amount, rate, result, rest in rows:
+        if format == 'csv':
+            writer.writerow([transaction, payment, amount, rate,
+                             format_minor(result, payment)] + rest)
+        else:
+            places = minor_units(payment)
+            f.write(json.dumps({
+                'from': transaction,
+                'to': payment,
+                'amount': amount,
+                'rate': rate,
+                'result': result / 10 ** places if places else result,
+                'extra': rest,
+            }))
+            f.write('\n')
+        count += 1
+
+    return count
@@ -7,13 +7,20 @@
     Copyright: (c) 2014 Einar Uvsløkk
     License: GNU General Public License (GPL) version 3 or later
 """
+import os
 import sys
 import logging
 import argparse
+import datetime
 
 from curry import prog_name, version, description
-from curry.config import config
+from curry.config import config, config_file
 from curry.api import Provider, APIError, list_api_providers
+from curry.api.metrics import metrics
+from curry.batch import (FORMATS, read_header, read_rows, convert_rows,
+                         write_rows)
+from curry.money import (ROUNDING_MODES, to_minor, format_minor,
+                         convert_minor, rounding_mode)
 
 log = logging.getLogger(__name__)
 
@@ -24,11 +31,119 @@ class ListAPIProviders(argparse.Action):
         sys.exit(0)
 
 
+def parse_date(text):
+    """Parse a YYYY-MM-DD date argument."""
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date: {!r}, expected '
+                                         'YYYY-MM-DD'.format(text))
+
+
+def parse_jobs(text):
+    """Parse a number of worker processes argument, which is 0 for one
+    per CPU."""
+    try:
+        jobs = int(text)
+    except ValueError:
+        jobs = -1
+    if jobs < 0:
+        raise argparse.ArgumentTypeError('invalid number of jobs: {!r}, '
+                                         'expected 0 or more'.format(text))
+    return jobs
+
+
+def add_provider_arguments(parser, **defaults):
+    """Add the optional arguments used to setup an API provider."""
+    default_api = defaults.get('api')
+    parser.add_argument('-a', '--api', default=default_api,
+                        help='get exchange rates from a spesific API provider')
+    parser.add_argument('-k', '--key', metavar='KEY', dest='api_key',
+                        help='provide an API-key to use with API providers '
+                        'that requires one')
+    parser.add_argument('-r', '--refresh-cache', action='store_true',
+                        help='force a cache refresh even when the cache '
+                        'timeout is not reached')
+    parser.add_argument('-d', '--date', type=parse_date,
+                        help='use the exchange rates of a past date, on the '
+                        'form YYYY-MM-DD')
+    parser.add_argument('--rounding', choices=ROUNDING_MODES,
+                        help='how to round converted amounts to the minor '
+                        'unit of the payment currency (default: the '
+                        '"rounding" option, or half_even)')
+    parser.add_argument('-v', '--verbose', dest='verbose_count',
+                        action='count', default=0,
+                        help='increase logging verbosity, use -v to enable '
+                        '"info" messages, and -vv to enable "debug" messages')
+    parser.add_argument('--stats', nargs='?', const='text',
+                        choices=['text', 'prometheus'],
+                        help='print request, cache and parse statistics to '
+                        'stderr when done, as text (default) or in the '
+                        'Prometheus text format')
+
+
+def setup_logging(args):
+    """Set the log level to WARN going more verbose for each -v"""
+    level = max(3 - args.verbose_count, 0) * 10
+    logging.basicConfig(stream=sys.stderr, level=level,
+                        format='%(name)s (%(levelname)s): %(message)s')
+
+
+def print_stats(args):
+    """Print the collected metrics to stderr, if asked for with
+    --stats."""
+    if args.stats == 'prometheus':
+        sys.stderr.write(metrics.to_prometheus())
+    elif args.stats:
+        print(metrics.format_text() or 'No statistics collected',
+              file=sys.stderr)
+
+
+def provider_options(args):
+    """Get the provider options from the parsed command line
+    arguments."""
+    api, api_key = args.api, args.api_key
+
+    # If no api_key is provided for the given api provider,
+    # try to look it up in the config file.
+    if api_key is None:
+        api_key = config.get('api_key', section=api)
+        args.api_key = api_key
+
+    return {
+        'api': api,
+        'api_key': api_key,
+        'refresh_cache': args.refresh_cache
+    }
+
+
+def get_provider(args):
+    """Setup a `Provider` from the parsed command line arguments."""
+    return Provider(**provider_options(args))
+
+
+def connect_daemon(args):
+    """Connect to a running `curry serve` daemon, unless statistics of
+    this process are asked for with --stats.
+
+    :returns: a `curry.client.DaemonClient`, or None.
+    """
+    if args.stats:
+        return None
+    from curry.client import DaemonClient
+    return DaemonClient.connect(**provider_options(args))
+
+
 def parse_command_line(argv, **defaults):
     """Parses the command line arguments, and setup logging level."""
 
     parser = argparse.ArgumentParser(prog=prog_name,
-                                     description=description)
+                                     description=description,
+                                     epilog='use "%(prog)s batch -h" to '
+                                     'convert many rows at once, and '
+                                     '"%(prog)s serve -h" to keep exchange '
+                                     'rates in memory between runs, and '
+                                     '"%(prog)s warm -h" to prefetch them')
 
     # Positional arguments
     parser.add_argument('_from', metavar='from',
@@ -46,65 +161,264 @@ def parse_command_line(argv, **defaults):
                         help='show a list of available API providers and exit')
 
     # Other optional arguments
-    default_api = defaults.get('api')
-    parser.add_argument('-a', '--api', default=default_api,
-                        help='get exchange rates from a spesific API provider')
-    parser.add_argument('-k', '--key', metavar='KEY', dest='api_key',
-                        help='provide an API-key to use with API providers '
-                        'that requires one')
+    add_provider_arguments(parser, **defaults)
     # TODO:2014-10-21:einar: maybe save on default and provide --no-save flag?
     parser.add_argument('-s', '--save', action='store_true',
                         help='save current command-line options to the config '
                         'file')
+
+    args = parser.parse_args(argv[1:])
+    setup_logging(args)
+
+    return args
+
+
+def parse_batch_command_line(argv, **defaults):
+    """Parses the command line arguments for the batch command, and
+    setup logging level."""
+
+    parser = argparse.ArgumentParser(
+        prog='{} batch'.format(prog_name),
+        description='convert rows of "from,to,amount[,...]" read as CSV '
+                    'from a file or stdin, writing converted rows as they '
+                    'are produced')
+
+    parser.add_argument('input', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin,
+                        help='the CSV file to read rows from (default: stdin)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='the file to write converted rows to '
+                        '(default: stdout)')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='csv',
+                        help='the output format (default: csv)')
+    parser.add_argument('--header', action='store_true',
+                        help='the input starts with a header row, which is '
+                        'skipped, and a header row is written to the output')
+    parser.add_argument('-j', '--jobs', type=parse_jobs, default=1,
+                        metavar='N',
+                        help='convert an input file in N worker processes, '
+                        'or one per CPU if N is 0 (default: 1). Rows must '
+                        'not span lines')
+
+    add_provider_arguments(parser, **defaults)
+
+    args = parser.parse_args(argv[2:])
+    setup_logging(args)
+
+    return args
+
+
+def batch(argv, **defaults):
+    """Run the batch command.
+
+    :returns: 0 if every row was converted, 1 if any row was skipped or
+        the conversion failed.
+    """
+    args = parse_batch_command_line(argv, **defaults)
+
+    provider = get_provider(args)
+
+    parallel = args.jobs != 1
+    if parallel and not os.path.isfile(getattr(args.input, 'name', '')):
+        log.warning('Only input files can be converted in parallel, '
+                    'converting in one process')
+        parallel = False
+
+    client = None if parallel else connect_daemon(args)
+    if client:
+        from curry.client import FallbackProvider
+        provider = FallbackProvider(client, provider)
+
+    skipped = {}
+    try:
+        header = read_header(args.input) if args.header else None
+        if parallel:
+            from curry.parallel import convert_file
+            count = convert_file(args.input.name, args.output, provider,
+                                 jobs=args.jobs or None, format=args.format,
+                                 header=header, as_of=args.date,
+                                 rounding=args.rounding,
+                                 encoding=args.input.encoding,
+                                 skipped=skipped)
+        else:
+            rows = read_rows(args.input)
+            rows = convert_rows(rows, provider, as_of=args.date,
+                                rounding=args.rounding, skipped=skipped)
+            count = write_rows(rows, args.output, format=args.format,
+                               header=header)
+        log.info('Converted {} rows'.format(count))
+    except APIError as ae:
+        log.error(ae)
+        return 1
+    finally:
+        if client:
+            client.close()
+        print_stats(args)
+
+    if skipped:
+        log.error('Skipped {} rows without an exchange rate: {}'.format(
+            sum(skipped.values()), ', '.join(
+                '{}/{}'.format(*pair) for pair in sorted(skipped))))
+        return 1
+    return 0
+
+
+def parse_serve_command_line(argv):
+    """Parses the command line arguments for the serve command, and
+    setup logging level."""
+
+    parser = argparse.ArgumentParser(
+        prog='{} serve'.format(prog_name),
+        description='run a daemon keeping exchange rates in memory, and '
+                    'answering conversions over a Unix domain socket, '
+                    'which curry uses when it is running')
+
+    parser.add_argument('--socket', metavar='PATH',
+                        help='the socket to listen on (default: the '
+                        '"socket" option, or curry.sock in the cache '
+                        'directory)')
+    parser.add_argument('--port', type=int,
+                        help='also answer HTTP requests on this port')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the address to answer HTTP requests on '
+                        '(default: 127.0.0.1)')
+    parser.add_argument('-v', '--verbose', dest='verbose_count',
+                        action='count', default=0,
+                        help='increase logging verbosity')
+
+    args = parser.parse_args(argv[2:])
+    setup_logging(args)
+
+    return args
+
+
+def serve(argv, **defaults):
+    """Run the serve command."""
+    from curry.server import serve as run_daemon
+    args = parse_serve_command_line(argv)
+    run_daemon(args.socket, args.port, args.host)
+
+
+def parse_warm_command_line(argv):
+    """Parses the command line arguments for the warm command, and
+    setup logging level."""
+
+    parser = argparse.ArgumentParser(
+        prog='{} warm'.format(prog_name),
+        description='fetch the exchange rates of the pairs and rate tables '
+                    'in the [warm] section of the config file into the '
+                    'cache, so lookups do not have to wait for them')
+
+    parser.add_argument('pairs', nargs='*', metavar='pair',
+                        help='a currency pair to fetch instead of the '
+                        'configured pairs, e.g. EUR/USD')
+    parser.add_argument('-a', '--api',
+                        help='the API provider to fetch the pairs from '
+                        '(default: the "api" option of the [warm] or the '
+                        '[curry] section)')
     parser.add_argument('-r', '--refresh-cache', action='store_true',
-                        help='force a cache refresh even when the cache '
-                        'timeout is not reached')
+                        help='fetch every exchange rate, even if it is '
+                        'cached')
+    parser.add_argument('--every', nargs='?', type=float, const=0,
+                        metavar='SECONDS',
+                        help='keep running, refreshing every exchange rate '
+                        'at jittered intervals (default: the "interval" '
+                        'option, or 3/4 of the cache timeout)')
     parser.add_argument('-v', '--verbose', dest='verbose_count',
                         action='count', default=0,
-                        help='increase logging verbosity, use -v to enable '
-                        '"info" messages, and -vv to enable "debug" messages')
+                        help='increase logging verbosity')
+    parser.add_argument('--stats', nargs='?', const='text',
+                        choices=['text', 'prometheus'],
+                        help='print request, cache and parse statistics to '
+                        'stderr when done')
 
-    args = parser.parse_args(argv[1:])
+    args = parser.parse_args(argv[2:])
+    setup_logging(args)
 
-    # Set the log level to WARN going more verbose for each -v
-    level = max(3 - args.verbose_count, 0) * 10
-    logging.basicConfig(stream=sys.stderr, level=level,
-                        format='%(name)s (%(levelname)s): %(message)s')
+    from curry.warm import parse_pairs
+    try:
+        args.pairs = parse_pairs(' '.join(args.pairs)) or None
+    except ValueError as e:
+        parser.error(e)
 
     return args
 
 
+def warm(argv, **defaults):
+    """Run the warm command."""
+    from curry.warm import warm_targets, run_periodically, warm as warm_up
+    args = parse_warm_command_line(argv)
+    try:
+        targets = warm_targets(args.api, args.pairs)
+        if not targets:
+            log.error('Nothing to warm, set "pairs" or "tables" in the '
+                      '[warm] section of {}'.format(config_file))
+            return 1
+        if args.every is not None:
+            run_periodically(targets, args.every)
+            return 0
+        return 1 if warm_up(targets, args.refresh_cache) else 0
+    except KeyboardInterrupt:
+        return 0
+    except APIError as ae:
+        log.error(ae)
+        return 1
+    finally:
+        print_stats(args)
+
+
+Commands = {
+    'batch': batch,
+    'serve': serve,
+    'warm': warm,
+}
+"""A dictionary containing sub-commands, which are recognized by the
+first command-line argument."""
+
+
 def main():
+    args = None
     try:
         # Load config defaults needed for the command-line
         defaults = {
             'api': config.get('api', 'finance.yahoo.com')
         }
 
-        args = parse_command_line(sys.argv, **defaults)
-
-        api, api_key = args.api, args.api_key
+        if len(sys.argv) > 1 and sys.argv[1] in Commands:
+            return Commands[sys.argv[1]](sys.argv, **defaults)
 
-        # If no api_key is provided for the given api provider,
-        # try to look it up in the config file.
-        if api_key is None:
-            api_key = config.get('api_key', section=args.api)
+        args = parse_command_line(sys.argv, **defaults)
 
-        kwargs = {
-            'api': api,
-            'api_key': api_key,
-            'refresh_cache': args.refresh_cache
-        }
+        rate = None
+        client = connect_daemon(args)
+        if client:
+            from curry.client import DaemonError
+            try:
+                with client:
+                    rate = client.get_exchange_rate(args._from, args.to,
+                                                    as_of=args.date)
+            except DaemonError as e:
+                log.warning('{}, converting in this process'.format(e))
 
-        provider = Provider(**kwargs)
-        rate = provider.get_exchange_rate(args._from, args.to)
+        if rate is None:
+            provider = get_provider(args)
+            rate = provider.get_exchange_rate(args._from, args.to,
+                                              as_of=args.date)
+        api, api_key = args.api, args.api_key
 
         # TODO:2014-10-21:einar: better feedback on error?
         if rate <= 0:
             log.info('Got negative exchange rate: {}'.format(rate))
             return 1
 
-        print('{:.2f}'.format(rate * sum(args.amount)))
+        # Amounts are converted exactly in minor units, and shown with
+        # the decimal places of the payment currency.
+        transaction, payment = args._from.upper(), args.to.upper()
+        mode = rounding_mode(args.rounding)
+        amount = sum(to_minor(a, transaction, mode) for a in args.amount)
+        print(format_minor(convert_minor(amount, rate, transaction, payment,
+                                         mode), payment))
 
         if args.save:
             config.set('api', api)
@@ -114,4 +428,6 @@ def main():
     except APIError as ae:
         log.error(ae)
     finally:
+        if args is not None:
+            print_stats(args)
         logging.shutdown()
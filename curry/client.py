@@ -0,0 +1,179 @@
+"""
+    Curry
+    ~~~~~
+
+    Client of the resident rate daemon
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import json
+import socket
+import logging
+
+from curry.config import config, cache_path
+
+log = logging.getLogger(__name__)
+
+__all__ = ['DaemonClient', 'DaemonError', 'FallbackProvider', 'daemon_path']
+
+SOCKET_FILENAME = 'curry.sock'
+CONNECT_TIMEOUT = 0.5
+DEFAULT_TIMEOUT = 60
+
+
+def daemon_path():
+    """Get the socket of the daemon, from the 'socket' option, or
+    'curry.sock' in the cache directory."""
+    return config.get('socket') or os.path.join(cache_path, SOCKET_FILENAME)
+
+
+class DaemonError(Exception):
+    """Raised when the daemon can not be reached, or stops answering."""
+
+
+class DaemonClient:
+    """Converts through a running `curry serve` daemon, over its Unix
+    domain socket. Stands in for a `curry.api.Provider`, so it can be
+    used with `curry.batch.convert_rows`.
+
+    :param sock: a socket connected to the daemon.
+    :param options: the provider options sent with every request:
+        'api', 'api_key' and 'refresh_cache'.
+    """
+
+    def __init__(self, sock, **options):
+        self.sock = sock
+        self.options = {k: v for k, v in options.items() if v is not None}
+        self._file = sock.makefile('rwb')
+
+    @classmethod
+    def connect(cls, path=None, timeout=DEFAULT_TIMEOUT, **options):
+        """Connect to the daemon, if it is running and the 'daemon'
+        option is not 0.
+
+        :param path: the socket, default `daemon_path()`.
+        :param timeout: seconds to wait for an answer.
+        :param options: the provider options, see `DaemonClient`.
+
+        :returns: a `DaemonClient`, or None.
+        """
+        if not config.get('daemon', 1) or not hasattr(socket, 'AF_UNIX'):
+            return None
+        path = path or daemon_path()
+        if not os.path.exists(path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            log.debug('Daemon not running on {}: {}'.format(path, e))
+            sock.close()
+            return None
+        sock.settimeout(timeout)
+        log.info('Using daemon: {}'.format(path))
+        return cls(sock, **options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self._file.close()
+        except OSError:
+            # Unsent requests are dropped with a broken connection.
+            pass
+        self.sock.close()
+
+    def request(self, request):
+        """Send a request, and wait for the answer.
+
+        :param request: a request dictionary, see
+            `curry.server.ConversionService`.
+
+        :returns: the answer dictionary, or raises an APIError if it is
+            an error, and a DaemonError if the daemon does not answer.
+        """
+        try:
+            self._file.write(json.dumps(dict(self.options, **request))
+                             .encode('utf-8') + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+        except OSError as e:
+            raise DaemonError('Daemon connection failed: {}'.format(e))
+        if not line:
+            raise DaemonError('Daemon closed the connection')
+
+        answer = json.loads(line.decode('utf-8'))
+        if 'error' in answer:
+            from curry.api import APIError
+            raise APIError(answer['error'], answer.get('provider'))
+        return answer
+
+    def _date(self, as_of):
+        return {} if as_of is None else {'date': as_of.isoformat()}
+
+    def get_exchange_rate(self, transaction, payment, as_of=None):
+        """Get the exchange rate for a currency pair from the daemon.
+
+        :returns: the exchange rate, or raises an APIError.
+        """
+        return self.request(dict(self._date(as_of), **{
+            'from': transaction, 'to': payment}))['rate']
+
+    def get_exchange_rates(self, pairs, as_of=None):
+        """Get the exchange rates for many currency pairs from the
+        daemon, in one request.
+
+        :returns: a dictionary mapping the pairs to exchange rates, or
+            None for pairs without one.
+        """
+        pairs = list(pairs)
+        answer = self.request(dict(self._date(as_of),
+                                   pairs=[list(pair) for pair in pairs]))
+        return dict(zip(pairs, answer['rates']))
+
+
+class FallbackProvider:
+    """Converts through the daemon until it fails, and from then on
+    through a provider in this process, so a daemon stopping halfway
+    through a batch does not fail it. Stands in for a
+    `curry.api.Provider`, like `DaemonClient`.
+
+    :param client: a `DaemonClient`.
+    :param provider: the `curry.api.Provider` to fall back to.
+    """
+
+    def __init__(self, client, provider):
+        self.client = client
+        self.provider = provider
+        self.failed = False
+
+    def get_exchange_rate(self, transaction, payment, as_of=None):
+        """See `DaemonClient.get_exchange_rate`."""
+        if not self.failed:
+            try:
+                return self.client.get_exchange_rate(transaction, payment,
+                                                     as_of=as_of)
+            except DaemonError as e:
+                log.warning('{}, converting in this process'.format(e))
+                self.failed = True
+        return self.provider.get_exchange_rate(transaction, payment,
+                                               as_of=as_of)
+
+    def get_exchange_rates(self, pairs, as_of=None):
+        """See `DaemonClient.get_exchange_rates`. Once the daemon has
+        failed, the dictionary is empty, leaving the pairs to
+        `get_exchange_rate`."""
+        if not self.failed:
+            try:
+                return self.client.get_exchange_rates(pairs, as_of=as_of)
+            except DaemonError as e:
+                log.warning('{}, converting in this process'.format(e))
+                self.failed = True
+        return {}
@@ -9,6 +9,7 @@
 """
 import os
 import logging
+import threading
 import configparser
 
 from curry import prog_name
@@ -38,7 +39,8 @@ def get_cache_file(filename):
 
 class Config:
     """A simple wrapper for `configparser.ConfigParser`, implemented as
-    a Singleton [1]_.
+    a Singleton [1]_. The singleton is created, and options are set,
+    under a lock, so the config can be used from many threads.
 
     .. [1]: http://goo.gl/pVpkxe
     """
@@ -49,13 +51,19 @@ class Config:
         }
     }
 
+    _lock = threading.RLock()
+
     def __new__(cls, *args, **kwargs):
         if not hasattr(cls, 'self'):
-            cls.self = object.__new__(cls)
-            cls.self.config = configparser.ConfigParser()
-            cls.self.config.read_dict(Config.DEFAULTS)
-            if os.path.exists(config_file):
-                cls.self.config.read(config_file)
+            with cls._lock:
+                if not hasattr(cls, 'self'):
+                    self = object.__new__(cls)
+                    self.config = configparser.ConfigParser()
+                    self.config.read_dict(Config.DEFAULTS)
+                    if os.path.exists(config_file):
+                        self.config.read(config_file)
+                    # Only published once it is complete.
+                    cls.self = self
         return cls.self
 
     def default_api(self):
@@ -73,17 +81,31 @@ class Config:
         except:
             return v
 
+    def getfloat(self, key, val=None, section='curry'):
+        """Get an option as a float, or val if it is not set. Unlike
+        `get`, a float default is not truncated to an int."""
+        v = self.get(key, section=section)
+        return val if v is None else float(v)
+
+    def items(self, section):
+        """Get the options of a section as a dictionary, which is empty
+        if the section is missing."""
+        if section not in self.config:
+            return {}
+        return dict(self.config.items(section, raw=True))
+
     def set(self, key, val, section='curry'):
         if not val:
             log.debug('Skipping {}: {} ({})'.format(key, val, type(val)))
         else:
-            if section not in self.config:
-                self.config.add_section(section)
-            self.config.set(section, key, val)
+            with self._lock:
+                if section not in self.config:
+                    self.config.add_section(section)
+                self.config.set(section, key, val)
 
     def save(self):
         log.info('Saving config file: {}'.format(config_file))
-        with open(config_file, 'w') as f:
+        with self._lock, open(config_file, 'w') as f:
             self.config.write(f)
 
 
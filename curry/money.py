@@ -0,0 +1,232 @@
+"""
+    Curry
+    ~~~~~
+
+    Exact conversion of amounts in integer minor units
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import logging
+from decimal import Decimal, localcontext
+from fractions import Fraction
+
+from curry.config import config
+
+log = logging.getLogger(__name__)
+
+__all__ = ['minor_units', 'exact_rate', 'to_minor', 'format_minor',
+           'conversion_factors', 'convert_minor', 'convert_many',
+           'round_div', 'rounding_mode', 'ROUNDING_MODES', 'RATE_DIGITS']
+
+RATE_DIGITS = 15
+"""Exchange rates are exact fractions of their value rounded to this
+many significant digits, about the precision of a float, whatever
+their magnitude."""
+
+DEFAULT_MINOR_UNITS = 2
+
+MINOR_UNITS = {
+    # No minor unit
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0,
+    'KRW': 0, 'PYG': 0, 'RWF': 0, 'UGX': 0, 'UYI': 0, 'VND': 0, 'VUV': 0,
+    'XAF': 0, 'XOF': 0, 'XPF': 0,
+    # Thousandths
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+    # Ten thousandths
+    'CLF': 4, 'UYW': 4,
+}
+"""The ISO 4217 minor units (decimal places) of the currencies that do
+not have 2. Precious metals and other codes without minor units in ISO
+4217 (e.g. XAU) are given 2 as well."""
+
+HALF_EVEN, HALF_UP, HALF_DOWN = 'half_even', 'half_up', 'half_down'
+UP, DOWN, CEILING, FLOOR = 'up', 'down', 'ceiling', 'floor'
+
+ROUNDING_MODES = [HALF_EVEN, HALF_UP, HALF_DOWN, UP, DOWN, CEILING, FLOOR]
+"""The rounding modes, named as in the `decimal` module: 'up' and
+'down' round away from and towards zero, 'ceiling' and 'floor' towards
+positive and negative infinity, and the 'half_' modes round to the
+nearest, breaking ties as named."""
+
+DEFAULT_ROUNDING = HALF_EVEN
+
+
+def minor_units(code):
+    """Get the number of decimal places of a currency."""
+    return MINOR_UNITS.get(code.upper(), DEFAULT_MINOR_UNITS)
+
+
+def rounding_mode(mode=None):
+    """Check a rounding mode, default the 'rounding' option.
+
+    :returns: the rounding mode, or raises a ValueError.
+    """
+    mode = (mode or config.get('rounding', DEFAULT_ROUNDING)).lower()
+    mode = mode[len('round_'):] if mode.startswith('round_') else mode
+    if mode not in ROUNDING_MODES:
+        raise ValueError('Unknown rounding mode: {}'.format(mode))
+    return mode
+
+
+def round_div(num, den, mode=HALF_EVEN):
+    """Divide two integers, rounding the quotient.
+
+    :param num: the numerator.
+    :param den: the denominator, which must be positive.
+    :param mode: one of `ROUNDING_MODES`.
+
+    :returns: the rounded quotient.
+    """
+    q, r = divmod(num, den)
+    if not r:
+        return q
+    # q is rounded towards negative infinity, and 0 < r < den.
+    if mode == FLOOR:
+        return q
+    if mode == CEILING:
+        return q + 1
+    if mode == DOWN:
+        return q + 1 if q < 0 else q
+    if mode == UP:
+        return q if q < 0 else q + 1
+
+    twice = 2 * r
+    if twice != den:
+        return q + 1 if twice > den else q
+    if mode == HALF_EVEN:
+        return q + (q & 1)
+    if mode == HALF_UP:
+        return q if q < 0 else q + 1
+    return q + 1 if q < 0 else q
+
+
+def exact_rate(rate):
+    """Convert an exchange rate to an exact fraction of its value
+    rounded to RATE_DIGITS significant digits, so a float rate like 8.4
+    is 42/5, and not the binary fraction nearest to it.
+
+    :param rate: the exchange rate, e.g. a float from a provider.
+    """
+    if rate is None or rate <= 0:
+        raise ValueError('Invalid exchange rate: {}'.format(rate))
+    with localcontext() as ctx:
+        ctx.prec = RATE_DIGITS
+        return Fraction(+Decimal(rate))
+
+
+def to_minor(amount, code, mode=HALF_EVEN):
+    """Convert an amount to integer minor units of a currency, e.g.
+    12.34 USD to 1234, or 1234 JPY to 1234. Amounts with more decimal
+    places than the currency has are rounded.
+
+    :param amount: an int, float, `decimal.Decimal` or decimal string.
+    :param code: the currency code.
+    :param mode: one of `ROUNDING_MODES`.
+    """
+    places = minor_units(code)
+    if isinstance(amount, int):
+        return amount * 10 ** places
+    if isinstance(amount, float):
+        scaled = amount * 10 ** places
+        nearest = round(scaled)
+        # Exact whenever the amount has no more decimal places than the
+        # currency, which is the common case.
+        if abs(scaled - nearest) <= 1e-9 * max(1, abs(scaled)):
+            return nearest
+        amount = repr(amount)
+    fraction = Fraction(Decimal(amount)) * 10 ** places
+    return round_div(fraction.numerator, fraction.denominator, mode)
+
+
+def format_minor(minor, code):
+    """Format integer minor units of a currency as a decimal string,
+    e.g. 1234 USD as '12.34', or 1234 BHD as '1.234'."""
+    places = minor_units(code)
+    if not places:
+        return str(minor)
+    whole, fraction = divmod(abs(minor), 10 ** places)
+    return '{}{}.{:0{}d}'.format('-' if minor < 0 else '', whole, fraction,
+                                 places)
+
+
+def conversion_factors(rate, transaction, payment):
+    """Get the integer factors converting minor units of the transaction
+    currency to minor units of the payment currency at an exchange
+    rate: multiply by num, then divide by den (rounding). Both are
+    reduced by their common divisor.
+
+    :returns: a (num, den) tuple.
+    """
+    factor = exact_rate(rate) * Fraction(10 ** minor_units(payment),
+                                         10 ** minor_units(transaction))
+    return factor.numerator, factor.denominator
+
+
+def convert_minor(amount, rate, transaction, payment, mode=HALF_EVEN):
+    """Convert integer minor units of one currency to another.
+
+    :param amount: the amount, in minor units of the transaction
+        currency.
+    :param rate: the exchange rate from the transaction currency to the
+        payment currency.
+    :param transaction: the transaction (from) currency.
+    :param payment: the payment (to) currency.
+    :param mode: one of `ROUNDING_MODES`.
+
+    :returns: the converted amount, in minor units of the payment
+        currency.
+    """
+    num, den = conversion_factors(rate, transaction, payment)
+    return round_div(amount * num, den, mode)
+
+
+def convert_many(amounts, rate, transaction, payment, mode=HALF_EVEN):
+    """Convert many amounts in integer minor units at one exchange rate,
+    see `convert_minor`.
+
+    NumPy integer arrays are converted with array operations, in int64
+    when the products can not overflow, and otherwise in exact Python
+    integers. Other sequences give a list.
+
+    :param amounts: a sequence or NumPy array of amounts, in minor
+        units of the transaction currency.
+
+    :returns: a list or NumPy array of converted amounts, in minor
+        units of the payment currency.
+    """
+    num, den = conversion_factors(rate, transaction, payment)
+    if not hasattr(amounts, 'dtype'):
+        return [round_div(amount * num, den, mode) for amount in amounts]
+
+    import numpy as np
+    amounts = np.asarray(amounts)
+    if not len(amounts):
+        return amounts.astype(np.int64)
+    largest = int(np.abs(amounts).max())
+    if largest * num >= 2 ** 63 or den >= 2 ** 62:
+        log.debug('Converting in Python integers to avoid overflow')
+        exact = np.array([round_div(int(a) * num, den, mode)
+                          for a in amounts.tolist()], dtype=object)
+        return exact.astype(np.int64)
+
+    q, r = np.divmod(amounts.astype(np.int64) * num, den)
+    if mode == FLOOR:
+        up = np.zeros(len(q), dtype=bool)
+    elif mode == CEILING:
+        up = r > 0
+    elif mode == DOWN:
+        up = (r > 0) & (q < 0)
+    elif mode == UP:
+        up = (r > 0) & (q >= 0)
+    else:
+        twice = 2 * r
+        up = twice > den
+        tie = twice == den
+        if mode == HALF_EVEN:
+            up |= tie & (q % 2 == 1)
+        elif mode == HALF_UP:
+            up |= tie & (q >= 0)
+        else:
+            up |= tie & (q < 0)
+    return q + up
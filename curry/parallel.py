@@ -0,0 +1,279 @@
+"""
+    Curry
+    ~~~~~
+
+    Parallel batch conversion of large files
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import io
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from curry.api import APIError
+from curry.batch import read_rows, convert_rows, write_rows
+
+log = logging.getLogger(__name__)
+
+__all__ = ['SharedRates', 'split_file', 'convert_file']
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+_rates = None
+
+
+class SharedRates:
+    """A read-only snapshot of exchange rates, taken once from the
+    provider cache and shared with every worker process. It holds the
+    rates of single currency pairs, and for API providers fetching a
+    rate table, the rates relative to its base currency, from which any
+    cross rate is calculated.
+
+    :param pairs: a dictionary mapping (transaction, payment) tuples to
+        exchange rates.
+    :param base: the base currency of the rate table, if any.
+    :param rates: the rate table, mapping currency codes to the amount
+        of that currency one unit of the base currency buys.
+    """
+
+    def __init__(self, pairs=None, base=None, rates=None):
+        self.pairs = dict(pairs or {})
+        self.base = base
+        self.rates = dict(rates or {})
+        if base:
+            self.rates[base] = 1.0
+
+    def __repr__(self):
+        return '<SharedRates pairs={} base={} rates={}>'.format(
+            len(self.pairs), self.base, len(self.rates))
+
+    @classmethod
+    def from_provider(cls, provider, as_of=None):
+        """Take a snapshot of the usable exchange rates in the cache of
+        a provider. Rate tables are refreshed first if needed, while
+        pairs missing from the cache are left to `SharedRates.get`
+        callers to request.
+
+        :param provider: a `curry.api.Provider` instance.
+        :param as_of: a `datetime.date`, for which no rates are taken
+            from the cache, as it only holds the current rates.
+        """
+        from curry.api import (RateTableProvider, cache_state, EXPIRED,
+                               entry_cache_timeout)
+        api = provider.api
+        if as_of is not None or api.refresh_cache:
+            return cls()
+
+        if isinstance(api, RateTableProvider):
+            base, rates = api.get_base_rates()
+            return cls(base=base, rates={code: rate for code, rate in
+                                         (rates or {}).items() if rate})
+
+        pairs = {}
+        for transaction, payments in api.cache_backend.load(api.id_).items():
+            for payment, data in payments.items():
+                if cache_state(data.get('timestamp'), entry_cache_timeout(
+                        data, transaction, payment)) != EXPIRED:
+                    pairs[(transaction, payment)] = data.get('rate')
+        return cls(pairs=pairs)
+
+    def get(self, transaction, payment):
+        """Get the exchange rate of a currency pair.
+
+        :returns: the exchange rate, or None if it is not known.
+        """
+        pair = (transaction, payment)
+        if pair in self.pairs:
+            return self.pairs[pair]
+        t_rate = self.rates.get(transaction)
+        p_rate = self.rates.get(payment)
+        if t_rate and p_rate:
+            return p_rate * (1 / t_rate)
+        return None
+
+    def get_exchange_rate(self, transaction, payment, as_of=None):
+        """Stand in for `curry.api.Provider.get_exchange_rate` in
+        `curry.batch.convert_rows`."""
+        return self.get(transaction, payment)
+
+
+def split_file(path, chunk_size=DEFAULT_CHUNK_SIZE, start=0):
+    """Split a file into byte ranges of about chunk_size bytes, each
+    ending after a newline, so no row is split. Rows can therefore not
+    span lines, e.g. in quoted CSV fields.
+
+    :param path: the file.
+    :param chunk_size: the approximate size of each range.
+    :param start: the offset of the first range, e.g. after a header.
+
+    :returns: a generator of (start, end) tuples.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + chunk_size
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            end = min(end, size)
+            yield start, end
+            start = end
+
+
+def _init_worker(rates):
+    global _rates
+    _rates = rates
+
+
+def _convert_chunk(path, start, end, format, encoding, rounding,
+                   extra_rates, retry=False):
+    """Convert the rows of a byte range in a worker process.
+
+    :param extra_rates: exchange rates of pairs missing from the shared
+        rates, which are added to them. A rate of None marks a pair the
+        provider failed on.
+    :param retry: convert the rows even if some pairs are missing,
+        skipping their rows.
+
+    :returns: an (output, count, missing, skipped) tuple, where missing
+        is the set of currency pairs without a known exchange rate, and
+        skipped maps currency pairs to their number of skipped rows. If
+        any pair is missing nothing is converted, and the chunk must be
+        retried with their rates in extra_rates.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    rows = list(read_rows(io.StringIO(data.decode(encoding))))
+
+    if extra_rates:
+        _rates.pairs.update(extra_rates)
+    if not retry:
+        missing = {(transaction, payment)
+                   for transaction, payment, _, _ in rows
+                   if (transaction, payment) not in _rates.pairs and
+                   _rates.get(transaction, payment) is None}
+        if missing:
+            return None, 0, missing, {}
+
+    output = io.StringIO()
+    skipped = {}
+    count = write_rows(convert_rows(rows, _rates, rounding=rounding,
+                                    skipped=skipped), output, format=format)
+    return output.getvalue(), count, set(), skipped
+
+
+def convert_file(path, output, provider, jobs=None, format='csv',
+                 header=None, as_of=None, rounding=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8',
+                 skipped=None):
+    """Convert the rows of a file in parallel, in a pool of worker
+    processes, writing the converted rows in the original order.
+
+    The file is split into byte ranges (see `split_file`), converted by
+    the workers using a `SharedRates` snapshot of the provider cache.
+    A chunk with currency pairs missing from the snapshot is sent back:
+    their exchange rates are requested through the provider, once per
+    pair, and the chunk is converted again, skipping the rows of pairs
+    the provider failed on, as `curry.batch.convert_rows` does. Only a
+    bounded window of chunks is in flight, so memory use does not grow
+    with the file.
+
+    :param path: the CSV file to read rows from.
+    :param output: a file object opened in text mode.
+    :param provider: a `curry.api.Provider` instance.
+    :param jobs: the number of worker processes, default the number of
+        CPUs.
+    :param format: the output format, either 'csv' or 'jsonl'.
+    :param header: if not None, the input starts with a header row,
+        which is skipped, and a header row is written first, with these
+        names for the passthrough columns (CSV only).
+    :param as_of: a `datetime.date` to use the exchange rates of,
+        default the current exchange rates.
+    :param rounding: the rounding mode, default the 'rounding' option.
+    :param chunk_size: the approximate size in bytes of each chunk.
+    :param encoding: the encoding of the file.
+    :param skipped: a dictionary, which is updated with the number of
+        skipped rows of every currency pair.
+
+    :returns: the number of rows written.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    rates = SharedRates.from_provider(provider, as_of)
+    log.info('Converting {} with {} workers, using {!r}'
+             .format(path, jobs, rates))
+
+    start = 0
+    if header is not None:
+        with open(path, 'rb') as f:
+            f.readline()
+            start = f.tell()
+    write_rows([], output, format=format, header=header)
+
+    resolved = {}
+    skipped = {} if skipped is None else skipped
+
+    def resolve(missing):
+        for transaction, payment in sorted(missing):
+            if (transaction, payment) in resolved:
+                continue
+            try:
+                rate = provider.get_exchange_rate(transaction, payment,
+                                                  as_of=as_of)
+            except APIError as e:
+                log.error(e)
+                rate = None
+            resolved[(transaction, payment)] = rate
+
+    count = 0
+    with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                             initargs=(rates,)) as pool:
+
+        def submit(chunk, retry=False):
+            # Rates requested so far go along, as the workers only have
+            # the snapshot they started with.
+            return pool.submit(_convert_chunk, path, chunk[0], chunk[1],
+                               format, encoding, rounding, dict(resolved),
+                               retry)
+
+        chunks = split_file(path, chunk_size, start)
+        window = deque()
+        for chunk in chunks:
+            window.append((chunk, submit(chunk), False))
+            if len(window) < jobs * 2:
+                continue
+            count += _write_next(window, output, submit, resolve, skipped)
+        while window:
+            count += _write_next(window, output, submit, resolve, skipped)
+    return count
+
+
+def _write_next(window, output, submit, resolve, skipped):
+    """Wait for the oldest chunk in the window and write it.
+
+    Chunks that had pairs missing from the shared rates are retried
+    once, with the rates requested, as soon as they are back rather
+    than when they reach the front of the window, so the retries run
+    alongside the other chunks. Rows of pairs still missing are then
+    skipped.
+    """
+    for i, (chunk, future, retried) in enumerate(list(window)):
+        if retried or (i and not future.done()):
+            continue
+        missing = future.result()[2]
+        if missing:
+            log.info('Requesting {} exchange rates missing from the cache'
+                     .format(len(missing)))
+            resolve(missing)
+            window[i] = (chunk, submit(chunk, retry=True), True)
+
+    chunk, future, _ = window.popleft()
+    text, count, _, chunk_skipped = future.result()
+    for pair, rows in chunk_skipped.items():
+        skipped[pair] = skipped.get(pair, 0) + rows
+    output.write(text)
+    return count
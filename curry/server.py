@@ -0,0 +1,261 @@
+"""
+    Curry
+    ~~~~~
+
+    Resident rate daemon
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import sys
+import json
+import signal
+import socket
+import logging
+import datetime
+import threading
+import socketserver
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from curry.config import config
+from curry.api import Provider, APIError
+from curry.api.metrics import metrics
+from curry.client import daemon_path
+from curry.money import rounding_mode, to_minor, format_minor, convert_minor
+
+log = logging.getLogger(__name__)
+
+__all__ = ['ConversionService', 'serve']
+
+DEFAULT_HOST = '127.0.0.1'
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+class ConversionService:
+    """Answers conversion requests, keeping a `Provider` per API
+    provider, API key and refresh setting, so their caches stay parsed
+    in memory between requests. Providers are shared by the threads
+    serving the requests.
+
+    A request is a dictionary with the 'from' and 'to' currencies and
+    an optional 'amount', or a list of [from, to] currency 'pairs'. It
+    may also name the 'api', 'api_key', 'refresh_cache', 'date'
+    (YYYY-MM-DD) and 'rounding' mode to use. The answer holds the
+    'rate' and 'result', or the list of 'rates' of the pairs (null for
+    pairs without one), or an 'error' message, and the 'provider' it
+    came from, if any. The
+    result is converted exactly, as `curry` does, and given as a
+    decimal string with the decimal places of the payment currency.
+    """
+
+    def __init__(self):
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def provider(self, api=None, api_key=None, refresh_cache=False):
+        """Get the shared provider for a set of provider options."""
+        api = api or config.get('api', config.default_api())
+        if api_key is None:
+            api_key = config.get('api_key', section=api)
+        key = (api, api_key, bool(refresh_cache))
+        with self._lock:
+            if key not in self._providers:
+                log.info('Starting provider: {}'.format(api))
+                self._providers[key] = Provider(api=api, api_key=api_key,
+                                                refresh_cache=refresh_cache)
+            return self._providers[key]
+
+    def pair_rate(self, provider, transaction, payment, as_of=None):
+        """Get the exchange rate of one of the 'pairs' of a request, so
+        a pair without one does not fail the others.
+
+        :returns: the exchange rate, or None.
+        """
+        try:
+            rate = provider.get_exchange_rate(transaction, payment,
+                                              as_of=as_of)
+        except APIError as e:
+            log.warning(e)
+            return None
+        return rate if rate and rate > 0 else None
+
+    def handle(self, request):
+        """Answer a request.
+
+        :param request: the decoded request dictionary.
+
+        :returns: the answer dictionary.
+        """
+        try:
+            if not isinstance(request, dict):
+                raise ValueError('Expected a JSON object')
+            provider = self.provider(request.get('api'),
+                                     request.get('api_key'),
+                                     request.get('refresh_cache'))
+            as_of = request.get('date')
+            if as_of is not None:
+                as_of = datetime.datetime.strptime(as_of, '%Y-%m-%d').date()
+
+            if 'pairs' in request:
+                return {'rates': [self.pair_rate(provider, t, p, as_of)
+                                  for t, p in request['pairs']]}
+
+            transaction = request['from'].upper()
+            payment = request['to'].upper()
+            rate = provider.get_exchange_rate(transaction, payment,
+                                              as_of=as_of)
+            if not rate or rate <= 0:
+                return {'error': 'No exchange rate for {}/{}'.format(
+                    transaction, payment), 'provider': provider.api.id_}
+            mode = rounding_mode(request.get('rounding'))
+            amount = to_minor(request.get('amount', 1), transaction, mode)
+            result = convert_minor(amount, rate, transaction, payment, mode)
+            return {'rate': rate, 'result': format_minor(result, payment)}
+        except APIError as e:
+            return {'error': e.message, 'provider': e.id_}
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            return {'error': 'Bad request: {}'.format(e)}
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    """Reads requests as JSON lines, answering each with a JSON line,
+    until the client disconnects."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                answer = self.server.service.handle(json.loads(
+                    line.decode('utf-8')))
+            except ValueError as e:
+                answer = {'error': 'Bad request: {}'.format(e)}
+            self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    """Answers 'GET /convert?from=..&to=..&amount=..', 'POST /convert'
+    with a JSON request body, and 'GET /metrics' in the Prometheus text
+    format."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            return self.reply(200, metrics.to_prometheus().encode('utf-8'),
+                              'text/plain; version=0.0.4')
+        if url.path != '/convert':
+            return self.reply_json(404, {'error': 'Not found'})
+        request = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if 'refresh_cache' in request:
+            request['refresh_cache'] = request['refresh_cache'] in ('1',
+                                                                    'true')
+        self.answer(request)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/convert':
+            return self.reply_json(404, {'error': 'Not found'})
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_REQUEST_SIZE:
+            return self.reply_json(413, {'error': 'Request too large'})
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            return self.reply_json(400, {'error': 'Bad request: {}'
+                                         .format(e)})
+        self.answer(request)
+
+    def answer(self, request):
+        answer = self.server.service.handle(request)
+        self.reply_json(400 if 'error' in answer else 200, answer)
+
+    def reply_json(self, status, answer):
+        self.reply(status, json.dumps(answer).encode('utf-8'),
+                   'application/json')
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _remove_stale_socket(path):
+    """Remove a socket file left behind by a daemon that is gone, or
+    raise an APIError if a daemon is still answering on it."""
+    if not os.path.exists(path):
+        return
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except OSError:
+        log.info('Removing stale socket: {}'.format(path))
+        os.unlink(path)
+    else:
+        raise APIError('A daemon is already running on {}'.format(path))
+    finally:
+        s.close()
+
+
+def serve(socket_path=None, port=None, host=DEFAULT_HOST):
+    """Run the daemon until interrupted, answering requests on a Unix
+    domain socket, and if a port is given, over HTTP.
+
+    :param socket_path: the socket file, default the 'socket' option,
+        or 'curry.sock' in the cache directory.
+    :param port: the HTTP port, or None to not serve HTTP.
+    :param host: the address to serve HTTP on, default localhost only.
+    """
+    service = ConversionService()
+    socket_path = socket_path or daemon_path()
+    _remove_stale_socket(socket_path)
+
+    umask = os.umask(0o077)
+    try:
+        unix_server = _UnixServer(socket_path, _UnixHandler)
+    finally:
+        os.umask(umask)
+    unix_server.service = service
+    servers = [unix_server]
+    log.info('Serving on {}'.format(socket_path))
+
+    if port is not None:
+        http_server = ThreadingHTTPServer((host, port), _HTTPHandler)
+        http_server.daemon_threads = True
+        http_server.service = service
+        servers.append(http_server)
+        log.info('Serving HTTP on {}:{}'.format(host, port))
+
+    threads = [threading.Thread(target=server.serve_forever,
+                                name='curry-serve', daemon=True)
+               for server in servers[1:]]
+    for thread in threads:
+        thread.start()
+    # Clean up on SIGTERM as on Ctrl-C.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        unix_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers[1:]:
+            server.shutdown()
+        for server in servers:
+            server.server_close()
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,162 @@
+"""
+    Curry
+    ~~~~~
+
+    Prefetching of exchange rates into the cache
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import re
+import random
+import asyncio
+import logging
+import threading
+
+from curry.config import config
+from curry.api import (APIError, RateTableProvider, get_api_provider,
+                       get_cache_timeout)
+
+log = logging.getLogger(__name__)
+
+__all__ = ['parse_pairs', 'warm_targets', 'warm', 'warm_interval',
+           'next_delay', 'run_periodically']
+
+SECTION = 'warm'
+DEFAULT_INTERVAL_FRACTION = 0.75
+DEFAULT_JITTER = 0.1
+
+
+def parse_pairs(text):
+    """Parse a list of currency pairs, separated by commas or white
+    space, each on the form 'EUR/USD' or 'EURUSD'.
+
+    :returns: a list of upper-cased (transaction, payment) tuples, or
+        raises a ValueError.
+    """
+    pairs = []
+    for item in re.split(r'[\s,]+', text or ''):
+        if not item:
+            continue
+        match = re.match(r'^([A-Za-z]{3})/?([A-Za-z]{3})$', item)
+        if not match:
+            raise ValueError('Invalid currency pair: {!r}, expected e.g. '
+                             'EUR/USD'.format(item))
+        pairs.append((match.group(1).upper(), match.group(2).upper()))
+    return pairs
+
+
+def warm_targets(api=None, pairs=None):
+    """Get what to warm from the [warm] section of the config file:
+    the currency 'pairs' to fetch from an API provider, and the API
+    providers whose rate 'tables' to fetch.
+
+    :param api: the API provider of the pairs, default the 'api' option
+        of the [warm] section, or of the [curry] section.
+    :param pairs: the pairs, default the 'pairs' option.
+
+    :returns: a dictionary mapping API providers to the list of pairs
+        to fetch from them, which is empty for rate tables.
+    """
+    api = api or config.get('api', section=SECTION) or \
+        config.get('api', config.default_api())
+    if pairs is None:
+        pairs = parse_pairs(config.get('pairs', '', section=SECTION))
+
+    targets = {}
+    for table in re.split(r'[\s,]+', config.get('tables', '',
+                                                section=SECTION)):
+        if table:
+            targets[table] = []
+    if pairs:
+        targets.setdefault(api, []).extend(pairs)
+    return targets
+
+
+async def _warm_api(api, pairs, refresh_cache, priority):
+    """Fetch the pairs, or the rate table, of one API provider."""
+    from curry.api.aio import AsyncProvider
+    provider = AsyncProvider(api=api, priority=priority,
+                             api_key=config.get('api_key', section=api),
+                             refresh_cache=refresh_cache)
+    if not pairs and not isinstance(provider.api, RateTableProvider):
+        raise APIError('No pairs to warm, and not a rate table', api)
+    rates = await provider.get_exchange_rates(pairs)
+    failed = sorted(pair for pair, rate in rates.items() if rate <= 0)
+    if failed:
+        raise APIError('Failed to fetch {}'.format(', '.join(
+            '{}/{}'.format(*pair) for pair in failed)), api)
+    log.info('Warmed {}'.format('{} pairs'.format(len(pairs)) if pairs
+                                else 'the rate table'))
+
+
+def warm(targets, refresh_cache=False, priority=None):
+    """Fetch the exchange rates of every target into the cache, with
+    the API providers, and the requests to each of them, running
+    concurrently.
+
+    :param targets: a dictionary mapping API providers to pairs, see
+        `warm_targets`.
+    :param refresh_cache: fetch every rate, even if it is cached.
+    :param priority: the request priority, see `curry.api.scheduler`.
+
+    :returns: the number of API providers that failed, whose errors
+        are logged.
+    """
+    for api in targets:
+        get_api_provider(api)
+
+    async def run():
+        return await asyncio.gather(*[
+            _warm_api(api, pairs, refresh_cache, priority)
+            for api, pairs in targets.items()], return_exceptions=True)
+
+    failed = 0
+    for result in asyncio.run(run()):
+        if isinstance(result, Exception):
+            if not isinstance(result, APIError):
+                raise result
+            log.error(result)
+            failed += 1
+    return failed
+
+
+def warm_interval():
+    """Get the seconds between refreshes, from the 'interval' option of
+    the [warm] section, default three quarters of the cache timeout, so
+    cached rates are refreshed before they expire."""
+    interval = config.get('interval', section=SECTION)
+    if interval:
+        return float(interval)
+    return get_cache_timeout() * DEFAULT_INTERVAL_FRACTION
+
+
+def next_delay(interval, jitter=None):
+    """Get the seconds until the next refresh: the interval, moved by a
+    random fraction of up to 'jitter' (default 0.1) either way, so many
+    refreshers do not request the API providers at the same time.
+    """
+    if jitter is None:
+        jitter = config.getfloat('jitter', DEFAULT_JITTER, section=SECTION)
+    return max(0, interval * (1 + random.uniform(-jitter, jitter)))
+
+
+def run_periodically(targets, interval=None, stop=None):
+    """Refresh every target at jittered intervals until stopped. Every
+    round fetches all rates, at background priority, so lookups always
+    find them fresh and go ahead of the refreshes in the rate limits.
+
+    :param targets: see `warm_targets`.
+    :param interval: the seconds between refreshes, default
+        `warm_interval()`.
+    :param stop: a `threading.Event` that ends the loop when set.
+    """
+    from curry.api.scheduler import BACKGROUND
+    interval = interval or warm_interval()
+    stop = stop or threading.Event()
+    while True:
+        warm(targets, refresh_cache=True, priority=BACKGROUND)
+        delay = next_delay(interval)
+        log.info('Refreshing again in {:.0f} seconds'.format(delay))
+        if stop.wait(delay):
+            return
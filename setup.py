@@ -37,6 +37,9 @@ setup(
         'requests',  # 2.4.3
         'beautifulsoup4',
     ],
+    extras_require={
+        'matrix': ['numpy'],
+    },
     data_files=[
         ('share/man/man1', ['data/curry.1']),
         ('share/zsh/site-functions', ['data/_curry']),
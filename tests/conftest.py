@@ -0,0 +1,59 @@
+"""
+    Curry
+    ~~~~~
+
+    Test fixtures
+
+    Copyright: (c) 2014 Einar Uvsløkk
+    License: GNU General Public License (GPL) version 3 or later
+"""
+import os
+import sys
+import time
+import tempfile
+
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# The config and cache directories are set up when curry is imported,
+# so they are pointed away from the user's before any test imports it.
+home = tempfile.mkdtemp(prefix='curry-test-')
+os.environ['HOME'] = home
+os.environ['XDG_CONFIG_HOME'] = os.path.join(home, '.config')
+os.environ['XDG_CACHE_HOME'] = os.path.join(home, '.cache')
+
+sys.path.insert(0, os.path.join(os.path.dirname(here), 'benchmarks'))
+
+
+def wait_for(condition, timeout=5):
+    """Wait for a condition to become true.
+
+    :returns: whether it did within the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture(scope='session')
+def stub():
+    """A stub server answering like every API provider, see
+    benchmarks/stubs.py."""
+    from stubs import StubServer
+
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture(scope='session')
+def env(stub, tmp_path_factory):
+    """The benchmark environment, which points every API provider at the
+    stub server for the whole session, and creates providers with empty
+    caches of their own, see benchmarks/suite.py."""
+    from suite import Environment
+
+    return Environment(stub, str(tmp_path_factory.mktemp('env')))
@@ -0,0 +1,93 @@
+import io
+import csv
+import json
+
+import pytest
+
+from curry.batch import read_header, read_rows, convert_rows, write_rows
+from curry.money import to_minor, format_minor, convert_minor
+
+API = 'finance.yahoo.com'
+TABLE_API = 'openexchangerates.org'
+
+INPUT = '''from,to,amount,note
+EUR,USD,10,a
+eur, nok ,0.5,b
+EUR,QQQ,5,c
+not a row
+GBP,JPY,1234.5,d
+EUR,QQQ,1,e
+'''
+
+
+def expected(stub, transaction, payment, amount):
+    minor = convert_minor(to_minor(amount, transaction),
+                          stub.rate(transaction, payment), transaction,
+                          payment)
+    return format_minor(minor, payment)
+
+
+def convert(provider, text=INPUT, **kwargs):
+    f = io.StringIO(text)
+    header = read_header(f)
+    output = io.StringIO()
+    skipped = {}
+    count = write_rows(convert_rows(read_rows(f), provider, skipped=skipped),
+                       output, header=header, **kwargs)
+    return count, output.getvalue(), skipped
+
+
+@pytest.mark.parametrize('api', [API, TABLE_API])
+def test_convert(env, api):
+    count, output, skipped = convert(env.new_provider(api))
+    rows = list(csv.reader(io.StringIO(output)))
+
+    assert count == 3
+    assert rows[0] == ['from', 'to', 'amount', 'rate', 'result', 'note']
+    assert [row[:3] + row[4:] for row in rows[1:]] == [
+        ['EUR', 'USD', '10.0', expected(env.stub, 'EUR', 'USD', 10), 'a'],
+        ['EUR', 'NOK', '0.5', expected(env.stub, 'EUR', 'NOK', 0.5), 'b'],
+        ['GBP', 'JPY', '1234.5', expected(env.stub, 'GBP', 'JPY', 1234.5),
+         'd'],
+    ]
+    assert skipped == {('EUR', 'QQQ'): 2}
+
+
+def test_convert_jsonl(env):
+    count, output, _ = convert(env.new_provider(API), format='jsonl')
+    rows = [json.loads(line) for line in output.splitlines()]
+    assert count == len(rows) == 3
+    assert rows[2]['to'] == 'JPY'
+    assert rows[2]['result'] == int(expected(env.stub, 'GBP', 'JPY', 1234.5))
+    assert rows[2]['extra'] == ['d']
+
+
+def test_each_pair_is_requested_once(env):
+    provider = env.new_provider(API)
+    before = sum(env.stub.requests.values())
+    convert(provider, 'EUR,USD,1\n' * 50 + 'EUR,QQQ,1\n' * 50)
+    assert sum(env.stub.requests.values()) == before + 2
+
+
+def test_cli_reports_skipped_rows(env, tmp_path, capsys, caplog):
+    from curry.cli import batch
+
+    path = tmp_path / 'rows.csv'
+    path.write_text(INPUT)
+    assert batch(['curry', 'batch', '--header', '-a', API, str(path)]) == 1
+    assert len(capsys.readouterr().out.splitlines()) == 4
+    assert 'Skipped 2 rows without an exchange rate: EUR/QQQ' in caplog.text
+
+    path.write_text('EUR,USD,1\n')
+    assert batch(['curry', 'batch', '-a', API, str(path)]) == 0
+
+
+@pytest.mark.parametrize('jobs', ['-1', 'many'])
+def test_cli_rejects_invalid_jobs(capsys, jobs):
+    from curry.cli import parse_batch_command_line
+
+    with pytest.raises(SystemExit) as e:
+        parse_batch_command_line(['curry', 'batch', '-j', jobs])
+    assert e.value.code == 2
+    assert 'invalid number of jobs' in capsys.readouterr().err
+    assert parse_batch_command_line(['curry', 'batch', '-j', '0']).jobs == 0
@@ -0,0 +1,146 @@
+import time
+
+import pytest
+
+from curry.api.cache import JSONCache, SQLiteCache, MemoryCache
+
+PROVIDER = 'test'
+PAIR_API = 'finance.yahoo.com'
+TABLE_API = 'openexchangerates.org'
+
+
+@pytest.fixture(params=['json', 'sqlite', 'memory'])
+def new_backend(request, tmp_path):
+    """Create backends sharing one store, so changes made through one
+    are seen by the others."""
+    backends = []
+
+    def new():
+        if request.param == 'json':
+            backend = JSONCache(str(tmp_path))
+        elif request.param == 'sqlite':
+            backend = SQLiteCache(str(tmp_path / 'cache.sqlite'))
+        else:
+            backend = MemoryCache(SQLiteCache(str(tmp_path / 'cache.sqlite')))
+        backends.append(backend)
+        return backend
+
+    yield new
+    for backend in backends:
+        backend.close()
+
+
+def entry(rate, timestamp=1000.0):
+    return {'rate': rate, 'timestamp': timestamp}
+
+
+def test_pairs(new_backend):
+    backend = new_backend()
+    assert backend.load(PROVIDER) == {}
+    backend.update(PROVIDER, {'EUR': {'USD': entry(1.25), 'NOK': entry(8.5)}})
+    backend.update(PROVIDER, {'EUR': {'USD': entry(1.5, 2000.0)},
+                              'USD': {'JPY': entry(110.0)}})
+
+    assert backend.get(PROVIDER, 'EUR', 'USD') == entry(1.5, 2000.0)
+    assert backend.get(PROVIDER, 'EUR', 'SEK') is None
+    assert backend.count(PROVIDER) == 3
+    assert backend.load('other') == {}
+
+    backend.delete(PROVIDER, [('EUR', 'NOK'), ('USD', 'JPY')])
+    assert backend.load(PROVIDER) == {'EUR': {'USD': entry(1.5, 2000.0)}}
+
+
+def test_rate_table(new_backend):
+    backend = new_backend()
+    table = {'base': 'USD', 'rates': {'EUR': 0.8, 'NOK': 6.5},
+             'inverse_rates': {'EUR': 1.25, 'NOK': 1 / 6.5},
+             'timestamp': 1000.0, 'etag': '"x"'}
+    backend.replace(PROVIDER, table)
+    loaded = backend.load(PROVIDER)
+    assert loaded['base'] == 'USD'
+    assert loaded['rates'] == pytest.approx(table['rates'])
+    assert loaded['inverse_rates'] == pytest.approx(table['inverse_rates'])
+    assert loaded['timestamp'] == 1000.0
+    assert loaded['etag'] == '"x"'
+
+
+def test_changes_are_seen_by_other_instances(new_backend):
+    writer, reader = new_backend(), new_backend()
+    reader.load(PROVIDER)
+    version = reader.version(PROVIDER)
+    # Make sure an mtime based version can move on.
+    time.sleep(0.01)
+    writer.update(PROVIDER, {'EUR': {'USD': entry(1.25)}})
+    if version is not None:
+        assert reader.version(PROVIDER) != version
+    if isinstance(reader, MemoryCache):
+        reader.ttl = 0
+    assert reader.get(PROVIDER, 'EUR', 'USD') == entry(1.25)
+
+
+@pytest.mark.parametrize('api', [PAIR_API, TABLE_API])
+def test_provider_requests_only_when_needed(env, api):
+    def requests():
+        return sum(env.stub.requests.values())
+
+    provider = env.new_provider(api)
+    before = requests()
+    rate = provider.get_exchange_rate('EUR', 'USD')
+    assert rate == pytest.approx(env.stub.rate('EUR', 'USD'), rel=1e-3)
+    assert requests() == before + 1
+
+    # Fresh rates are answered from the cache, also by a new provider.
+    assert provider.get_exchange_rate('EUR', 'USD') == rate
+    assert env.new_provider(api, provider.api.cache_backend) \
+        .get_exchange_rate('EUR', 'USD') == rate
+    assert requests() == before + 1
+
+    env.expire(provider)
+    assert provider.get_exchange_rate('EUR', 'USD') == \
+        pytest.approx(rate, rel=1e-3)
+    assert requests() == before + 2
+
+
+@pytest.mark.parametrize('backend_class', [JSONCache, SQLiteCache])
+def test_memory_cache_reloads_only_on_change(tmp_path, backend_class):
+    path = str(tmp_path / 'cache.sqlite') if backend_class is SQLiteCache \
+        else str(tmp_path)
+    memory = MemoryCache(backend_class(path))
+    other = backend_class(path)
+    try:
+        other.update(PROVIDER, {'EUR': {'USD': entry(1.25)}})
+        cache = memory.load(PROVIDER)
+        assert memory.load(PROVIDER) is cache
+        assert memory.stats == {'hits': 1, 'misses': 1, 'reloads': 0}
+
+        # Own writes are applied in memory, without reloading.
+        memory.update(PROVIDER, {'EUR': {'NOK': entry(8.5)}})
+        assert memory.get(PROVIDER, 'EUR', 'NOK') == entry(8.5)
+        assert memory.stats['reloads'] == 0
+        assert cache == {'EUR': {'USD': entry(1.25)}}
+
+        time.sleep(0.01)
+        other.update(PROVIDER, {'EUR': {'USD': entry(1.5)}})
+        assert memory.get(PROVIDER, 'EUR', 'USD') == entry(1.5)
+        assert memory.stats['reloads'] == 1
+    finally:
+        memory.close()
+        other.close()
+
+
+def test_lookups_compact_the_cache_periodically(env, monkeypatch):
+    import curry.api
+
+    monkeypatch.setattr(curry.api, '_last_compacted', {})
+    provider = env.new_provider(PAIR_API)
+    backend = provider.api.cache_backend
+    backend.update(PAIR_API, {'EUR': {'USD': entry(1.25, time.time()),
+                                      'NOK': entry(8.5, 1000.0)}})
+
+    assert provider.api.get_exchange_rate_from_cache('EUR', 'USD') == 1.25
+    assert backend.get(PAIR_API, 'EUR', 'NOK') is None
+
+    # Not again within the interval.
+    backend.update(PAIR_API, {'EUR': {'SEK': entry(9.5, 1000.0)}})
+    assert provider.api.get_exchange_rate_from_cache('EUR', 'USD') == 1.25
+    assert backend.get(PAIR_API, 'EUR', 'SEK') == entry(9.5, 1000.0)
@@ -0,0 +1,116 @@
+import os
+import threading
+
+import pytest
+
+from curry.api import flight
+from curry.api.flight import single_flight, file_lock, lock_path
+
+fcntl = pytest.importorskip('fcntl')
+
+
+class WatchedEvent(threading.Event):
+    """An event telling when someone waits for it."""
+
+    def __init__(self):
+        threading.Event.__init__(self)
+        self.waited = threading.Event()
+
+    def wait(self, timeout=None):
+        self.waited.set()
+        return threading.Event.wait(self, timeout)
+
+
+def test_concurrent_callers_share_one_fetch():
+    key = ('test', 'EUR', 'USD')
+    started, release = threading.Event(), threading.Event()
+    fetches, results = [], []
+
+    def fetch():
+        fetches.append(threading.current_thread().name)
+        started.set()
+        release.wait(5)
+        return 1.25
+
+    def call():
+        results.append(single_flight(key, fetch))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    done = flight._flights[key].done = WatchedEvent()
+
+    follower = threading.Thread(target=call)
+    follower.start()
+    assert done.waited.wait(5)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(fetches) == 1
+    assert results == [1.25, 1.25]
+    assert key not in flight._flights
+
+
+def test_waiting_callers_get_the_error():
+    key = ('test', 'EUR', 'QQQ')
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        raise ValueError('No rate')
+
+    def call():
+        try:
+            single_flight(key, fetch)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(5)
+    done = flight._flights[key].done = WatchedEvent()
+    threads[1].start()
+    assert done.waited.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+
+def test_result_saved_by_another_process_is_used():
+    result = single_flight(('test', 'checked'), lambda: 1 / 0, lambda: 1.5)
+    assert result == 1.5
+
+
+def test_stale_lock_file_does_not_block():
+    key = ('test', 'stale')
+    # A lock file left by a process that died is not locked.
+    path = lock_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+    assert single_flight(key, lambda: 2.5) == 2.5
+
+
+def test_held_lock_times_out(monkeypatch, caplog):
+    monkeypatch.setattr(flight, 'DEFAULT_LOCK_TIMEOUT', 0.05)
+    key = ('test', 'held')
+    path = lock_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        assert single_flight(key, lambda: 3.5) == 3.5
+    finally:
+        os.close(fd)
+    assert 'Timed out waiting for lock' in caplog.text
+
+    # The lock is free again once the holder is gone.
+    caplog.clear()
+    with file_lock(path, timeout=0):
+        pass
+    assert 'Timed out' not in caplog.text
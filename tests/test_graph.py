@@ -0,0 +1,72 @@
+import pytest
+
+from curry.api.graph import RateGraph, SHORTEST, FRESHEST
+
+
+def entry(rate, timestamp=1000.0):
+    return {'rate': rate, 'timestamp': timestamp}
+
+
+def test_rate_is_derived_over_cached_pairs():
+    graph = RateGraph()
+    graph.sync({'EUR': {'USD': entry(1.25)}, 'USD': {'NOK': entry(8.0)}}, 1)
+    rate, path = graph.triangulate('EUR', 'NOK')
+    assert path == ['EUR', 'USD', 'NOK']
+    assert rate == pytest.approx(10.0)
+    rate, path = graph.triangulate('NOK', 'EUR')
+    assert rate == pytest.approx(0.1)
+    assert graph.triangulate('EUR', 'JPY') is None
+
+
+def test_changed_edge_rate_is_used():
+    graph = RateGraph()
+    cache = {'EUR': {'USD': entry(1.25)}, 'USD': {'NOK': entry(8.0)}}
+    graph.sync(cache, 1)
+    assert graph.triangulate('EUR', 'NOK')[0] == pytest.approx(10.0)
+
+    cache = {'EUR': {'USD': entry(1.5, 2000.0)}, 'USD': {'NOK': entry(8.0)}}
+    # An unchanged version is not synced.
+    graph.sync(cache, 1)
+    assert graph.triangulate('EUR', 'NOK')[0] == pytest.approx(10.0)
+    graph.sync(cache, 2)
+    assert graph.triangulate('EUR', 'NOK')[0] == pytest.approx(12.0)
+
+
+def test_new_edge_connects_pairs_without_a_path():
+    graph = RateGraph()
+    cache = {'EUR': {'USD': entry(1.25)}}
+    graph.sync(cache, 1)
+    assert graph.triangulate('EUR', 'NOK') is None
+
+    cache['USD'] = {'NOK': entry(8.0)}
+    graph.sync(cache, 2)
+    assert graph.triangulate('EUR', 'NOK')[1] == ['EUR', 'USD', 'NOK']
+
+
+def test_stale_path_is_rejected():
+    graph = RateGraph()
+    graph.sync({'EUR': {'USD': entry(1.25, 1000.0),
+                        'SEK': entry(10.0, 3000.0)},
+                'USD': {'NOK': entry(8.0, 3000.0)},
+                'SEK': {'NOK': entry(0.9, 3000.0)}}, 1)
+    assert graph.triangulate('EUR', 'NOK')[1] == ['EUR', 'SEK', 'NOK']
+
+    # The kept path is dropped once one of its edges is too old.
+    graph = RateGraph()
+    graph.sync({'EUR': {'USD': entry(1.25, 1000.0)},
+                'USD': {'NOK': entry(8.0, 3000.0)}}, 1)
+    assert graph.triangulate('EUR', 'NOK', min_timestamp=500.0)
+    assert graph.triangulate('EUR', 'NOK', min_timestamp=2000.0) is None
+
+
+def test_modes_prefer_fewer_hops_or_fresher_rates():
+    graph = RateGraph(max_hops=3)
+    graph.sync({'EUR': {'USD': entry(1.25, 1000.0),
+                        'SEK': entry(10.0, 3000.0)},
+                'USD': {'NOK': entry(8.0, 1000.0)},
+                'SEK': {'DKK': entry(0.7, 3000.0)},
+                'DKK': {'NOK': entry(1.4, 3000.0)}}, 1)
+    assert graph.find_path('EUR', 'NOK', mode=SHORTEST) == \
+        ['EUR', 'USD', 'NOK']
+    assert graph.find_path('EUR', 'NOK', mode=FRESHEST) == \
+        ['EUR', 'SEK', 'DKK', 'NOK']
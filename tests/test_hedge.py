@@ -0,0 +1,66 @@
+import pytest
+
+from curry.api import hedge
+
+PAIR_API = 'finance.yahoo.com'
+TABLE_API = 'openexchangerates.org'
+HOSTS = ['download.finance.yahoo.com', 'openexchangerates.org']
+
+
+@pytest.fixture(autouse=True)
+def records(monkeypatch):
+    monkeypatch.setattr(hedge, '_records', {})
+
+
+def new_hedged(env, *apis):
+    hedged = hedge.HedgedAPI(providers=list(apis))
+    for api in apis:
+        hedged._apis[api] = env.new_provider(api).api
+    return hedged
+
+
+def requests(env):
+    return sum(env.stub.requests.get(host, 0) for host in HOSTS)
+
+
+def test_rate_is_fetched_and_then_cached(env):
+    hedged = new_hedged(env, PAIR_API, TABLE_API)
+    rate = hedged.get_exchange_rate('EUR', 'USD')
+    assert rate == pytest.approx(env.stub.rate('EUR', 'USD'), rel=1e-4)
+
+    before = requests(env)
+    assert hedged.get_exchange_rate('EUR', 'USD') == rate
+    assert requests(env) == before
+
+
+def test_cached_rate_is_answered_inline(env, monkeypatch):
+    hedged = new_hedged(env, PAIR_API, TABLE_API)
+    hedged._apis[TABLE_API].load_cache()
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError('A cached rate needs no thread pool')
+    monkeypatch.setattr(hedge, 'ThreadPoolExecutor', no_pool)
+
+    before = requests(env)
+    assert hedged.get_exchange_rate('EUR', 'USD') == \
+        pytest.approx(env.stub.rate('EUR', 'USD'), rel=1e-6)
+    assert requests(env) == before
+
+
+def test_cached_providers_are_ranked_before_unmeasured(env):
+    hedged = new_hedged(env, PAIR_API, TABLE_API)
+    hedge.get_provider_record(TABLE_API).record(0.5, True)
+    assert hedged.rank() == [PAIR_API, TABLE_API]
+
+    hedged._apis[TABLE_API].load_cache()
+    cached = hedged.get_cached_rates('EUR', 'USD')
+    assert list(cached) == [TABLE_API]
+    assert hedged.rank(cached) == [TABLE_API, PAIR_API]
+
+
+def test_unhealthy_providers_are_ranked_last(env):
+    hedged = new_hedged(env, PAIR_API, TABLE_API)
+    hedge.get_provider_record(TABLE_API).record(0.5, True)
+    for _ in range(3):
+        hedge.get_provider_record(PAIR_API).record(0.1, False)
+    assert hedged.rank() == [TABLE_API, PAIR_API]
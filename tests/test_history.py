@@ -0,0 +1,80 @@
+import os
+from datetime import date
+
+import pytest
+
+from curry.api.history import RateHistory, list_bases
+
+
+@pytest.fixture
+def history(tmp_path):
+    return RateHistory('test', 'USD', str(tmp_path))
+
+
+def test_rows_are_appended(history, tmp_path):
+    assert len(history) == 0
+    assert history.get('EUR', date(2014, 10, 1)) is None
+
+    history.append(date(2014, 10, 1), {'EUR': 0.79, 'NOK': 6.45})
+    history.append(date(2014, 10, 2), {'EUR': 0.8})
+    # Rates for a date already recorded update its row.
+    history.append(date(2014, 10, 2), {'NOK': 6.5})
+
+    assert len(history) == 2
+    assert history.currencies() == ['EUR', 'NOK']
+    assert list_bases('test', str(tmp_path)) == ['USD']
+    assert history.row(date(2014, 10, 2)) == \
+        (date(2014, 10, 2), {'EUR': 0.8, 'NOK': 6.5})
+    assert history.get('EUR', date(2014, 10, 5)) == (date(2014, 10, 2), 0.8)
+    assert history.get('EUR', date(2014, 9, 30)) is None
+    assert history.has_date(date(2014, 10, 1))
+    assert not history.has_date(date(2014, 10, 3))
+
+
+def test_new_currency_is_unknown_on_earlier_rows(history):
+    history.append(date(2014, 10, 1), {'EUR': 0.79})
+    history.append(date(2014, 10, 2), {'EUR': 0.8, 'SEK': 7.2})
+    assert history.row(date(2014, 10, 1)) == \
+        (date(2014, 10, 1), {'EUR': 0.79})
+    assert history.get('SEK', date(2014, 10, 1)) is None
+
+
+def test_out_of_order_backfill(history):
+    history.append(date(2014, 10, 10), {'EUR': 0.8})
+    history.append(date(2014, 10, 20), {'EUR': 0.82})
+    history.extend([(date(2014, 10, 15), {'EUR': 0.81, 'NOK': 6.5}),
+                    (date(2014, 10, 1), {'EUR': 0.79}),
+                    (date(2014, 10, 10), {'NOK': 6.4})])
+
+    assert len(history) == 4
+    assert history.range('EUR') == [(date(2014, 10, 1), 0.79),
+                                    (date(2014, 10, 10), 0.8),
+                                    (date(2014, 10, 15), 0.81),
+                                    (date(2014, 10, 20), 0.82)]
+    assert history.range('NOK') == [(date(2014, 10, 10), 6.4),
+                                    (date(2014, 10, 15), 6.5)]
+    assert history.get('NOK', date(2014, 10, 25)) == \
+        (date(2014, 10, 15), 6.5)
+    assert not [name for name in os.listdir(history.path)
+                if '.tmp' in name]
+
+
+def test_range_reads(history):
+    rows = [(date(2014, 10, day), {'EUR': 0.7 + day / 100})
+            for day in range(1, 31)]
+    history.extend(rows)
+
+    assert history.range('EUR', date(2014, 10, 5), date(2014, 10, 7)) == \
+        [(date(2014, 10, day), pytest.approx(0.7 + day / 100))
+         for day in (5, 6, 7)]
+    assert len(history.range('EUR', end=date(2014, 10, 10))) == 10
+    assert len(history.range('EUR', start=date(2014, 10, 25))) == 6
+    assert history.range('EUR', date(2014, 11, 1)) == []
+    assert history.range('NOK') == []
+
+
+def test_lookups_scan_back_over_unknown_rates(history):
+    history.append(date(2014, 1, 1), {'EUR': 0.75})
+    history.extend([(date.fromordinal(date(2014, 1, 2).toordinal() + i),
+                     {'NOK': 6.0}) for i in range(200)])
+    assert history.get('EUR', date(2015, 1, 1)) == (date(2014, 1, 1), 0.75)
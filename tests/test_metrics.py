@@ -0,0 +1,56 @@
+import threading
+
+from curry.api.metrics import Metrics, CACHE_EVENTS
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_counts_of_finished_threads_are_kept():
+    metrics = Metrics()
+    run_threads(300, lambda: metrics.record_cache('p', 'hit'))
+    metrics.record_cache('p', 'miss')
+
+    assert metrics.cache == {'p': dict(dict.fromkeys(CACHE_EVENTS, 0),
+                                       hit=300, miss=1)}
+    assert len(metrics._cache_counts) <= 2
+
+
+def test_concurrent_recording_and_reading():
+    metrics = Metrics()
+    rounds, threads, lookups = 20, 8, 500
+    done = threading.Event()
+    errors = []
+
+    def record():
+        for i in range(lookups):
+            metrics.record_cache('p{}'.format(i % 3), CACHE_EVENTS[i % 5])
+
+    def read():
+        while not done.is_set():
+            try:
+                metrics.snapshot()
+                metrics.to_prometheus()
+            except Exception as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        # Threads come and go while the reader sums up their counts.
+        for _ in range(rounds):
+            run_threads(threads, record)
+    finally:
+        done.set()
+        reader.join()
+
+    assert not errors
+    cache = metrics.cache
+    assert sum(sum(events.values()) for events in cache.values()) == \
+        rounds * threads * lookups
+    assert cache['p0']['hit'] == rounds * threads * len(range(0, lookups, 15))
@@ -0,0 +1,95 @@
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+from curry.money import (ROUNDING_MODES, to_minor, format_minor,
+                         convert_minor, convert_many, rounding_mode,
+                         exact_rate)
+
+
+@pytest.mark.parametrize('amount, code, minor', [
+    (12.34, 'USD', 1234),
+    ('12.34', 'USD', 1234),
+    (Decimal('12.34'), 'USD', 1234),
+    (12, 'USD', 1200),
+    (1234, 'JPY', 1234),
+    ('1.234', 'BHD', 1234),
+    (0.1 + 0.2, 'EUR', 30),
+])
+def test_to_minor(amount, code, minor):
+    assert to_minor(amount, code) == minor
+
+
+@pytest.mark.parametrize('minor, code, text', [
+    (1234, 'USD', '12.34'),
+    (-5, 'USD', '-0.05'),
+    (1234, 'JPY', '1234'),
+    (1234, 'BHD', '1.234'),
+])
+def test_format_minor(minor, code, text):
+    assert format_minor(minor, code) == text
+
+
+@pytest.mark.parametrize('mode, cents', [
+    ('half_even', [0, 2, -2]), ('half_up', [1, 2, -2]),
+    ('half_down', [0, 1, -1]), ('up', [1, 2, -2]), ('down', [0, 1, -1]),
+    ('ceiling', [1, 2, -1]), ('floor', [0, 1, -2]),
+])
+def test_rounding_modes(mode, cents):
+    # Half a cent, one and a half, and minus one and a half.
+    assert [convert_minor(amount, 0.5, 'EUR', 'USD', mode)
+            for amount in (1, 3, -3)] == cents
+
+
+def test_unknown_rounding_mode():
+    with pytest.raises(ValueError):
+        rounding_mode('banker')
+
+
+def test_convert_is_exact(stub):
+    rate = stub.rate('EUR', 'JPY')
+    assert convert_minor(to_minor('0.10', 'EUR'), rate, 'EUR', 'JPY') == \
+        round(Decimal(str(rate)) * Decimal('0.10'))
+    # Sums of converted amounts do not drift, as floats would.
+    assert sum(convert_minor(10, 1.0, 'EUR', 'USD')
+               for _ in range(1000)) == 10000
+
+
+@pytest.mark.parametrize('amount, rate, transaction, payment, text', [
+    (100000000, 1 / 24000, 'VND', 'USD', '4166.67'),
+    (10 ** 9, 7.3123456e-6, 'IRR', 'KWD', '7312.346'),
+    (1, 123456.789, 'USD', 'VND', '123457'),
+])
+def test_small_and_large_rates_keep_their_precision(
+        amount, rate, transaction, payment, text):
+    minor = convert_minor(to_minor(amount, transaction), rate, transaction,
+                          payment)
+    assert format_minor(minor, payment) == text
+
+
+def test_exact_rate():
+    assert exact_rate(8.4) == Fraction(42, 5)
+    assert exact_rate(1 / 3) == Fraction(333333333333333, 10 ** 15)
+    with pytest.raises(ValueError):
+        exact_rate(0)
+
+
+@pytest.mark.parametrize('mode', ROUNDING_MODES)
+def test_convert_many_matches_convert_minor(stub, mode):
+    np = pytest.importorskip('numpy')
+    rate = stub.rate('USD', 'NOK')
+    amounts = np.arange(-5000, 5000, 7, dtype=np.int64)
+    expected = [convert_minor(int(a), rate, 'USD', 'NOK', mode)
+                for a in amounts]
+    assert convert_many(amounts, rate, 'USD', 'NOK', mode).tolist() == \
+        expected
+    assert convert_many(amounts.tolist(), rate, 'USD', 'NOK', mode) == \
+        expected
+    # A short rate is converted in int64, and amounts large enough to
+    # overflow it in exact integers.
+    assert convert_many(amounts, 8.4, 'USD', 'NOK', mode).tolist() == \
+        [convert_minor(int(a), 8.4, 'USD', 'NOK', mode) for a in amounts]
+    large = np.array([2 ** 62, -2 ** 62], dtype=np.int64)
+    assert convert_many(large, 1.5, 'USD', 'USD', mode).tolist() == \
+        [convert_minor(int(a), 1.5, 'USD', 'USD', mode) for a in large]
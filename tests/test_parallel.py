@@ -0,0 +1,50 @@
+import io
+
+import pytest
+
+from curry.batch import read_rows, convert_rows, write_rows
+from curry.parallel import SharedRates, split_file, convert_file
+
+API = 'finance.yahoo.com'
+TABLE_API = 'openexchangerates.org'
+
+
+def test_split_file_ends_ranges_after_newlines(tmp_path):
+    path = tmp_path / 'rows.csv'
+    path.write_bytes(b'header\n' + b'EUR,USD,1\n' * 100)
+    ranges = list(split_file(str(path), 64, start=7))
+    assert ranges[0][0] == 7 and ranges[-1][1] == path.stat().st_size
+    assert all(end == start for (_, end), (start, _) in
+               zip(ranges, ranges[1:]))
+    data = path.read_bytes()
+    assert all(data[end - 1:end] == b'\n' for _, end in ranges)
+
+
+def test_shared_rates_cross_rates():
+    rates = SharedRates(pairs={('EUR', 'USD'): 1.25}, base='USD',
+                        rates={'NOK': 6.5, 'EUR': 0.8})
+    assert rates.get('EUR', 'USD') == 1.25
+    assert rates.get('EUR', 'NOK') == pytest.approx(6.5 / 0.8)
+    assert rates.get('EUR', 'QQQ') is None
+
+
+@pytest.mark.parametrize('api', [API, TABLE_API])
+def test_parallel_matches_sequential(env, tmp_path, api):
+    lines = ['{},{},{}'.format(t, p, i) for i in range(2000)
+             for t, p in [('EUR', 'USD'), ('USD', 'QQQ'), ('NOK', 'GBP')]]
+    path = tmp_path / 'rows.csv'
+    path.write_text('from,to,amount\n' + '\n'.join(lines) + '\n')
+
+    output, skipped = io.StringIO(), {}
+    count = convert_file(str(path), output, env.new_provider(api), jobs=2,
+                         header=[], chunk_size=4096, skipped=skipped)
+
+    expected, expected_skipped = io.StringIO(), {}
+    with open(str(path)) as f:
+        f.readline()
+        expected_count = write_rows(
+            convert_rows(read_rows(f), env.new_provider(api),
+                         skipped=expected_skipped), expected, header=[])
+    assert (count, output.getvalue(), skipped) == \
+        (expected_count, expected.getvalue(), expected_skipped)
+    assert skipped == {('USD', 'QQQ'): 2000}
@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+
+from conftest import wait_for
+from curry.api import RateLimitError
+from curry.api import scheduler
+from curry.api.scheduler import (Scheduler, Ledger, INTERACTIVE, BACKGROUND,
+                                 parse_rate_limit)
+
+
+class FakeClock:
+    """Stands in for the time module of the scheduler."""
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, 'time', clock)
+    return clock
+
+
+def new_scheduler(tmp_path, capacity=10, reserve=0, max_wait=0):
+    ledger = Ledger(str(tmp_path / 'ledger'), 1.0, capacity)
+    return Scheduler('test', ledger, reserve, max_wait)
+
+
+def test_parse_rate_limit():
+    assert parse_rate_limit('1000/month') == (1000, 60 * 60 * 24 * 30)
+    assert parse_rate_limit('5/seconds') == (5, 1)
+    assert parse_rate_limit('2') == (2, 1)
+    with pytest.raises(ValueError):
+        parse_rate_limit('5/fortnight')
+    with pytest.raises(ValueError):
+        parse_rate_limit('0/day')
+
+
+def test_rate_limit_is_raised_once_the_tokens_run_out(tmp_path, clock):
+    s = new_scheduler(tmp_path, capacity=3)
+    for _ in range(3):
+        s.acquire(INTERACTIVE)
+    with pytest.raises(RateLimitError, match='1.0s'):
+        s.acquire(INTERACTIVE)
+
+    clock.advance(1)
+    s.acquire(INTERACTIVE)
+    with pytest.raises(RateLimitError):
+        s.acquire(INTERACTIVE)
+
+
+def test_background_requests_leave_the_reserve(tmp_path, clock):
+    s = new_scheduler(tmp_path, capacity=10, reserve=0.2)
+    for _ in range(8):
+        s.acquire(BACKGROUND)
+    with pytest.raises(RateLimitError):
+        s.acquire(BACKGROUND)
+
+    for _ in range(2):
+        s.acquire(INTERACTIVE)
+    with pytest.raises(RateLimitError):
+        s.acquire(INTERACTIVE)
+
+
+def test_backoff_holds_back_requests(tmp_path, clock):
+    s = new_scheduler(tmp_path)
+    s.backoff(30)
+    with pytest.raises(RateLimitError, match='30.0s'):
+        s.acquire(INTERACTIVE)
+    clock.advance(30)
+    with pytest.raises(RateLimitError):
+        s.acquire(INTERACTIVE)
+    clock.advance(1)
+    s.acquire(INTERACTIVE)
+
+
+def test_interactive_requests_go_ahead_of_background(tmp_path, clock):
+    s = new_scheduler(tmp_path, max_wait=60)
+    s.ledger.drain()
+    served = []
+
+    def request(level):
+        s.acquire(level)
+        served.append(level)
+
+    threads = []
+    for level in (BACKGROUND, INTERACTIVE):
+        thread = threading.Thread(target=request, args=(level,))
+        thread.start()
+        threads.append(thread)
+        assert wait_for(lambda: len(s._queue) == len(threads))
+
+    def release_token():
+        clock.advance(1)
+        with s._condition:
+            s._condition.notify_all()
+
+    release_token()
+    assert wait_for(lambda: served == [INTERACTIVE])
+    assert s._queue == [(BACKGROUND, 0)]
+    release_token()
+    assert wait_for(lambda: served == [INTERACTIVE, BACKGROUND])
+    for thread in threads:
+        thread.join()
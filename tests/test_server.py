@@ -0,0 +1,113 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from conftest import wait_for
+from curry.client import DaemonClient, FallbackProvider
+from curry.money import to_minor, format_minor, convert_minor
+from curry.server import ConversionService, _UnixServer, _UnixHandler
+
+API = 'finance.yahoo.com'
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.fixture
+def daemon(tmp_path, env):
+    server = _UnixServer(str(tmp_path / 'curry.sock'), _UnixHandler)
+    server.service = ConversionService()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def connect(daemon):
+    return DaemonClient.connect(daemon.server_address, api=API)
+
+
+def test_result_is_converted_exactly(daemon):
+    with connect(daemon) as client:
+        answer = client.request({'from': 'eur', 'to': 'jpy',
+                                 'amount': '10.005'})
+    minor = convert_minor(to_minor('10.005', 'EUR'), answer['rate'], 'EUR',
+                          'JPY')
+    assert answer['result'] == format_minor(minor, 'JPY')
+
+
+def test_missing_rate_is_an_error(daemon):
+    answer = daemon.service.handle({'api': API, 'from': 'EUR', 'to': 'QQQ'})
+    assert 'error' in answer
+    assert 'result' not in answer
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'),
+                    reason='needs /proc/self/fd')
+def test_clients_do_not_leak_fds(daemon):
+    def convert():
+        with connect(daemon) as client:
+            assert client.get_exchange_rate('EUR', 'USD') > 0
+
+    threads = threading.active_count()
+    convert()
+    assert wait_for(lambda: threading.active_count() <= threads)
+    before = open_fds()
+    for _ in range(100):
+        convert()
+    assert wait_for(lambda: open_fds() <= before + 2), \
+        '{} fds open, {} before'.format(open_fds(), before)
+
+
+def test_fallback_when_daemon_fails(daemon, stub):
+    from curry.api import Provider
+
+    client = connect(daemon)
+    provider = FallbackProvider(client, Provider(api=API))
+    assert provider.get_exchange_rate('EUR', 'USD') > 0
+    assert not provider.failed
+
+    client.sock.shutdown(socket.SHUT_RDWR)
+    assert provider.get_exchange_rate('EUR', 'USD') == \
+        pytest.approx(stub.rate('EUR', 'USD'), rel=1e-3)
+    assert provider.failed
+    client.close()
+
+
+def test_batch_asks_the_daemon_once(daemon, stub, monkeypatch):
+    from curry.api import Provider
+    from curry.batch import convert_rows
+
+    client = connect(daemon)
+    requests = []
+    request = client.request
+
+    def counted(r):
+        requests.append(r)
+        return request(r)
+    monkeypatch.setattr(client, 'request', counted)
+
+    rows = [('EUR', 'USD', 1.0, []), ('EUR', 'NOK', 2.0, []),
+            ('EUR', 'QQQ', 3.0, []), ('EUR', 'USD', 4.0, [])]
+    skipped = {}
+    provider = FallbackProvider(client, Provider(api=API))
+    converted = list(convert_rows(rows, provider, skipped=skipped))
+    assert len(requests) == 1
+    assert requests[0]['pairs'] == [['EUR', 'USD'], ['EUR', 'NOK'],
+                                    ['EUR', 'QQQ']]
+    assert [row[2] for row in converted] == [1.0, 2.0, 4.0]
+    assert converted[0][3] == pytest.approx(stub.rate('EUR', 'USD'),
+                                            rel=1e-3)
+    assert skipped == {('EUR', 'QQQ'): 1}
+
+    # Converted in this process once the daemon fails.
+    client.sock.shutdown(socket.SHUT_RDWR)
+    converted = list(convert_rows([('USD', 'NOK', 1.0, [])], provider))
+    assert provider.failed
+    assert converted[0][3] == pytest.approx(stub.rate('USD', 'NOK'),
+                                            rel=1e-3)
+    client.close()
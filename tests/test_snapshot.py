@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from curry.api.snapshot import (RateSnapshot, write_snapshot, open_snapshot,
+                                snapshot_path, HEADER)
+
+TABLE_API = 'openexchangerates.org'
+RATES = {'EUR': 0.8, 'NOK': 6.5, 'JPY': 110.25, 'XAU': None, 'ZZZZ': 1.0}
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'test.snapshot')
+    write_snapshot(path, 'USD', RATES, {'EUR': 1.25, 'NOK': 1 / 6.5},
+                   timestamp=1000.5)
+    with RateSnapshot(path) as snapshot:
+        assert snapshot.base == 'USD'
+        assert snapshot.timestamp == 1000.5
+        assert snapshot.keys() == ['EUR', 'JPY', 'NOK']
+        assert snapshot.to_dict() == {'EUR': 0.8, 'JPY': 110.25, 'NOK': 6.5}
+        assert snapshot['NOK'] == 6.5
+        assert snapshot.get('SEK') is None
+        assert 'XAU' not in snapshot
+        with pytest.raises(KeyError):
+            snapshot['SEK']
+        assert snapshot.get_inverse('EUR') == 1.25
+        assert snapshot.get_inverse('JPY') is None
+
+
+def test_snapshot_without_inverse_rates(tmp_path):
+    path = str(tmp_path / 'test.snapshot')
+    write_snapshot(path, 'USD', {'EUR': 0.8})
+    with RateSnapshot(path) as snapshot:
+        assert not snapshot.has_inverse
+        assert snapshot.get_inverse('EUR') is None
+        assert len(snapshot) == 1
+
+
+def test_replaced_snapshot_is_reopened(tmp_path):
+    directory = str(tmp_path)
+    write_snapshot(snapshot_path('test', directory), 'USD', {'EUR': 0.8})
+    snapshot = open_snapshot('test', directory)
+    assert open_snapshot('test', directory) is snapshot
+
+    write_snapshot(snapshot_path('test', directory), 'USD',
+                   {'EUR': 0.9, 'NOK': 6.5})
+    assert open_snapshot('test', directory)['EUR'] == 0.9
+    # The old mapping stays valid.
+    assert snapshot['EUR'] == 0.8
+
+
+@pytest.mark.parametrize('damage', ['empty', 'header', 'rates', 'magic'])
+def test_damaged_snapshot_is_not_opened(tmp_path, damage):
+    directory = str(tmp_path)
+    path = snapshot_path('test', directory)
+    write_snapshot(path, 'USD', RATES, {'EUR': 1.25})
+    with open(path, 'r+b') as f:
+        if damage == 'magic':
+            f.write(b'XXXX')
+        else:
+            size = {'empty': 0, 'header': HEADER.size - 1,
+                    'rates': os.path.getsize(path) - 8}[damage]
+            f.truncate(size)
+
+    with pytest.raises(ValueError):
+        RateSnapshot(path)
+    assert open_snapshot('test', directory) is None
+
+
+def test_truncated_snapshot_falls_back_to_the_cache(env):
+    provider = env.new_provider(TABLE_API)
+    rate = provider.get_exchange_rate('EUR', 'USD')
+    path = snapshot_path(TABLE_API, provider.api.snapshot_dir)
+    with open(path, 'r+b') as f:
+        f.truncate(HEADER.size + 4)
+
+    before = env.stub.requests.get(TABLE_API, 0)
+    assert before
+    assert provider.get_exchange_rate('EUR', 'USD') == rate
+    assert env.stub.requests.get(TABLE_API, 0) == before
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from curry.api import RequestError
+from curry.api.transport import Transport
+
+
+def test_connections_are_reused(stub):
+    url = '{}/openexchangerates.org/api/latest.json?app_id=x'.format(stub.url)
+    transport = Transport()
+    try:
+        for _ in range(5):
+            assert transport.get(url).status_code == 200
+        pools = transport.session.get_adapter(url).poolmanager.pools
+        assert [(pools[key].num_connections, pools[key].num_requests)
+                for key in pools.keys()] == [(1, 5)]
+    finally:
+        transport.close()
+
+
+def test_read_timeout():
+    from stubs import StubServer
+
+    with StubServer(latency=1) as slow:
+        # The answer comes after the client has gone.
+        slow.server.handle_error = lambda request, client_address: None
+        transport = Transport(read_timeout=0.1)
+        try:
+            start = time.perf_counter()
+            with pytest.raises(RequestError):
+                transport.get('{}/openexchangerates.org/api/latest.json'
+                              .format(slow.url))
+            assert time.perf_counter() - start < 0.9
+        finally:
+            transport.close()
+
+
+def test_connect_error_is_a_request_error():
+    transport = Transport(connect_timeout=0.5)
+    try:
+        # Nothing listens on the discard port.
+        with pytest.raises(RequestError):
+            transport.get('http://127.0.0.1:9/')
+    finally:
+        transport.close()
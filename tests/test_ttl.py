@@ -0,0 +1,83 @@
+import pytest
+
+from curry.config import config
+from curry.api.ttl import next_ttl, ttl_bounds, rate_tolerance
+
+OPTIONS = ['adaptive_ttl', 'rate_tolerance', 'min_cache_timeout',
+           'max_cache_timeout']
+
+
+@pytest.fixture
+def options():
+    section = config.config['curry']
+
+    def set_options(**values):
+        for key, value in values.items():
+            section[key] = str(value)
+
+    set_options(adaptive_ttl=1, rate_tolerance=0.003,
+                min_cache_timeout=600, max_cache_timeout=86400)
+    yield set_options
+    for key in OPTIONS:
+        section.pop(key, None)
+
+
+T = 1413000000.0
+
+
+def entry(rate, timestamp, ttl=None):
+    return {'rate': rate, 'timestamp': T + timestamp, 'ttl': ttl}
+
+
+def test_not_adaptive_when_off(options):
+    options(adaptive_ttl=0)
+    assert next_ttl('EUR', 'USD', 1.25, T + 1000.0) is None
+
+
+def test_options(options):
+    assert rate_tolerance() == 0.003
+    assert ttl_bounds() == (600, 86400)
+    # The maximum is never below the minimum.
+    options(max_cache_timeout=300)
+    assert ttl_bounds() == (600, 600)
+
+
+def test_first_timeout_is_the_cache_timeout(options):
+    assert next_ttl('EUR', 'USD', 1.25, T + 1000.0) == 43200
+    options(min_cache_timeout=50000)
+    assert next_ttl('EUR', 'USD', 1.25, T + 1000.0) == 50000
+
+
+def test_timeout_grows_while_the_rate_is_still(options):
+    previous = entry(1.25, 0.0, 3600)
+    ttl = next_ttl('EUR', 'USD', 1.25, T + 3600.0, previous)
+    assert ttl > 3600
+    assert next_ttl('EUR', 'USD', 1.25, T + 3600.0 + ttl,
+                    entry(1.25, 3600.0, ttl)) > ttl
+
+
+def test_timeout_shrinks_when_the_rate_moves(options):
+    previous = entry(1.25, 0.0, 3600)
+    # A move within the tolerance still lets it grow.
+    assert next_ttl('EUR', 'USD', 1.25 * 1.001, T + 3600.0, previous) > 3600
+    small = next_ttl('EUR', 'USD', 1.25 * 1.005, T + 3600.0, previous)
+    large = next_ttl('EUR', 'USD', 1.25 * 1.01, T + 3600.0, previous)
+    assert large < small < 3600
+    # Falls the same for moves up and down.
+    assert next_ttl('EUR', 'USD', 1.25 / 1.01, T + 3600.0, previous) == \
+        pytest.approx(large, rel=0.05)
+
+
+def test_timeout_is_clamped(options):
+    assert next_ttl('EUR', 'USD', 2.5, T + 3600.0,
+                    entry(1.25, 0.0, 3600)) == 600
+    assert next_ttl('EUR', 'USD', 1.25, T + 80000.0,
+                    entry(1.25, 0.0, 80000)) == 86400
+
+
+def test_invalid_rates_keep_the_last_timeout(options):
+    previous = entry(1.25, 0.0, 7200)
+    assert next_ttl('EUR', 'USD', None, T + 3600.0, previous) == 7200
+    assert next_ttl('EUR', 'USD', 1.25, T, previous) == 7200
+    assert next_ttl('EUR', 'USD', 1.25, T + 3600.0,
+                    entry(1.25, 0.0, 10 ** 6)) == 86400
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from curry.api import APIError
+
+API = 'finance.yahoo.com'
+PAIRS = [('AUD', 'NZD'), ('EUR', 'USD'), ('GBP', 'JPY')]
+
+
+def requests(env):
+    return env.stub.requests.get('download.finance.yahoo.com', 0)
+
+
+def test_pairs_are_quoted_in_one_request(env):
+    provider = env.new_provider(API)
+    before = requests(env)
+    rates = provider.api.get_exchange_rates(PAIRS)
+    assert requests(env) == before + 1
+    assert rates == {pair: pytest.approx(env.stub.rate(*pair), rel=1e-6)
+                     for pair in PAIRS}
+
+
+def test_requests_are_split_to_fit_the_url(env):
+    provider = env.new_provider(API)
+    # Room for one symbol per request.
+    provider.api.max_url_length = len(provider.api.bulk_url.format('')) + 10
+    assert len(provider.api.chunk_pairs(PAIRS)) == 3
+    before = requests(env)
+    assert len(provider.api.get_exchange_rates(PAIRS)) == 3
+    assert requests(env) == before + 3
+
+
+def test_rates_found_are_kept_when_a_pair_fails(env):
+    provider = env.new_provider(API)
+    with pytest.raises(APIError, match='EUR/QQQ'):
+        provider.api.get_exchange_rates([('AUD', 'NZD'), ('EUR', 'QQQ')])
+
+    before = requests(env)
+    assert provider.get_exchange_rate('AUD', 'NZD') == \
+        pytest.approx(env.stub.rate('AUD', 'NZD'), rel=1e-6)
+    assert requests(env) == before
+
+
+def test_async_rates_found_are_kept_when_a_pair_fails(env):
+    from curry.api.aio import AsyncProvider
+
+    provider = AsyncProvider(api=API)
+    provider.api.cache_backend = env.new_cache()
+    with pytest.raises(APIError, match='EUR/QQQ'):
+        asyncio.run(provider.get_exchange_rates([('AUD', 'NZD'),
+                                                 ('EUR', 'QQQ')]))
+
+    before = requests(env)
+    assert asyncio.run(provider.get_exchange_rate('AUD', 'NZD')) == \
+        pytest.approx(env.stub.rate('AUD', 'NZD'), rel=1e-6)
+    assert requests(env) == before